@@ -0,0 +1,91 @@
+import argparse
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.calculate_rhoR import load_shot_parameters, nif_analysis_parameters
+from src.rhoR_Analysis import rhoR_Analysis
+
+# the measured energies at which to do the analysis by default (MeV)
+ENERGIES = np.linspace(6, 13, 5)
+
+
+def analyze_sensitivity(name: str, parameters: dict[str, Any], energies: np.ndarray, samples: Optional[int],
+                        workers: Optional[int], seed: Optional[int]) -> pd.DataFrame:
+	""" compute the Sobol indices of every parameter of a ρR analysis and print the biggest ones
+	    :param name: a label for this case in the output
+	    :param parameters: the keyword arguments for rhoR_Analysis
+	    :param energies: the measured energies at which to do it (MeV)
+	    :param samples: the number of base samples, or None for the rhoR_Analysis default
+	    :param workers: the number of processes to use, or None for one per CPU
+	    :param seed: the random seed, for reproducibility
+	    :return: a table with a row for each energy and parameter
+	"""
+	analysis = rhoR_Analysis(**parameters, backend="numpy", lazy=True, workers=workers)
+	result = analysis.Calc_Sobol_Indices(energies, samples=samples, seed=seed)
+	print(f"{name}: {result['evaluations']} evaluations in {result['time']:.1f} s")
+
+	rows = []
+	for j, energy in enumerate(result["E1"]):
+		print(f"  at {energy:.2f} MeV, ρR = {result['mean'][j]*1e3:.1f} ± {np.sqrt(result['variance'][j])*1e3:.1f} "
+		      f"mg/cm^2 ({result['valid fraction'][j]:.0%} of samples valid)")
+		order = np.argsort(-result["total"][:, j])
+		for i in order[:5]:
+			print(f"    {result['parameters'][i]:>20s}: first order {result['first order'][i, j]:6.3f} "
+			      f"± {result['first order error'][i, j]:.3f}, total {result['total'][i, j]:6.3f} "
+			      f"± {result['total error'][i, j]:.3f}")
+		for i, parameter in enumerate(result["parameters"]):
+			rows.append({"case": name, "energy (MeV)": energy, "parameter": parameter,
+			             "first order index": result["first order"][i, j],
+			             "first order index unc.": result["first order error"][i, j],
+			             "total index": result["total"][i, j],
+			             "total index unc.": result["total error"][i, j],
+			             "rhoR mean (mg/cm^2)": result["mean"][j]*1e3,
+			             "rhoR std (mg/cm^2)": np.sqrt(result["variance"][j])*1e3})
+	return pd.DataFrame(rows)
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		prog="python analyze_rhoR_sensitivity.py",
+		description="work out which model parameters drive the uncertainty in the inferred ρR, including their "
+		            "interactions, with a variance-based (Sobol) sensitivity analysis, and save the indices to a CSV "
+		            "file.")
+	parser.add_argument("shots", type=str, nargs="*",
+	                    help="NIF shot numbers from shot_info.csv (like N210808-001); by default, just the "
+	                         "rhoR_Analysis default parameters")
+	parser.add_argument("--energies", type=str, default=None,
+	                    help=f"the measured energies in MeV, separated by commas (by default "
+	                         f"{', '.join(f'{energy:g}' for energy in ENERGIES)})")
+	parser.add_argument("--samples", type=int, default=None,
+	                    help=f"the number of base samples, which gets rounded up to a power of two (by default "
+	                         f"{rhoR_Analysis.sobol_samples})")
+	parser.add_argument("--workers", type=int, default=None,
+	                    help="the number of processes to use (by default one per CPU)")
+	parser.add_argument("--seed", type=int, default=None,
+	                    help="the random seed, for reproducibility")
+	parser.add_argument("--output", type=str, default="rhoR_sensitivity.csv",
+	                    help="the CSV file to save the indices to")
+	args = parser.parse_args()
+
+	energies = ENERGIES if args.energies is None else np.array([float(energy) for energy in args.energies.split(",")])
+	cases = {}
+	if len(args.shots) == 0:
+		cases["defaults"] = {}
+	for shot_number in args.shots:
+		try:
+			cases[shot_number] = nif_analysis_parameters(load_shot_parameters(shot_number))
+		except KeyError as e:
+			parser.error(f"the {e} for {shot_number} isn't in shot_info.csv")
+		except ValueError as e:
+			parser.error(str(e))
+
+	tables = [analyze_sensitivity(name, parameters, energies, args.samples, args.workers, args.seed)
+	          for name, parameters in cases.items()]
+	pd.concat(tables).to_csv(args.output, index=False)
+	print(f"saved the indices to `{args.output}`")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from src import calculate_rhoR, model_bank, model_cache, stopping_power_tables
+from src.Material import __material_rho__
+from src.rhoR_Analysis import rhoR_Analysis
+from src.rhoR_Model import DoubleVector, rhoR_Model
+
+# where the results go, one JSON file per run
+RESULTS_DIRECTORY = "benchmarks"
+# changes in the median time smaller than this factor are reported as noise
+SIGNIFICANT_CHANGE = 1.10
+
+# the OMEGA analysis takes the shell conditions on the command line, so there's nothing in shot_info.csv for it
+OMEGA_SHELL_DENSITY = 20.  # (g/cm^3)
+OMEGA_SHELL_TEMPERATURE = 0.3  # (keV)
+# hohlraum stacks like the ones in data/*/hohlraum.txt
+HOHLRAUM_STACKS = [
+	[(8., "Au")],
+	[(31., "U")],
+	[(40., "Au"), (60., "Al")],
+	[(31., "U"), (205., "Al")],
+	[(150., "U"), (200., "Al")],
+]
+# the parameters to vary for the shared-stage case, by their position in default_model_parameters(), which between
+# them leave the gas, the gas and shell, or nothing upstream of the ablated mass to share
+STAGE_PERTURBATIONS = {"Te_Gas": 6, "Te_Shell": 7, "Te_Abl": 8, "rho_Abl_Max": 10, "rho_Abl_Scale": 12}
+# the measured energies to query (MeV)
+QUERY_ENERGY = (10., 0.1, 0.1)
+NUM_QUERY_ENERGIES = 1000
+
+
+def benchmark(repeat: int, backend: Optional[str], quick: bool) -> dict[str, Any]:
+	""" time every stage of the ρR calculation for a representative set of cases.  everything runs with a fresh model
+	    cache, so that it measures the calculations and not the disk.
+	    :param repeat: the number of times to time each case
+	    :param backend: the stopping power backend to use, or None for the default
+	    :param quick: whether to do just one material and one shot instead of all of them
+	    :return: the results, ready to be written to JSON
+	"""
+	materials = ["CH"] if quick else list(__material_rho__.keys())
+	shots = {shot_number: {**params, "stopping power backend": backend}
+	         for shot_number, params in calculate_rhoR.load_representative_shots().items()}
+	if quick:
+		shots = dict(list(shots.items())[:1])
+	stacks = HOHLRAUM_STACKS[:1] if quick else HOHLRAUM_STACKS
+
+	results: dict[str, Any] = {}
+	original_cache_directory = model_cache.CACHE_DIRECTORY
+	with tempfile.TemporaryDirectory() as cache_directory:
+		model_cache.CACHE_DIRECTORY = cache_directory
+		try:
+			# standalone models, for every stopping power model and shell material
+			for dEdx_model in rhoR_Model.dEdx_models_avail:
+				for material in materials:
+					name = f"{dEdx_model}/{material}"
+					parameters = default_model_parameters(material)
+					build = lambda: rhoR_Model(*parameters, dEdx_model=dEdx_model, backend=backend, cache=False)
+					results[f"model/{name}"] = time_case(build, repeat, setup=clear_caches)
+					if "error" in results[f"model/{name}"]:
+						continue
+					model = build()
+					energies = np.linspace(5, 14, NUM_QUERY_ENERGIES)
+					results[f"model_Calc_rhoR_scalar/{name}"] = time_case(
+						lambda: model.Calc_rhoR(QUERY_ENERGY[0]), repeat)
+					results[f"model_Calc_rhoR_array/{name}"] = time_case(
+						lambda: model.Calc_rhoR(energies), repeat)
+
+			# a model and its perturbations, like the varied models of an analysis, with and without sharing stages
+			for material in materials:
+				for share in [True, False]:
+					name = f"{'shared' if share else 'unshared'}_stages/{material}"
+					results[name] = time_case(lambda: build_perturbed_models(material, backend, share), repeat)
+				if "error" not in results[f"shared_stages/{material}"]:
+					shared = build_perturbed_models(material, backend, True)
+					unshared = build_perturbed_models(material, backend, False)
+					results[f"shared_stages/{material}"]["identical"] = all(
+						np.array_equal(a, b) for table_a, table_b in zip(shared, unshared)
+						for a, b in zip(table_a, table_b))
+
+			# full NIF analyses, thru the same function that make_plots_from_analysis uses
+			for shot_number, params in shots.items():
+				analyze = lambda: calculate_rhoR.calculate_rhoR(QUERY_ENERGY, shot_number, params)
+				results[f"analysis/{shot_number}"] = time_case(analyze, repeat, setup=clear_caches)
+				results[f"analysis_from_disk_cache/{shot_number}"] = time_case(
+					analyze, repeat, setup=clear_memory)
+				results[f"analysis_Calc_rhoR/{shot_number}"] = time_case(analyze, repeat)
+
+			# the OMEGA uniform-plasma analysis
+			for material in materials:
+				params = {"ablator material": material, "shell density": OMEGA_SHELL_DENSITY,
+				          "shell electron temperature": OMEGA_SHELL_TEMPERATURE, "secondary": False,
+				          "stopping power backend": backend}
+				results[f"omega/{material}"] = time_case(
+					lambda: calculate_rhoR.calculate_rhoR(QUERY_ENERGY, "O", params), repeat,
+					setup=calculate_rhoR.omega_tables.clear)
+
+			# the hohlraum correction
+			for layers in stacks:
+				name = " ".join(f"{thickness:g}{material}" for thickness, material in layers)
+				correct = lambda: calculate_rhoR.perform_hohlraum_correction(
+					layers, ((0, 0, 0), QUERY_ENERGY, (.5, .05, .05)))
+				results[f"hohlraum/{name}"] = time_case(correct, repeat)
+				results[f"hohlraum_cold/{name}"] = time_case(
+					correct, repeat, setup=stopping_power_tables.clear_tables)
+		finally:
+			clear_caches()
+			model_cache.CACHE_DIRECTORY = original_cache_directory
+
+	return {"metadata": describe_environment(repeat, backend, quick), "results": results}
+
+
+def time_case(function: Callable[[], Any], repeat: int, setup: Callable[[], Any] = lambda: None) -> dict[str, Any]:
+	""" time a function, keeping it from printing anything
+	    :param function: the thing to time
+	    :param repeat: the number of times to call it
+	    :param setup: something to call before each call, which doesn't count toward the time
+	    :return: the individual times and their summary statistics (s), or the error it raised
+	"""
+	times = []
+	for i in range(repeat):
+		setup()
+		with contextlib.redirect_stdout(io.StringIO()):
+			start = time.perf_counter()
+			try:
+				function()
+			except Exception as e:  # record why this case can't run here (like a stopping model the backend can't do)
+				return {"error": f"{type(e).__name__}: {e}"}
+			times.append(time.perf_counter() - start)
+	return {"times": times, "min": min(times), "median": statistics.median(times)}
+
+
+def clear_caches() -> None:
+	""" forget every model and table that's been built, so the next case starts cold """
+	clear_memory()
+	stopping_power_tables.clear_tables()
+	calculate_rhoR.omega_tables.clear()
+	model_cache.purge_cache()
+
+
+def clear_memory() -> None:
+	""" forget every analysis and model in memory, but leave the tables in the on-disk cache """
+	calculate_rhoR.rhoR_objects.clear()
+	model_bank.clear_bank()
+
+
+def default_model_parameters(material: str) -> tuple:
+	""" the rhoR_Analysis default parameters, in the order rhoR_Model takes them """
+	a = rhoR_Analysis
+	return (material, a.def_Ri, a.def_Ro, a.def_fD, a.def_f3He, a.def_P0,
+	        a.def_Te_Gas, a.def_Te_Shell, a.def_Te_Abl, a.def_Te_Mix,
+	        a.def_rho_Abl_Max, a.def_rho_Abl_Min, a.def_rho_Abl_Scale,
+	        a.def_f_Mix, a.def_t_Shell, a.def_f_Remain, a.def_E0)
+
+
+def build_perturbed_models(material: str, backend: Optional[str], share: bool) -> list[tuple[np.ndarray, np.ndarray]]:
+	""" build the default model for a material and two perturbations of it for each of STAGE_PERTURBATIONS
+	    :param material: the shell material
+	    :param backend: the stopping power backend to use, or None for the default
+	    :param share: whether the perturbed models should reuse the default model's stages (see rhoR_Model.__stage__)
+	                  the way rhoR_Analysis's varied models do, or each range their own protons
+	    :return: the Rcm and Eout tables of every model
+	"""
+	nominal = default_model_parameters(material)
+	models = [rhoR_Model(*nominal, backend=backend, cache=False, lazy=True)]
+	for index in STAGE_PERTURBATIONS.values():
+		for factor in [0.9, 1.1]:
+			parameters = list(nominal)
+			parameters[index] *= factor
+			model = rhoR_Model(*parameters, backend=backend, cache=False, lazy=True)
+			if share:
+				model.__stages__ = models[0].__stages__
+			models.append(model)
+	tables = []
+	for model in models:
+		model.__build_tables__()
+		tables.append((model.__RcmList__, model.__EoutList__))
+	return tables
+
+
+def describe_environment(repeat: int, backend: Optional[str], quick: bool) -> dict[str, Any]:
+	""" record everything that might make two runs' times not comparable """
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		"date": datetime.now().isoformat(timespec="seconds"),
+		"commit": commit,
+		"python": sys.version.split()[0],
+		"numpy": np.__version__,
+		"platform": platform.platform(),
+		"processor": platform.processor(),
+		"cpu count": os.cpu_count(),
+		"StopPow installed": DoubleVector is not None,
+		"backend": backend,
+		"repeat": repeat,
+		"quick": quick,
+	}
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> None:
+	""" print how each case's median time changed between two runs """
+	print(f"comparing to the run from {old['metadata']['date']} (commit {old['metadata']['commit']}):")
+	if old["metadata"]["platform"] != new["metadata"]["platform"] or \
+			old["metadata"]["StopPow installed"] != new["metadata"]["StopPow installed"]:
+		print("  (warning: these runs were on different setups, so the times may not be comparable)")
+	for name, result in new["results"].items():
+		if name not in old["results"] or "median" not in result or "median" not in old["results"][name]:
+			continue
+		ratio = result["median"]/old["results"][name]["median"]
+		if ratio > SIGNIFICANT_CHANGE:
+			verdict = "slower"
+		elif ratio < 1/SIGNIFICANT_CHANGE:
+			verdict = "faster"
+		else:
+			verdict = ""
+		print(f"  {name:50s} {old['results'][name]['median']:10.4g} s -> {result['median']:10.4g} s  "
+		      f"(×{ratio:.2f}) {verdict}")
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		prog="python benchmark_rhoR.py",
+		description="time the ρR model construction, its queries, the full NIF and OMEGA analyses, and the hohlraum "
+		            "correction, save the times to a JSON file, and compare them to the last run.")
+	parser.add_argument("--repeat", type=int, default=3,
+	                    help="the number of times to time each case (the median is what gets compared)")
+	parser.add_argument("--backend", type=str, default=None,
+	                    help="the stopping power backend ('SWIG' or 'numpy'); by default SWIG, which needs the StopPow "
+	                         "library")
+	parser.add_argument("--quick", action="store_true",
+	                    help="to only do one material, one shot, and one hohlraum instead of all of them")
+	parser.add_argument("--output", type=str, default=None,
+	                    help=f"the JSON file to save the results to (by default a new file in {RESULTS_DIRECTORY}/)")
+	parser.add_argument("--compare", type=str, default=None,
+	                    help=f"a JSON file from a previous run to compare to (by default the latest one in "
+	                         f"{RESULTS_DIRECTORY}/)")
+	args = parser.parse_args()
+
+	previous_runs = sorted(glob.glob(os.path.join(RESULTS_DIRECTORY, "benchmark_*.json")))
+	comparison_filename = args.compare if args.compare is not None else \
+		previous_runs[-1] if len(previous_runs) > 0 else None
+
+	results = benchmark(args.repeat, args.backend, args.quick)
+
+	for name, result in results["results"].items():
+		if "median" in result:
+			note = {True: "  (bit-identical)", False: "  (NOT bit-identical!)"}.get(result.get("identical"), "")
+			print(f"{name:50s} {result['median']:10.4g} s{note}")
+		else:
+			print(f"{name:50s} {result['error']}")
+
+	output_filename = args.output
+	if output_filename is None:
+		os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+		output_filename = os.path.join(
+			RESULTS_DIRECTORY, f"benchmark_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json")
+	with open(output_filename, "w", encoding="utf-8") as f:
+		json.dump(results, f, indent=2)
+	print(f"saved the results to `{output_filename}`")
+
+	if comparison_filename is not None:
+		with open(comparison_filename, encoding="utf-8") as f:
+			compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+	main()
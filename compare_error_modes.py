@@ -0,0 +1,82 @@
+import argparse
+import time
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.calculate_rhoR import load_representative_shots, nif_analysis_parameters
+from src.rhoR_Analysis import rhoR_Analysis
+
+# the measured energies at which to compare the error bars (MeV)
+ENERGIES = np.linspace(6, 14, 9)
+# error bars that differ by more than this fraction get flagged
+TOLERANCE = 0.15
+
+
+def compare_error_modes(name: str, parameters: dict[str, Any], backend: Optional[str]) -> pd.DataFrame:
+	""" set up a ρR analysis with the brute-force ('varied') and linearized ('jacobian') error modes, and compare the
+	    error bars they give on ρR, both in total and for each source of error
+	    :param name: a label for this case in the output
+	    :param parameters: the keyword arguments for rhoR_Analysis
+	    :param backend: the stopping power backend to use, or None for the default
+	    :return: a table with a row for each energy and source of error
+	"""
+	errors, setup_times = {}, {}
+	for error_mode in rhoR_Analysis.error_modes_avail:
+		start = time.perf_counter()
+		analysis = rhoR_Analysis(**parameters, backend=backend, cache=False, error_mode=error_mode)
+		setup_times[error_mode] = time.perf_counter() - start
+		rhoR, Rcm, (total, sources) = analysis.Calc_rhoR(ENERGIES, breakdown=True)
+		errors[error_mode] = {"total": total, **{source: error for source, error in sources}}
+	print(f"{name}: set up in {setup_times['varied']:.2f} s with 'varied' and {setup_times['jacobian']:.2f} s "
+	      f"with 'jacobian' (×{setup_times['varied']/setup_times['jacobian']:.1f} faster)")
+
+	rows = []
+	for source in errors["varied"].keys():
+		for i, energy in enumerate(ENERGIES):
+			varied = np.broadcast_to(errors["varied"][source], ENERGIES.shape)[i]*1e3  # convert to mg/cm^2
+			jacobian = np.broadcast_to(errors["jacobian"][source], ENERGIES.shape)[i]*1e3
+			rows.append({"case": name, "source": source, "energy (MeV)": energy,
+			             "varied error (mg/cm^2)": varied, "jacobian error (mg/cm^2)": jacobian,
+			             "ratio": jacobian/varied if varied > 0 else np.nan,
+			             "varied setup time (s)": setup_times["varied"],
+			             "jacobian setup time (s)": setup_times["jacobian"]})
+	table = pd.DataFrame(rows)
+
+	total = table[(table["source"] == "total") & table["varied error (mg/cm^2)"].notna()]
+	print(f"  the total error bars agree to within {np.nanmax(np.abs(total['ratio'] - 1)):.1%}")
+	significant = table["varied error (mg/cm^2)"] > 0.1*np.interp(
+		table["energy (MeV)"], total["energy (MeV)"], total["varied error (mg/cm^2)"])
+	disagreements = table[significant & (np.abs(table["ratio"] - 1) > TOLERANCE)]
+	for source, rows in disagreements.groupby("source", sort=False):
+		print(f"  {source} disagrees by up to {np.max(np.abs(rows['ratio'] - 1)):.1%}")
+	return table
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		prog="python compare_error_modes.py",
+		description="check rhoR_Analysis's linearized error mode against the brute-force one, for the default "
+		            "parameters and one NIF shot in shot_info.csv per ablator material, and save the comparison to "
+		            "a CSV file.")
+	parser.add_argument("--backend", type=str, default=None,
+	                    help="the stopping power backend ('SWIG' or 'numpy'); by default whatever rhoR_Model would use")
+	parser.add_argument("--quick", action="store_true",
+	                    help="to only do the default parameters and not the NIF shots")
+	parser.add_argument("--output", type=str, default="error_mode_comparison.csv",
+	                    help="the CSV file to save the comparison to")
+	args = parser.parse_args()
+
+	cases = {"defaults": {}}
+	if not args.quick:
+		for shot_number, params in load_representative_shots().items():
+			cases[shot_number] = nif_analysis_parameters(params)
+
+	tables = [compare_error_modes(name, parameters, args.backend) for name, parameters in cases.items()]
+	pd.concat(tables).to_csv(args.output, index=False)
+	print(f"saved the comparison to `{args.output}`")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,15 +1,16 @@
 import argparse
-from typing import Union
+from typing import Optional, Union
 
 import numpy as np
 
-from src.calculate_rhoR import calculate_rhoR, Quantity, perform_hohlraum_correction
+from src.calculate_rhoR import calculate_rhoR, calculate_omega_rhoR, Quantity, perform_hohlraum_correction, \
+	get_ein_from_eout, get_σin_from_σout
 
 
 def convert_energy_to_rhoR(
 		final_energy: Union[Quantity, str], shell_material: str, shell_density: float,
 		shell_temperature: float, secondary: bool,
-		gold: float, tantalum: float, uranium: float, aluminum: float):
+		gold: float, tantalum: float, uranium: float, aluminum: float, backend: Optional[str] = None):
 	""" print out the ρR that approximately corresponds to a given measured D3He-p energy, given some hohlraum parameters.
 	    :param final_energy: the final energy of the D3He protons or a filename containing them (MeV)
 	    :param shell_material: the material of the capsule shell ("HDC", "SiO2", or "CH")
@@ -20,35 +21,42 @@ def convert_energy_to_rhoR(
 	    :param tantalum: the amount of tantalum the particles passed thru (μm)
 	    :param uranium: the amount of depleted uranium the particles passed thru (μm)
 	    :param aluminum: the amount of aluminum the particles passed thru (μm)
+	    :param backend: the stopping power backend ("SWIG" or "numpy"), or None for SWIG
 	"""
-	# if a filename is passd instead of a specific energy
+	params = {
+		"ablator material": shell_material,
+		"shell density": shell_density,
+		"shell electron temperature": shell_temperature,
+		"secondary": secondary,
+		"stopping power backend": backend,
+	}
+	layers = [(gold, "Au"), (tantalum, "Ta"), (uranium, "U"), (aluminum, "Al")]
+
+	# if a filename is passd instead of a specific energy, convert all of its energies at once
 	if type(final_energy) is str:
-		final_energies = np.genfromtxt(final_energy)
-		for row in final_energies:
-			if len(row) == 1:
-				final_energy = (row[0], 0, 0)
-			elif len(row) == 2:
-				final_energy = (row[0], row[1], row[1])
-			elif len(row) == 3:
-				final_energy = (row[0], row[1], row[2])
-			else:
-				raise ValueError(f"the table you pass should have 1, 2, or 3 collums, not {len(row)}")
-			convert_energy_to_rhoR(final_energy, shell_material, shell_density, shell_temperature,
-			                       secondary, gold, tantalum, uranium, aluminum)
+		final_energies = np.genfromtxt(final_energy, ndmin=2)
+		if final_energies.shape[1] == 1:
+			final_energies = np.concatenate([final_energies, np.zeros((final_energies.shape[0], 2))], axis=1)
+		elif final_energies.shape[1] == 2:
+			final_energies = final_energies[:, [0, 1, 1]]
+		elif final_energies.shape[1] != 3:
+			raise ValueError(f"the table you pass should have 1, 2, or 3 collums, not {final_energies.shape[1]}")
+		intermediate_energies = final_energies.copy()
+		if any(thickness > 0 for thickness, material in layers):
+			intermediate_energies[:, 0] = get_ein_from_eout(final_energies[:, 0], layers)
+			intermediate_energies[:, 1] = intermediate_energies[:, 2] = get_σin_from_σout(
+				final_energies[:, 1], final_energies[:, 0], layers)
+		rhoRs = calculate_omega_rhoR(intermediate_energies, params)
+		for final_energy, intermediate_energy, rhoR in zip(final_energies, intermediate_energies, rhoRs):
+			if intermediate_energy[0] != final_energy[0]:
+				print(f"Hohlraum-corrected energy is {intermediate_energy[0]:.2f} MeV")
+			print(f"ρR = {rhoR[0]:.2f} ± {rhoR[1]:.2f} mg/cm^2")
 	else:
 		_, intermediate_energy, _ = perform_hohlraum_correction(
-			[(gold, "Au"), (tantalum, "Ta"), (uranium, "U"), (aluminum, "Al")],
-			((0, 0, 0), final_energy, (0, 0, 0)))
+			layers, ((0, 0, 0), final_energy, (0, 0, 0)))
 		if intermediate_energy[0] != final_energy[0]:
 			print(f"Hohlraum-corrected energy is {intermediate_energy[0]:.2f} MeV")
-		rhoR = calculate_rhoR(
-			intermediate_energy, "O", {
-				"ablator material": shell_material,
-				"shell density": shell_density,
-				"shell electron temperature": shell_temperature,
-				"secondary": secondary,
-			}
-		)
+		rhoR = calculate_rhoR(intermediate_energy, "O", params)
 		print(f"ρR = {rhoR[0]:.2f} ± {rhoR[1]:.2f} mg/cm^2")
 
 
@@ -76,6 +84,8 @@ def main():
 	                    help="the amount of depleted uranium the particles passed through, in μm")
 	parser.add_argument("--aluminum", type=float, default=0,
 	                    help="the amount of tantalum the particles passed through, in μm")
+	parser.add_argument("--backend", type=str, choices=["SWIG", "numpy"], default=None,
+	                    help="the stopping power backend (by default SWIG, which needs the StopPow library)")
 	parser.add_argument("--secondary", action="store_true",
 	                    help="to treat the protons as secondary reactions (in which case the assumed mean birth energy "
 	                         "is 15.0 MeV instead of 14.7)")
@@ -87,7 +97,7 @@ def main():
 		energy = args.energy
 	convert_energy_to_rhoR(energy, args.shell_material, args.shell_density,
 	                       args.shell_temperature, args.secondary,
-	                       args.gold, args.tantalum, args.uranium, args.aluminum)
+	                       args.gold, args.tantalum, args.uranium, args.aluminum, args.backend)
 
 
 if __name__ == "__main__":
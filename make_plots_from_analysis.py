@@ -16,7 +16,8 @@ from matplotlib.ticker import ScalarFormatter
 from numpy.typing import NDArray
 from scipy import optimize
 
-from src.calculate_rhoR import perform_hohlraum_correction, calculate_rhoR, Layer, Peak, np_Peak, Quantity, np_Quantity
+from src.calculate_rhoR import perform_hohlraum_correction, correct_spectrum_for_hohlraum, calculate_rhoR, \
+	calculate_rhoR_breakdown, load_shot_parameters, Layer, Peak, np_Peak, Quantity, np_Quantity
 
 # matplotlib.use("qtagg")
 np.seterr(all="raise", under="ignore")
@@ -28,14 +29,15 @@ ROOT = 'data'
 δσWRF = .014
 
 # define an analysis type that combines all the information about one WRF spectrum
-Analysis = tuple[str, str, str, str, str, bool, bool, Peak, Quantity, Peak, Quantity, NDArray[float]]
+Analysis = tuple[str, str, str, str, str, bool, bool, Peak, Quantity, Peak, Quantity,
+                 NDArray[float], Optional[NDArray[float]]]
 np_Analysis = np.dtype([
 	("shot_day", np.str_, 11), ("shot_number", np.str_, 7),
 	("line_of_site", np.str_, 7), ("position", np.str_, 2),
 	("tag", np.str_, 16), ("overlapd", bool), ("clipd", bool),
 	("peak", np_Peak), ("rhoR", np_Quantity),
 	("compression", np_Peak), ("compression_rhoR", np_Quantity),
-	("spectrum", object)])
+	("spectrum", object), ("corrected_spectrum", object)])
 # define an analysis type that combines all the information we get from yield ratios
 SecondaryAnalysis = tuple[Quantity, Quantity]
 np_SecondaryAnalysis = np.dtype([("rhoR", np_Quantity), ("temperature", np_Quantity)])
@@ -124,13 +126,18 @@ def make_plots_from_analysis(folders: list[str], show_plots: bool, command_line_
 		secondary_analyses[i] = ((row[0], row[1], row[2]), (row[3], row[4], row[5]))
 	assert len(secondary_analyses) == len(analyses), "This secondary analysis file has the rong number of entries"
 
-	# save the spectra to a csv file
+	# save the spectra to a csv file, along with the ones unfolded thru the hohlraum if there was one
 	for label, analysis in zip(labels, analyses):
 		sanitized_label = re.sub(r"[:\s]", "_", label)
 		filename = os.path.join(base_directory, f"spectrum_{sanitized_label}.csv")
 		np.savetxt(filename, analysis["spectrum"],
 		           header="Energy after passing through hohlraum (MeV),Spectrum (MeV^-1),Uncertainty (MeV^-1)",
 		           delimiter=",", comments="")
+		if analysis["corrected_spectrum"] is not None:
+			filename = os.path.join(base_directory, f"spectrum_{sanitized_label}_before_hohlraum.csv")
+			np.savetxt(filename, analysis["corrected_spectrum"],
+			           header="Energy before passing through hohlraum (MeV),Spectrum (MeV^-1),Uncertainty (MeV^-1)",
+			           delimiter=",", comments="")
 
 	# save the spectra in a spreadsheet
 	for item, secondary_stuff in zip(analyses, secondary_analyses):
@@ -212,6 +219,9 @@ def make_plots_from_analysis(folders: list[str], show_plots: bool, command_line_
 			last_shot_label = shot_label
 	print()
 
+	# save the breakdown of each ρR error bar by source
+	save_rhoR_breakdown(analyses, labels, base_directory, command_line_options)
+
 	# make the error bars asymmetrick if there are issues with the data
 	if np.any(analyses["overlapd"]):
 		decreased_data = [analyses["peak"]["yield"], analyses["compression"]["yield"],
@@ -363,6 +373,49 @@ def make_plots_from_analysis(folders: list[str], show_plots: bool, command_line_
 	plt.close('all')
 
 
+def save_rhoR_breakdown(analyses: NDArray[np_Analysis], labels: NDArray[str], base_directory: str,
+                        command_line_options: dict[str, Any]) -> None:
+	""" work out how much each source of error contributes to the ρR error bars of every shock and compression peak
+	    on the NIF shots, doing all of each shot's peaks in one batch, and save it all in a csv file
+	    :param analyses: the analyzed WRFs
+	    :param labels: the label of each WRF
+	    :param base_directory: the folder in which to save the table
+	    :param command_line_options: additional values specified in the original command
+	"""
+	tables = []
+	for shot in np.unique(analyses[["shot_day", "shot_number"]]):
+		shot_day, shot_number = shot["shot_day"], shot["shot_number"]
+		if not shot_day.startswith("N"):
+			continue  # only NIF shots have a breakdown
+		here = (analyses["shot_day"] == shot_day) & (analyses["shot_number"] == shot_number)
+		rows = []
+		for peak_name, peak_key in [("shock", "peak"), ("compression", "compression")]:
+			mean = analyses[peak_key]["mean"][here]
+			for label, value, error in zip(labels[here], mean["value"], mean["lower_err"]):
+				if np.isfinite(value) and np.isfinite(error):
+					rows.append({"WRF": label.replace("\n", " "), "peak": peak_name,
+					             "Mean energy (MeV)": value, "Mean energy unc. (MeV)": error})
+		if len(rows) == 0:
+			continue
+		table = pd.DataFrame(rows)
+		try:
+			parameters = load_rhoR_parameters(base_directory, f"{shot_day}-{shot_number}")
+			parameters.update(command_line_options)
+			breakdown = calculate_rhoR_breakdown(
+				table["Mean energy (MeV)"].to_numpy(), table["Mean energy unc. (MeV)"].to_numpy(),
+				f"{shot_day}-{shot_number}", parameters)
+		except (HohlraumFileError, ValueError) as e:
+			print(f"skipping the ρR error breakdown for {shot_day}-{shot_number} because {e}")
+			continue
+		table["Rho-R (mg/cm^2)"] = breakdown.pop("ρR")
+		for source, error in breakdown.items():
+			table[f"{source} unc. (mg/cm^2)"] = error
+		tables.append(table)
+
+	if len(tables) > 0:
+		pd.concat(tables).to_csv(os.path.join(base_directory, "rhoR_error_breakdown.csv"), index=False)
+
+
 def read_shot_summary_file(filepath: str) -> list[Analysis]:
 	""" read a file that lists the key outputs from a single shot (as gets generated in the folders
 	    that summarize entire campains) and put those outputs in a convenient format
@@ -395,6 +448,7 @@ def read_shot_summary_file(filepath: str) -> list[Analysis]:
 				),
 				(nan, inf, inf),
 				np.empty(0),
+				None,
 			))
 
 	return analyses
@@ -524,6 +578,16 @@ def read_analysis_file(folder: str, filepath: str,
 	any_clipping_here = any(indicator in filepath for indicator in parameters["clipping"])
 	any_overlap_here = any(indicator in filepath for indicator in parameters["overlap"])
 
+	# figure out the hohlraum correction for this LOS and position, and unfold the whole spectrum thru it
+	if '90' in line_of_site and any(parameters["hohlraum"].values()) > 0:
+		if position in parameters["hohlraum"]:
+			hohlraum_layers = parameters["hohlraum"][position]
+		else:
+			hohlraum_layers = parameters["hohlraum"][""]
+	else:
+		hohlraum_layers = []
+	corrected_spectrum = correct_spectrum_for_hohlraum(hohlraum_layers, spectrum)
+
 	# plot its spectrum
 	plt.figure(figsize=(10, 4))
 	plt.grid()
@@ -540,12 +604,23 @@ def read_analysis_file(folder: str, filepath: str,
 	plt.errorbar(x=spectrum[:, 0],
 	             y=spectrum[:, 1],
 	             yerr=spectrum[:, 2],
-	             fmt='.', color='#000000', elinewidth=1, markersize=6)
-	plt.axis([4, 18, min(0, np.min(spectrum[:, 1] + spectrum[:, 2])), np.max(spectrum[:, 1] + spectrum[:, 2])])
+	             fmt='.', color='#000000', elinewidth=1, markersize=6,
+	             label="after hohlraum wall" if corrected_spectrum is not None else None)
+	top = np.max(spectrum[:, 1] + spectrum[:, 2])
+	if corrected_spectrum is not None:
+		plt.errorbar(x=corrected_spectrum[:, 0],
+		             y=corrected_spectrum[:, 1],
+		             yerr=corrected_spectrum[:, 2],
+		             fmt='.', color='#7F7F7F', elinewidth=1, markersize=6,
+		             label="unfolded thru hohlraum wall")
+		plt.legend()
+		top = max(top, np.max(corrected_spectrum[:, 1] + corrected_spectrum[:, 2]))
+	plt.axis([4, 18, min(0, np.min(spectrum[:, 1] + spectrum[:, 2])), top])
 	plt_set_locators()
 	plt.xticks(np.arange(4, 18.1))
 	plt.ticklabel_format(axis='y', style='scientific', scilimits=(0, 0))
-	plt.xlabel("Energy after hohlraum wall (MeV)" if any_hohlraum else "Energy (MeV)")
+	plt.xlabel("Energy (MeV)" if corrected_spectrum is not None else
+	           "Energy after hohlraum wall (MeV)" if any_hohlraum else "Energy (MeV)")
 	plt.ylabel("Yield (MeV⁻¹)")
 	if position != "":
 		title = f"{line_of_site}, {position}"
@@ -561,14 +636,7 @@ def read_analysis_file(folder: str, filepath: str,
 		plt.show()
 	plt.close()
 
-	# figure out the hohlraum correction for this LOS and position
-	if '90' in line_of_site and any(parameters["hohlraum"].values()) > 0:
-		if position in parameters["hohlraum"]:
-			hohlraum_layers = parameters["hohlraum"][position]
-		else:
-			hohlraum_layers = parameters["hohlraum"][""]
-	else:
-		hohlraum_layers = []
+	# correct the fitted peaks for the hohlraum
 	yeeld, mean, sigma = perform_hohlraum_correction(hohlraum_layers, (yeeld, mean, sigma))
 
 	# do the ρR analysis for both the shock and compression peak
@@ -606,6 +674,7 @@ def read_analysis_file(folder: str, filepath: str,
 		 compression_sigma),
 		compression_rhoR,
 		spectrum,
+		corrected_spectrum,
 	)
 
 
@@ -649,23 +718,10 @@ def load_rhoR_parameters(folder: str, shot_number: str) -> dict[str, Any]:
 	# start by taking any relevant information from shot_info.csv
 	params: dict[str, Any] = {}
 	if shot_number.startswith("N"):
-		shot_number = shot_number + "-999"  # make sure to normalize the shot number first
-		nif_shot_table = pd.read_csv(
-			"shot_info.csv", skipinitialspace=True, index_col="shot number", dtype={})
-		if shot_number in nif_shot_table.index:
-			# collect the relevant information from shot_info.csv
-			shot_info = nif_shot_table.loc[shot_number]
-			for key in ["ablator radius", "ablator thickness", "ablator material",
-			            "fill pressure", "deuterium fraction", "helium-3 fraction"]:
-				if not pd.isnull(shot_info[key]):
-					params[key] = shot_info[key]
-
-			# calculate the converged shell thickness
-			if "shell thickness" not in params and "ablator thickness" in params:
-				params["shell thickness"] = params["ablator thickness"]*40.0/200.0  # from "Alex's paper" (idk which)
-
-		else:
-			print(f"there was no information about NIF shot {shot_number} in `shot_info.csv`.")
+		try:
+			params.update(load_shot_parameters(shot_number))
+		except ValueError as e:
+			print(e)
 
 	# read hohlraum.txt if it exists
 	if not os.path.isfile(os.path.join(folder, "hohlraum.txt")):
@@ -788,6 +844,11 @@ def main():
 	parser.add_argument(
 		"--secondary", action="store_true",
 		help="to treat the protons as secondary reactions (in which case the assumed mean birth energy is 15.0 MeV instead of 14.7)")
+	parser.add_argument(
+		"--backend", type=str, choices=["SWIG", "numpy"], default=None,
+		help="The stopping power backend to use for the ρR inference. By default it's SWIG, which needs the StopPow "
+		     "library; pass 'numpy' to use the NumPy stopping power instead."
+	)
 	parser.add_argument(
 		"--show", action="store_true",
 		help="to show the plots as they're generated in addition to saving them in the subdirectory."
@@ -802,6 +863,8 @@ def main():
 	if args.shell_temperature is not None:
 		options["shell electron temperature"] = args.shell_temperature
 	options["secondary"] = args.secondary
+	if args.backend is not None:
+		options["stopping power backend"] = args.backend
 
 	make_plots_from_analysis(args.folders.split(","), args.show, options)
 
@@ -31,7 +31,10 @@ __element_Z__ = {'H': 1,
                  'W': 74}
 
 from src.Constants import me, mp
-from src.StopPow import DoubleVector
+try:
+    from src.StopPow import DoubleVector
+except ImportError:  # without the StopPow library, plain arrays are what StopPow_numpy wants anyway
+    DoubleVector = None
 
 
 class Material:
@@ -109,26 +112,24 @@ def plasma_conditions(material_specifier: str, density: float, temperature: floa
         :param density: the mass density of the plasma in g/cm^3
         :param temperature: the ion and electron temperature in keV
         :return: the arrays containing the properties of each species (including electrons):
-                 mass (Da), charge (e), temperature (keV), and number density (cm^-3)
+                 mass (Da), charge (e), temperature (keV), and number density (cm^-3).  these are DoubleVectors if
+                 the StopPow library is installed and NumPy arrays otherwise.
     """
     material = Material(material_specifier)
     ion_density = density/(material.AvgA*mp)
     electron_density = ion_density*material.AvgZ
-    num_species = len(material.Z) + 1
-
-    masses = DoubleVector(num_species)
-    charges = DoubleVector(num_species)
-    temperatures = DoubleVector(num_species)
-    densities = DoubleVector(num_species)
-    for i in range(num_species):
-        if i < len(material.Z):
-            masses[i] = material.A[i]
-            charges[i] = material.Z[i]
-            densities[i] = ion_density*material.f[i]
-        else:
-            masses[i] = me/mp
-            charges[i] = -1
-            densities[i] = electron_density
-        temperatures[i] = temperature
-
-    return masses, charges, temperatures, densities
+
+    masses = np.array(material.A + [me/mp], dtype=float)
+    charges = np.array(material.Z + [-1], dtype=float)
+    temperatures = np.full(len(material.Z) + 1, temperature, dtype=float)
+    densities = np.array([ion_density*f for f in material.f] + [electron_density], dtype=float)
+    if DoubleVector is None:
+        return masses, charges, temperatures, densities
+
+    vectors = []
+    for values in [masses, charges, temperatures, densities]:
+        vector = DoubleVector(len(values))
+        for i in range(len(values)):
+            vector[i] = values[i]
+        vectors.append(vector)
+    return vectors[0], vectors[1], vectors[2], vectors[3]
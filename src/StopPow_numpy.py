@@ -0,0 +1,283 @@
+""" a pure-NumPy version of the Li-Petrasso plasma stopping power, for when the SWIG-wrapped StopPow library isn't
+    installed or when you want to do a lot of energies at once.  it follows the same conventions as StopPow_LP (masses in
+    Da, charges in e, temperatures in keV, densities in cm^-3, energies in MeV, lengths in μm, and dE/dx negative), but
+    every function takes NumPy arrays and broadcasts the energies against the field particle conditions, so you can
+    evaluate thousands of protons in thousands of different plasmas in one call.
+    the physics is from
+	    C.-K. Li and R. D. Petrasso (1993), "Charged-particle stopping powers in inertial confinement fusion plasmas",
+	    *Phys. Rev. Lett.* 70, 3059. DOI: 10.1103/PhysRevLett.70.3059.
+    with the collective term applied to electrons only and the quantum and classical impact parameters summed in
+    quadrature.  it's meant to agree with StopPow_LP to within TOLERANCE, but that hasn't been measured yet: the StopPow
+    builds in src/ are for macOS and Windows, and this was written on Linux.  check_against_StopPow() will tell you how
+    far apart they are on any given plasma, and check_against_shots() (or `python -m src.StopPow_numpy`) sweeps every
+    ablator material in shot_info.csv and the D3He fuel over the densities and temperatures that rhoR_Analysis covers.
+    run that somewhere StopPow loads and set TOLERANCE to what it finds, plus a little margin.
+"""
+from typing import Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.special import erf
+
+from src.Constants import e, hbar, me, mp, keVtoeV
+
+MeVtoerg = 1e3*keVtoeV  # (keVtoeV is actually the number of ergs in a keV)
+
+Emin = 0.01  # the lowest energy at which the model is meant to be used (MeV)
+Emax = 30.  # the highest energy at which the model is meant to be used (MeV)
+TOLERANCE = 0.05  # the relative difference from StopPow_LP's dE/dx that we consider acceptable (a target, not yet measured)
+# the conditions at which check_against_shots() compares the two: from below the ablated mass to above the compressed
+# shell in density (g/cm^3), and from the cold shell to the hot fuel in temperature (keV)
+CHECK_DENSITIES = np.geomspace(0.03, 300, 9)
+CHECK_TEMPERATURES = np.geomspace(0.05, 10, 7)
+
+# Gauss-Legendre nodes for the thickness integrals
+_nodes, _weights = np.polynomial.legendre.leggauss(32)
+
+
+def dEdx_LP(E: NDArray[float], mt: float, Zt: float,
+            mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[NDArray[float]], nf: Sequence[NDArray[float]]
+            ) -> NDArray[float]:
+	""" calculate the stopping power of a plasma for some test particles
+	    :param E: the test particle energies (MeV)
+	    :param mt: the test particle mass (Da)
+	    :param Zt: the test particle charge (e)
+	    :param mf: the mass of each field particle species (Da)
+	    :param Zf: the charge of each field particle species (e)
+	    :param Tf: the temperature of each field particle species, each of which may be an array (keV)
+	    :param nf: the number density of each field particle species, each of which may be an array (cm^-3)
+	    :return: the rate of energy change dE/dx, broadcast over the energies and field conditions (MeV/μm)
+	"""
+	shape = np.broadcast_shapes(np.shape(E), *(np.shape(T) for T in Tf), *(np.shape(n) for n in nf))
+	mf, Zf, Tf, nf = _field(shape, mf, Zf, Tf, nf)
+	m_t = mt*mp
+	m_f = mf*mp
+	m_r = m_t*m_f/(m_t + m_f)
+
+	with np.errstate(under="ignore"):
+		vt2 = 2*np.broadcast_to(E, shape)*MeVtoerg/m_t  # test particle velocity squared
+		kT = Tf*keVtoeV
+		vf2 = 2*kT/m_f  # field particle thermal velocity squared
+		x = vt2/vf2
+
+		# Coulomb logarithm, using the total Debye length and the larger of the classical and quantum impact parameters
+		kD2 = np.sum(4*np.pi*nf*Zf**2*e**2/kT, axis=0)
+		u2 = vt2 + vf2
+		p_classical = Zt*np.abs(Zf)*e**2/(m_r*u2)
+		p_quantum = hbar/(2*m_r*np.sqrt(u2))
+		log_Λ = 0.5*np.log1p(1/(kD2*(p_classical**2 + p_quantum**2)))
+
+		# Maxwell-averaged Chandrasekhar function
+		dμ = 2*np.sqrt(x/np.pi)*np.exp(-x)
+		μ = erf(np.sqrt(x)) - dμ
+		G = μ - mf/mt*(dμ - (μ + dμ)/log_Λ)
+
+		# collective effects, which only matter for the electrons
+		collective = np.where((Zf < 0) & (x > 1), np.log(1.123*np.sqrt(x)), 0)
+
+		ωpf2 = 4*np.pi*nf*Zf**2*e**2/m_f
+		dEdx = -(Zt*e)**2*ωpf2/vt2*(G*log_Λ + collective)  # erg/cm
+	return np.sum(dEdx, axis=0)/MeVtoerg*1e-4
+
+
+def Eout_LP(E: NDArray[float], x: NDArray[float], mt: float, Zt: float,
+            mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[NDArray[float]], nf: Sequence[NDArray[float]],
+            step_size=0.05) -> NDArray[float]:
+	""" calculate the energy of some test particles after passing thru some uniform plasma
+	    :param E: the initial test particle energies (MeV)
+	    :param x: the distance traveled thru the plasma (μm)
+	    :param mt: the test particle mass (Da)
+	    :param Zt: the test particle charge (e)
+	    :param mf: the mass of each field particle species (Da)
+	    :param Zf: the charge of each field particle species (e)
+	    :param Tf: the temperature of each field particle species, each of which may be an array (keV)
+	    :param nf: the number density of each field particle species, each of which may be an array (cm^-3)
+	    :param step_size: the largest fraction of its energy a particle may lose in one Runge-Kutta step
+	    :return: the final energies, or 0 wherever the particle ranged out (MeV)
+	"""
+	shape = np.broadcast_shapes(np.shape(E), np.shape(x),
+	                            *(np.shape(T) for T in Tf), *(np.shape(n) for n in nf))
+	mf, Zf, Tf, nf = _field(shape, mf, Zf, Tf, nf)
+	mf, Zf = mf.ravel(), Zf.ravel()
+	Tf, nf = Tf.reshape((mf.size, -1)), nf.reshape((mf.size, -1))
+	energy = np.array(np.broadcast_to(E, shape), dtype=float).ravel()
+	remaining = np.array(np.broadcast_to(x, shape), dtype=float).ravel()
+	energy[(energy < Emin) & (remaining > 0)] = 0
+
+	# don't bother stepping the particles whose range is clearly shorter than the plasma (with some margin for the
+	# quadrature error), since they're the ones that would take the most steps
+	active = np.nonzero((remaining > 0) & (energy > 0))[0]
+	if active.size > 0:
+		ranges = Thickness_LP(energy[active], Emin, mt, Zt, mf, Zf, Tf[:, active], nf[:, active])
+		energy[active[ranges < 0.95*remaining[active]]] = 0
+
+	# take fourth-order Runge-Kutta steps, each particle at its own pace, until they all get where they're going
+	active = np.nonzero((remaining > 0) & (energy > 0))[0]
+	while active.size > 0:
+		Tf_active, nf_active = Tf[:, active], nf[:, active]
+
+		def dEdx(energy):
+			return dEdx_LP(np.maximum(energy, Emin/10), mt, Zt, mf, Zf, Tf_active, nf_active)
+
+		E0 = energy[active]
+		k1 = dEdx(E0)
+		h = np.minimum(remaining[active], step_size*E0/-k1)
+		k2 = dEdx(E0 + h/2*k1)
+		k3 = dEdx(E0 + h/2*k2)
+		k4 = dEdx(E0 + h*k3)
+		E1 = E0 + h/6*(k1 + 2*k2 + 2*k3 + k4)
+		ranged_out = E1 < Emin
+		energy[active] = np.where(ranged_out, 0, E1)
+		remaining[active] = np.where(ranged_out, 0, remaining[active] - h)
+		active = np.nonzero((remaining > 0) & (energy > 0))[0]
+	return energy.reshape(shape)
+
+
+def Thickness_LP(E1: NDArray[float], E2: NDArray[float], mt: float, Zt: float,
+                 mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[NDArray[float]], nf: Sequence[NDArray[float]]
+                 ) -> NDArray[float]:
+	""" calculate the thickness of uniform plasma needed to slow some test particles from one energy to another
+	    :param E1: the initial test particle energies (MeV)
+	    :param E2: the final test particle energies (MeV)
+	    :param mt: the test particle mass (Da)
+	    :param Zt: the test particle charge (e)
+	    :param mf: the mass of each field particle species (Da)
+	    :param Zf: the charge of each field particle species (e)
+	    :param Tf: the temperature of each field particle species, each of which may be an array (keV)
+	    :param nf: the number density of each field particle species, each of which may be an array (cm^-3)
+	    :return: the path length (μm)
+	"""
+	shape = np.broadcast_shapes(np.shape(E1), np.shape(E2),
+	                            *(np.shape(T) for T in Tf), *(np.shape(n) for n in nf))
+	log_E1 = np.broadcast_to(np.log(E1), shape)
+	log_E2 = np.broadcast_to(np.log(E2), shape)
+	# integrate dx = -dE/(dE/dx) in log-space, where the integrand is nice and smooth
+	t = np.reshape((_nodes + 1)/2, (-1,) + (1,)*len(shape))
+	energy = np.exp(log_E2 + (log_E1 - log_E2)*t)
+	integrand = energy/-dEdx_LP(energy, mt, Zt, mf, Zf, Tf, nf)
+	weights = np.reshape(_weights, (-1,) + (1,)*len(shape))
+	return (log_E1 - log_E2)/2*np.sum(weights*integrand, axis=0)
+
+
+def check_against_StopPow(mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[float], nf: Sequence[float],
+                          energies: Sequence[float] = (1., 3., 6., 10., 15.)) -> float:
+	""" compare dE/dx to the SWIG-wrapped StopPow_LP for one plasma
+	    :param mf: the mass of each field particle species (Da)
+	    :param Zf: the charge of each field particle species (e)
+	    :param Tf: the temperature of each field particle species (keV)
+	    :param nf: the number density of each field particle species (cm^-3)
+	    :param energies: the proton energies at which to compare (MeV)
+	    :return: the largest relative difference between the two
+	    :raise ImportError: if the StopPow library isn't installed
+	    :raise ValueError: if the difference is more than TOLERANCE
+	"""
+	difference = _difference_from_StopPow(mf, Zf, Tf, nf, energies)
+	if difference > TOLERANCE:
+		raise ValueError(f"the NumPy stopping power is off by {difference:.1%} from StopPow_LP")
+	return difference
+
+
+def check_against_shots(filename: str = "shot_info.csv", energies: Sequence[float] = (1., 3., 6., 10., 15.)
+                        ) -> dict[str, float]:
+	""" compare dE/dx to the SWIG-wrapped StopPow_LP for every ablator material in shot_info.csv and for a D3He fuel,
+	    over CHECK_DENSITIES and CHECK_TEMPERATURES, and print how far apart they get in each
+	    :param filename: the table of shots whose materials to check
+	    :param energies: the proton energies at which to compare (MeV)
+	    :return: the largest relative difference for each material
+	    :raise ImportError: if the StopPow library isn't installed
+	    :raise ValueError: if any of the differences is more than TOLERANCE
+	"""
+	import pandas as pd
+	from src.Material import plasma_conditions
+	materials = pd.read_csv(filename, skipinitialspace=True)["ablator material"].dropna().unique()
+	differences = {}
+	for material in materials:
+		differences[material] = max(
+			_difference_from_StopPow(*(list(values) for values in plasma_conditions(material, density, temperature)),
+			                         energies)
+			for density in CHECK_DENSITIES for temperature in CHECK_TEMPERATURES)
+	# the fuel isn't a Material, so lay out a 50/50 D3He plasma by hand
+	fuel = []
+	for density in CHECK_DENSITIES:
+		ion_density = density/(2.5*mp)
+		for temperature in CHECK_TEMPERATURES:
+			fuel.append(_difference_from_StopPow(
+				[2, 3, me/mp], [1, 2, -1], [temperature]*3, [ion_density/2, ion_density/2, ion_density*1.5], energies))
+	differences["D3He"] = max(fuel)
+	for material, difference in differences.items():
+		print(f"{material:>6s}: the NumPy stopping power is off by up to {difference:.2%} from StopPow_LP")
+	if max(differences.values()) > TOLERANCE:
+		raise ValueError(f"the NumPy stopping power is off by {max(differences.values()):.1%} from StopPow_LP")
+	return differences
+
+
+class StopPow_LP:
+	""" a stand-in for the SWIG-wrapped StopPow_LP with the same constructor and methods, except that every method
+	    also accepts arrays of energies.
+	"""
+	def __init__(self, mt: float, Zt: float,
+	             mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[float], nf: Sequence[float]):
+		self.mt = mt
+		self.Zt = Zt
+		self.set_field(mf, Zf, Tf, nf)
+
+	def set_field(self, mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[float], nf: Sequence[float]):
+		self.mf = np.array(mf, dtype=float)
+		self.Zf = np.array(Zf, dtype=float)
+		self.Tf = np.array(Tf, dtype=float)
+		self.nf = np.array(nf, dtype=float)
+
+	def get_Emin(self) -> float:
+		return Emin
+
+	def get_Emax(self) -> float:
+		return Emax
+
+	def dEdx(self, E: NDArray[float]) -> NDArray[float]:
+		return dEdx_LP(E, self.mt, self.Zt, self.mf, self.Zf, self.Tf, self.nf)
+
+	def Eout(self, E: NDArray[float], x: NDArray[float]) -> NDArray[float]:
+		return Eout_LP(E, x, self.mt, self.Zt, self.mf, self.Zf, self.Tf, self.nf)
+
+	def Thickness(self, E1: NDArray[float], E2: NDArray[float]) -> NDArray[float]:
+		return Thickness_LP(E1, E2, self.mt, self.Zt, self.mf, self.Zf, self.Tf, self.nf)
+
+
+def _difference_from_StopPow(mf: Sequence[float], Zf: Sequence[float], Tf: Sequence[float], nf: Sequence[float],
+                             energies: Sequence[float]) -> float:
+	""" find the largest relative difference in dE/dx between this and the SWIG-wrapped StopPow_LP for one plasma """
+	from src.StopPow import StopPow_LP as StopPow_LP_SWIG, DoubleVector
+	vectors = []
+	for values in [mf, Zf, Tf, nf]:
+		vector = DoubleVector(len(values))
+		for i in range(len(values)):
+			vector[i] = values[i]
+		vectors.append(vector)
+	reference = StopPow_LP_SWIG(1, 1, *vectors)
+	expected = np.array([reference.dEdx(energy) for energy in energies])
+	actual = dEdx_LP(np.array(energies), 1, 1, mf, Zf, Tf, nf)
+	return float(np.max(np.abs(actual/expected - 1)))
+
+
+def _field(shape: tuple[int, ...], mf: Sequence[float], Zf: Sequence[float],
+           Tf: Sequence[NDArray[float]], nf: Sequence[NDArray[float]]
+           ) -> tuple[NDArray[float], NDArray[float], NDArray[float], NDArray[float]]:
+	""" stack the field particle properties into arrays with one row per species that broadcast against shape """
+	mf = np.reshape(np.asarray(mf, dtype=float), (-1,) + (1,)*len(shape))
+	Zf = np.reshape(np.asarray(Zf, dtype=float), (-1,) + (1,)*len(shape))
+	return mf, Zf, _stack(Tf, mf.size, shape), _stack(nf, mf.size, shape)
+
+
+def _stack(values: Sequence[NDArray[float]], num_species: int, shape: tuple[int, ...]) -> NDArray[float]:
+	""" stack a per-species list of scalars or arrays into one array with the species on the first axis """
+	try:
+		values = np.asarray(values, dtype=float)  # this is much faster when the list is all one shape
+	except ValueError:
+		return np.stack([np.broadcast_to(value, shape) for value in values]).astype(float)
+	# line up each species' values with the end of shape, the way broadcasting them individually would
+	values = np.reshape(values, (num_species,) + (1,)*(len(shape) + 1 - values.ndim) + values.shape[1:])
+	return np.broadcast_to(values, (num_species,) + shape)
+
+
+if __name__ == "__main__":
+	check_against_shots()
@@ -1,25 +1,22 @@
 # a file for top-level ρR calculation functions.  the reason this file is separate from rhoR_Analysis.py despite the
 # passingly similar semantic scope is that Alex wrote his fancy calculations OOPly and the script onto which I grafted it
 # is entirely procedural, so the interface is a little awkward.
-from typing import Any
+from typing import Any, Optional
 
 import numpy as np
+import pandas as pd
 from numpy import inf
-from scipy import integrate
+from numpy.typing import NDArray
 
-# if Alex's C stuff isn't working, catch the error here so the rest of the program can keep functioning
+from src import StopPow_numpy, stopping_power_tables
+from src.Material import plasma_conditions
+from src.rhoR_Analysis import rhoR_Analysis
+from src.rhoR_Model import rhoR_Model
+# if Alex's C stuff isn't working, catch the error here; the NumPy version of the stopping power is there if you ask
 try:
-	from src.Material import plasma_conditions
 	from src.StopPow import StopPow_LP
-	from src.rhoR_Analysis import rhoR_Analysis
-except ImportError as e:
-	print("the stopping power library couldn't be imported because of", e)
-	LIBRARY_IMPORTED = False
-	plasma_conditions = None
+except ImportError:
 	StopPow_LP = None
-	rhoR_Analysis = None
-else:
-	LIBRARY_IMPORTED = True
 
 # a type that represents the thickness and material of a layer
 Layer = tuple[float, str]
@@ -32,93 +29,39 @@ np_Peak = np.dtype([("yield", np_Quantity), ("mean", np_Quantity), ("sigma", np_
 
 rhoR_objects: dict[str, Any] = {}
 
+# the columns of shot_info.csv that go into the ρR analysis
+SHOT_INFO_KEYS = ["ablator radius", "ablator thickness", "ablator material",
+                  "fill pressure", "deuterium fraction", "helium-3 fraction"]
+
+# the number of energies at which to tabulate each OMEGA plasma's ρR, spaced logarithmicly up from the bottom of the
+# table and then again logarithmicly down from the birth energy, so that it's fine wherever ρR(E) is curvy or small
+OMEGA_TABLE_POINTS = 150
+# the lowest energy in those tables; below it, the ρR is taken to be the one at this energy (MeV)
+OMEGA_TABLE_MINIMUM = 0.05
+# the density and temperature factors of the plasmas whose spread gives the OMEGA ρR error bars (nominal first)
+OMEGA_VARIATIONS = [(1., 1.), (0.5, 0.5), (0.5, 1.5), (1.5, 0.5), (1.5, 1.5)]
+# the ρR-vs-energy tables built so far in this process, keyed by the shell conditions, birth energy, and backend
+omega_tables: dict[tuple[str, float, float, float, str], tuple[NDArray[float], NDArray[float]]] = {}
+
 
 def calculate_rhoR(mean_energy: Quantity, shot_number: str, params: dict[str, Any]) -> Quantity:
 	""" calculate the rhoR using whatever tecneke makes most sense.
 	    for a NIF shot, this will use Alex's fancy calculations.
-	    for an OMEGA shot, this will simply interpolate off a table loaded from disk.
+	    for an OMEGA shot, this will simply interpolate off a table of ρR against energy for a uniform plasma.
 		return rhoR, error, hotspot_component, shell_component (mg/cm^2)
 		:param mean_energy: the value and uncertainty of the peak energy that will be converted to a ρR
 		:param shot_number: a string unique to this shot that starts with either "N" or "O" depending on which facility this is
 		:param params: the dict of auxiliary information like the shell material and fill fraction
 		:raise ValueError: if not enuff information is available to make an inference
 	"""
-	if not LIBRARY_IMPORTED:
-		raise ValueError("the stopping power library wasn't imported")
-
-	elif shot_number.startswith("O"): # if it's an omega shot
-		if shot_number not in rhoR_objects:
-			if "ablator material" not in params:
-				raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell material with '--shell_material=_'.")
-			if "shell density" not in params:
-				raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell density (in g/cm3) with '--shell_density=_'")
-			if "shell electron temperature" not in params:
-				raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell material (in keV) with '--shell_temperature=_'")
-			elif params["shell electron temperature"] > 50:
-				raise ValueError("you clearly passed a shell temperature in eV.  read the instructions, baka; it should be in keV.  try again.")
-			# do a simple stopping power calculation through a uniform plasma
-			masses, charges, temperatures, densities = plasma_conditions(
-				params["ablator material"], params["shell density"], params["shell electron temperature"])
-			rhoR_objects[shot_number] = [
-				(1., StopPow_LP(1, 1, masses, charges, temperatures, densities))]  # the 1, 1 at the beginning specifies that these are protons
-			for density_factor in [0.5, 1.5]:
-				for temperature_factor in [0.5, 1.5]:
-					rhoR_objects[shot_number].append(
-						(density_factor, StopPow_LP(1, 1, masses, charges,
-						                            temperatures*temperature_factor,
-						                            densities*density_factor)))
-
-		birth_energy = 15.0 if params["secondary"] else 14.7
-		guesses = []
-		for energy in [mean_energy[0], mean_energy[0] - mean_energy[1], mean_energy[0] + mean_energy[2]]:
-			if energy >= birth_energy:
-				guesses.append(0)
-			elif energy <= 0:
-				guesses.append(inf)
-			else:
-				for density_factor, stopping_power in rhoR_objects[shot_number]: # then iterate thru all the other combinations of ρ and Te
-					thickness = stopping_power.Thickness(birth_energy, energy)*1e-4  # (convert μm to cm)
-					density = density_factor*params["shell density"]
-					guesses.append(thickness*density/1e-3)  # convert
-		best_gess = guesses[0]
-		lower_error = guesses[0] - np.min(guesses)
-		upper_error = np.max(guesses) - guesses[0]
-		return best_gess, lower_error, upper_error
+	if shot_number.startswith("O"): # if it's an omega shot
+		# do a simple stopping power calculation through a uniform plasma
+		best_gess, lower_error, upper_error = calculate_omega_rhoR(np.array(mean_energy, dtype=float), params)
+		return float(best_gess), float(lower_error), float(upper_error)
 
 	elif shot_number.startswith("N"): # if it's a NIF shot
 		# use Alex's fancy implosion stopping model
-		if shot_number not in rhoR_objects:
-			if "shell density" in params:
-				print("just so you know, I'm not using the shell density you provided; I'm inferring it from "
-				      "`shot_info.csv` and Alex's model.")
-			if "shell electron temperature" in params:
-				print("just so you know, I'm not using the shell electron temperature you provided; I'm inferring "
-				      "it from `shot_info.csv` and Alex's model.")
-			if params["secondary"] and "helium-3 fraction" in params:
-				print(f"fyi passing `--secondary` is not necessary for NIF shots; I can tell from `shot_info.csv` "
-				      f"that this is {'primary' if params['helium-3 fraction'] > 0 else 'secondary'} data.")
-			try:
-				rhoR_objects[shot_number] = rhoR_Analysis(
-					shell_mat   = params['ablator material'],
-					Ri          = (params['ablator radius'] - params['ablator thickness'])*1e-4,  # convert to cm
-					Ri_err      = 0.1e-4,
-					Ro          = params['ablator radius']*1e-4,  # convert to cm
-					Ro_err      = 0.1e-4,
-					fD          = params['deuterium fraction'],
-					fD_err      = min(params['deuterium fraction'], 1e-2),
-					f3He        = params['helium-3 fraction'],
-					f3He_err    = min(params['helium-3 fraction'], 1e-2),
-					P0          = params['fill pressure']/760,  # convert to atm
-					P0_err      = 0.1,
-					t_Shell     = params['shell thickness']*1e-4,  # convert to cm
-					t_Shell_err = params['shell thickness']/2*1e-4,
-					E0          = 14.7 if params['helium-3 fraction'] > 0 else 15.0,  # MeV
-				)
-			except KeyError as e:
-				raise ValueError(f"inferring ρR on NIF shots requires that the {e} be in the shot_info.csv table")
-
-		# then calculate the ρR
-		analysis_object = rhoR_objects[shot_number]
+		analysis_object = nif_rhoR_analysis(shot_number, params)
 		rhoR, Rcm_value, error = analysis_object.Calc_rhoR(E1=mean_energy[0], dE=mean_energy[1])
 		# hotspot_component, shell_component, ablated_component = analysis_object.rhoR_Parts(Rcm_value)
 		return rhoR*1e3, error*1e3, error*1e3 # convert from g/cm2 to mg/cm2
@@ -127,6 +70,185 @@ def calculate_rhoR(mean_energy: Quantity, shot_number: str, params: dict[str, An
 		raise ValueError(f"I don't know what facility {shot_number} is supposed to be")
 
 
+def calculate_omega_rhoR(mean_energies: NDArray[float], params: dict[str, Any]) -> NDArray[float]:
+	""" calculate the ρR of a uniform shell plasma from any number of energies at once, taking the error bars from the
+	    spread between the nominal plasma and ones with half and one and a half times the density and temperature.
+	    :param mean_energies: an array whose last axis holds the value, lower error, and upper error of each energy (MeV)
+	    :param params: the dict of auxiliary information like the shell material, density, and temperature
+	    :return: an array of the same shape with the value, lower error, and upper error of each ρR (mg/cm^2)
+	    :raise ValueError: if not enuff information is available to make an inference
+	"""
+	energies, rhoR_table = get_omega_table(params)
+	mean_energies = np.asarray(mean_energies, dtype=float)
+	guesses = np.stack([mean_energies[..., 0],
+	                    mean_energies[..., 0] - mean_energies[..., 1],
+	                    mean_energies[..., 0] + mean_energies[..., 2]], axis=-1)
+	# interpolate every plasma's table at all the energies and the ends of their error bars at once
+	log_guesses = np.log(np.clip(guesses, energies[0], energies[-1]))
+	rhoR = np.stack([np.interp(log_guesses, np.log(energies), table) for table in rhoR_table])
+	rhoR = np.where(guesses >= energies[-1], 0, np.where(guesses <= 0, inf, rhoR))
+	best_gess = rhoR[0, ..., 0]
+	with np.errstate(invalid="ignore"):
+		lower_error = best_gess - np.min(rhoR, axis=(0, -1))
+		upper_error = np.max(rhoR, axis=(0, -1)) - best_gess
+	return np.stack([best_gess, lower_error, upper_error], axis=-1)
+
+
+def get_omega_table(params: dict[str, Any]) -> tuple[NDArray[float], NDArray[float]]:
+	""" get the table of ρR against final energy for a uniform shell plasma and its variations, building it if it hasn't
+	    been already.  each table only takes one vectorized thickness calculation per plasma, after which any number of
+	    energies can be interpolated off of it.
+	    :param params: the dict of auxiliary information like the shell material, density, and temperature
+	    :return: the energies, in increasing order, ending at the birth energy (MeV), and the ρR at each one for each of
+	             the plasmas in OMEGA_VARIATIONS (mg/cm^2)
+	    :raise ValueError: if not enuff information is available to make an inference
+	"""
+	if "ablator material" not in params:
+		raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell material with '--shell_material=_'.")
+	if "shell density" not in params:
+		raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell density (in g/cm3) with '--shell_density=_'")
+	if "shell electron temperature" not in params:
+		raise ValueError("to infer ρR on OMEGA shots, you need to specify the shell material (in keV) with '--shell_temperature=_'")
+	elif params["shell electron temperature"] > 50:
+		raise ValueError("you clearly passed a shell temperature in eV.  read the instructions, baka; it should be in keV.  try again.")
+	birth_energy = 15.0 if params["secondary"] else 14.7
+	backend = params.get("stopping power backend")
+	if backend != "numpy":
+		backend = rhoR_Model.default_backend()  # this makes sure the StopPow library is there
+	key = (params["ablator material"], float(params["shell density"]),
+	       float(params["shell electron temperature"]), birth_energy, backend)
+	if key not in omega_tables:
+		energies = np.unique(np.concatenate([
+			np.geomspace(OMEGA_TABLE_MINIMUM, birth_energy, OMEGA_TABLE_POINTS),
+			birth_energy - np.geomspace(birth_energy - OMEGA_TABLE_MINIMUM, 1e-3, OMEGA_TABLE_POINTS)]))
+		rhoR_table = np.empty((len(OMEGA_VARIATIONS), energies.size))
+		for i, (density_factor, temperature_factor) in enumerate(OMEGA_VARIATIONS):
+			density = density_factor*params["shell density"]
+			new_stopping_power = StopPow_numpy.StopPow_LP if backend == "numpy" else StopPow_LP
+			stopping_power = new_stopping_power(1, 1, *plasma_conditions(  # the 1, 1 at the beginning specifies that these are protons
+				params["ablator material"], density, temperature_factor*params["shell electron temperature"]))
+			if backend == "numpy":
+				thickness = stopping_power.Thickness(birth_energy, energies[:-1])
+			else:
+				thickness = [stopping_power.Thickness(birth_energy, energy) for energy in energies[:-1]]
+			rhoR_table[i, :-1] = np.multiply(thickness, 1e-4)*density/1e-3  # convert μm to cm and g/cm^2 to mg/cm^2
+			rhoR_table[i, -1] = 0
+		omega_tables[key] = (energies, rhoR_table)
+	return omega_tables[key]
+
+
+def calculate_rhoR_breakdown(energies: NDArray[float], energy_errors: NDArray[float], shot_number: str,
+                             params: dict[str, Any]) -> dict[str, NDArray[float]]:
+	""" calculate the ρR and the contribution of each source of error to its error bar for a whole batch of peaks from
+	    one NIF shot at once, in one vectorized pass thru the analysis's varied models.
+	    :param energies: the mean energies of the peaks (MeV)
+	    :param energy_errors: the uncertainties in those mean energies (MeV)
+	    :param shot_number: a string unique to this shot that starts with "N"
+	    :param params: the dict of auxiliary information like the shell material and fill fraction
+	    :return: arrays of the ρR ("ρR"), its total error ("total"), the part of the error due to the uncertainty in
+	             the measured energy ("measured energy"), and the part due to each model parameter (under the name
+	             rhoR_Analysis gives it), all in mg/cm^2 and all nan wherever the energy is out of the model's range
+	    :raise ValueError: if this isn't a NIF shot or not enuff information is available to make an inference
+	"""
+	if not shot_number.startswith("N"):
+		raise ValueError(f"only NIF shots have a breakdown of their ρR error bars, not {shot_number}")
+	analysis_object = nif_rhoR_analysis(shot_number, params)
+	energies, energy_errors = np.broadcast_arrays(np.asarray(energies, dtype=float),
+	                                              np.asarray(energy_errors, dtype=float))
+	rhoR, _, (total_error, sources) = analysis_object.Calc_rhoR(E1=energies, dE=energy_errors, breakdown=True)
+	model_error = np.sqrt(sum(np.nan_to_num(error)**2 for _, error in sources))
+	breakdown = {
+		"ρR": rhoR*1e3,  # convert from g/cm2 to mg/cm2
+		"total": np.broadcast_to(total_error, energies.shape)*1e3,
+		"measured energy": np.sqrt(np.maximum(0, total_error**2 - model_error**2))*1e3,
+	}
+	for name, error in sources:
+		breakdown[name] = np.broadcast_to(error, energies.shape)*1e3
+	return breakdown
+
+
+def nif_rhoR_analysis(shot_number: str, params: dict[str, Any]) -> rhoR_Analysis:
+	""" get the rhoR_Analysis for a NIF shot, setting it up the first time it's needed
+	    :param shot_number: a string unique to this shot that starts with "N"
+	    :param params: the dict of auxiliary information like the shell material and fill fraction
+	    :raise ValueError: if not enuff information is available to make an inference
+	"""
+	if shot_number not in rhoR_objects:
+		if "shell density" in params:
+			print("just so you know, I'm not using the shell density you provided; I'm inferring it from "
+			      "`shot_info.csv` and Alex's model.")
+		if "shell electron temperature" in params:
+			print("just so you know, I'm not using the shell electron temperature you provided; I'm inferring "
+			      "it from `shot_info.csv` and Alex's model.")
+		if params["secondary"] and "helium-3 fraction" in params:
+			print(f"fyi passing `--secondary` is not necessary for NIF shots; I can tell from `shot_info.csv` "
+			      f"that this is {'primary' if params['helium-3 fraction'] > 0 else 'secondary'} data.")
+		try:
+			rhoR_objects[shot_number] = rhoR_Analysis(
+				**nif_analysis_parameters(params), backend=params.get("stopping power backend"))
+		except KeyError as e:
+			raise ValueError(f"inferring ρR on NIF shots requires that the {e} be in the shot_info.csv table")
+	return rhoR_objects[shot_number]
+
+
+def load_shot_parameters(shot_number: str, filename: str = "shot_info.csv") -> dict[str, Any]:
+	""" look up a NIF shot in shot_info.csv and collect whatever it has that the ρR analysis needs
+	    :param shot_number: the NIF shot number, like "N210808-001"
+	    :param filename: the table of shots to look in
+	    :return: the calculate_rhoR parameters that the table has for the shot, plus the converged shell thickness if it
+	             has the ablator thickness
+	    :raise ValueError: if the shot isn't in the table
+	"""
+	table = pd.read_csv(filename, skipinitialspace=True, index_col="shot number", dtype={})
+	if f"{shot_number}-999" not in table.index:
+		raise ValueError(f"there was no information about NIF shot {shot_number} in `{filename}`.")
+	shot_info = table.loc[f"{shot_number}-999"]
+	params: dict[str, Any] = {key: shot_info[key] for key in SHOT_INFO_KEYS if not pd.isnull(shot_info[key])}
+	# calculate the converged shell thickness
+	if "ablator thickness" in params:
+		params["shell thickness"] = params["ablator thickness"]*40.0/200.0  # from "Alex's paper" (idk which)
+	return params
+
+
+def load_representative_shots(filename: str = "shot_info.csv") -> dict[str, dict[str, Any]]:
+	""" pick the first NIF shot in shot_info.csv with each ablator material that has everything the ρR analysis needs
+	    :param filename: the table of shots to look in
+	    :return: the calculate_rhoR parameters for each shot, keyed by shot number
+	"""
+	table = pd.read_csv(filename, skipinitialspace=True, index_col="shot number", dtype={})
+	table = table.dropna(subset=SHOT_INFO_KEYS).groupby("ablator material").head(1)
+	shots = {}
+	for shot_number in table.index:
+		shot_number = shot_number[:-4]  # remove the -999
+		shots[shot_number] = {**load_shot_parameters(shot_number, filename), "secondary": False}
+	return shots
+
+
+def nif_analysis_parameters(params: dict[str, Any]) -> dict[str, Any]:
+	""" work out the rhoR_Analysis arguments for a NIF shot from its shot_info.csv entries
+	    :param params: the shot's parameters, including the ablator radius, thickness, and material, the fill pressure,
+	                   the deuterium and helium-3 fractions, and the shell thickness
+	    :return: the keyword arguments to pass to rhoR_Analysis
+	    :raise KeyError: if any of the shot's parameters are missing
+	"""
+	return dict(
+		shell_mat   = params['ablator material'],
+		Ri          = (params['ablator radius'] - params['ablator thickness'])*1e-4,  # convert to cm
+		Ri_err      = 0.1e-4,
+		Ro          = params['ablator radius']*1e-4,  # convert to cm
+		Ro_err      = 0.1e-4,
+		fD          = params['deuterium fraction'],
+		fD_err      = min(params['deuterium fraction'], 1e-2),
+		f3He        = params['helium-3 fraction'],
+		f3He_err    = min(params['helium-3 fraction'], 1e-2),
+		P0          = params['fill pressure']/760,  # convert to atm
+		P0_err      = 0.1,
+		t_Shell     = params['shell thickness']*1e-4,  # convert to cm
+		t_Shell_err = params['shell thickness']/2*1e-4,
+		E0          = 14.7 if params['helium-3 fraction'] > 0 else 15.0,  # MeV
+	)
+
+
 def perform_hohlraum_correction(layers: list[Layer], after_wall: Peak) -> Peak:
 	""" correct some spectral properties for a hohlraum """
 	if not any(thickness > 0 for thickness, material in layers):
@@ -134,11 +256,15 @@ def perform_hohlraum_correction(layers: list[Layer], after_wall: Peak) -> Peak:
 
 	yeeld, after_wall_mean, after_wall_sigma = after_wall
 
-	before_wall_mean = (
-		get_ein_from_eout(after_wall_mean[0], layers),
-		get_σin_from_σout(after_wall_mean[1], after_wall_mean[0], layers))
-	before_wall_sigma = (get_σin_from_σout(after_wall_sigma[0], after_wall_mean[0], layers),
-	                     get_σin_from_σout(after_wall_sigma[1], after_wall_mean[0], layers))
+	# look up the mean and the ends of each of the spreads all at once
+	spreads = np.array([after_wall_mean[1], after_wall_sigma[0], after_wall_sigma[1]])
+	energies = get_ein_from_eout(np.concatenate([
+		[after_wall_mean[0]],
+		np.maximum(0., after_wall_mean[0] - spreads),
+		np.maximum(0., after_wall_mean[0] + spreads)]), layers)
+	before_wall_spreads = (energies[4:] - energies[1:4])/2
+	before_wall_mean = (energies[0], before_wall_spreads[0])
+	before_wall_sigma = (before_wall_spreads[1], before_wall_spreads[2])
 	before_wall = (yeeld,
 	               (before_wall_mean[0], before_wall_mean[1], before_wall_mean[1]),
 	               (before_wall_sigma[0], before_wall_sigma[1], before_wall_sigma[1]))
@@ -153,23 +279,34 @@ def perform_hohlraum_correction(layers: list[Layer], after_wall: Peak) -> Peak:
 	return before_wall
 
 
-def get_ein_from_eout(eout: float, layers: list[Layer]) -> float:
-	""" do the reverse cold matter stopping power calculation """
-	energy = eout # [MeV]
-	for thickness, formula in layers[::-1]:
-		data = np.loadtxt(f"tables/stopping_power_protons_{formula}.csv", delimiter=',')
-		energy_axis = data[:, 0]/1e3 # [MeV]
-		dEdx = data[:, 1]/1e3 # [MeV/μm]
-		energy = integrate.odeint(
-			func =lambda E, x: np.interp(E, energy_axis, dEdx),
-			y0   =energy,
-			t    =[0, thickness]
-		)[-1, 0]  # type: ignore
+def correct_spectrum_for_hohlraum(layers: list[Layer], after_wall: NDArray[float]) -> Optional[NDArray[float]]:
+	""" unfold a whole spectrum thru the hohlraum: map each bin's energy back to what it was before the wall, and scale
+	    its yield per MeV (and its error) by how much the wall stretched the energy axis there, dE_in/dE_out.
+	    :param layers: the hohlraum's layers, from the inside out
+	    :param after_wall: the spectrum after the hohlraum, with a row per bin and columns for the energy (MeV), the
+	                       yield per MeV, and its error (and any others, which get copied over)
+	    :return: the spectrum before the hohlraum, in the same format, or None if there's no hohlraum to correct for
+	"""
+	if not any(thickness > 0 for thickness, material in layers):
+		return None
+	energy, stretch = stopping_power_tables.unfold_layers(after_wall[:, 0], layers) # [MeV], dE_in/dE_out
+	before_wall = after_wall.copy()
+	before_wall[:, 0] = energy
+	before_wall[:, 1:3] /= stretch[:, np.newaxis]
+	return before_wall
+
+
+def get_ein_from_eout(eout: float | NDArray[float], layers: list[Layer]) -> float | NDArray[float]:
+	""" do the reverse cold matter stopping power calculation, using the layer stack's transfer function (which only
+	    gets tabulated the first time this stack comes up).  eout may be an array, such as a whole spectrum's energy bins.
+	"""
+	energy, _ = stopping_power_tables.unfold_layers(eout, layers) # [MeV]
 	return energy
 
 
-def get_σin_from_σout(deout: float, eout: float, layers: list[Layer]) -> float:
+def get_σin_from_σout(deout: float | NDArray[float], eout: float | NDArray[float], layers: list[Layer]
+                      ) -> float | NDArray[float]:
 	""" do a derivative of the cold matter stopping power calculation """
-	left = get_ein_from_eout(max(0., eout - deout), layers)
-	rite = get_ein_from_eout(max(0., eout + deout), layers)
+	left = get_ein_from_eout(np.maximum(0., eout - deout), layers)
+	rite = get_ein_from_eout(np.maximum(0., eout + deout), layers)
 	return (rite - left)/2
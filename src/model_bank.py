@@ -0,0 +1,82 @@
+""" an in-memory bank of the rhoR_Models set up so far in this process, keyed by everything that determines their
+    tables, so that identical models get built once and shared.  this catches the pair of models that a parameter with
+    no error bar gets "varied" into (which are both just the nominal model), as well as the models of different shots
+    that have the same capsule.  the models in the bank start out lazy, and whoever builds one builds it for everyone
+    holding it.  once they're built, they can be swapped for their frozen tables to save memory.  (the on-disk
+    model_cache still saves the tables between processes; this just saves setting them up again.)
+"""
+from typing import Any, Optional
+
+from numpy.typing import NDArray
+
+from src import model_cache
+from src.rhoR_Model import rhoR_Model, rhoR_Table
+
+# every model set up so far in this process (or its frozen table, once it's been built)
+_models: dict[str, rhoR_Model | rhoR_Table] = {}
+# the number of requests that found their model in the bank and the number that had to make a new one
+_statistics = {"hits": 0, "misses": 0}
+
+
+def get_model(*parameters: Any, dEdx_model: str = "LP", backend: Optional[str] = None, cache: bool = True,
+              grid: Optional[NDArray[float]] = None, stages: Optional[dict] = None) -> rhoR_Model | rhoR_Table:
+	""" get the model with these parameters, setting up a new (lazy) one if there isn't one in the bank yet
+	    :param parameters: the shell material, the parameters from Ri to f_Remain, and E0, as rhoR_Model takes them
+	    :param dEdx_model: the stopping power model, as in rhoR_Model
+	    :param backend: the stopping power backend, as in rhoR_Model
+	    :param cache: whether a new model should use the on-disk model cache, as in rhoR_Model.  this doesn't go into
+	                  the key, since it doesn't change the tables.
+	    :param grid: if given, a new model only gets evaluated at these shell radii (see
+	                 rhoR_Model.__build_tables_at__) rather than being left lazy, and is banked apart from the full ones
+	    :param stages: if given, a store of region stages for a new model to share (see rhoR_Model.__stage__)
+	    :return: the model, which may be shared with other callers, and which will be a frozen rhoR_Table if someone
+	             has built it and handed it to freeze_model()
+	"""
+	if backend is None:  # resolve the default the same way rhoR_Model does, so it doesn't split the key
+		backend = rhoR_Model.default_backend()
+	key = model_cache.table_key(
+		"model", *parameters, dEdx_model, backend, None if grid is None else tuple(float(Rcm) for Rcm in grid))
+	if key in _models:
+		_statistics["hits"] += 1
+	else:
+		_statistics["misses"] += 1
+		model = rhoR_Model(*parameters, dEdx_model=dEdx_model, backend=backend,
+		                   cache=cache and grid is None, lazy=True)
+		if stages is not None:
+			model.__stages__ = stages
+		if grid is not None:
+			model.__build_tables_at__(grid)
+		_models[key] = model
+	return _models[key]
+
+
+def freeze_model(model: rhoR_Model | rhoR_Table, table: Optional[rhoR_Table] = None) -> rhoR_Table:
+	""" swap a model in the bank for its frozen table, so that the bank (and whoever gets the model from it next) only
+	    holds on to the parameters and tables
+	    :param model: the model, which will get built if it's lazy
+	    :param table: the model's frozen table, if it's already been made (say, in another process)
+	    :return: the frozen table
+	"""
+	if isinstance(model, rhoR_Table):
+		return model
+	if table is None:
+		table = model.freeze()
+	for key, banked in _models.items():
+		if banked is model:
+			_models[key] = table
+	return table
+
+
+def bank_info() -> tuple[int, int, int]:
+	""" describe the contents and the use of the bank
+	    :return: the number of models in the bank, the number of requests that found their model in the bank, and the
+	             number of requests that had to set up a new one
+	"""
+	return len(_models), _statistics["hits"], _statistics["misses"]
+
+
+def clear_bank() -> None:
+	""" forget every model in memory and reset the statistics (the tables on disk stay in the model cache) """
+	_models.clear()
+	_statistics["hits"] = 0
+	_statistics["misses"] = 0
@@ -0,0 +1,139 @@
+""" a persistent on-disk cache for the tables that rhoR_Model precomputes, so that a model that has been built before
+    (with the same parameters and the same version of the code) can be loaded instead of rebuilt.  each set of tables
+    is saved as an .npz file in CACHE_DIRECTORY named after a hash of everything that went into it.  when the directory
+    gets bigger than CACHE_SIZE_LIMIT, the least recently used files are deleted.
+"""
+import functools
+import hashlib
+import os
+import zipfile
+from typing import Any, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+CACHE_DIRECTORY = os.path.join("cache", "rhoR_models")
+CACHE_SIZE_LIMIT = 50_000_000  # the most space the cache may take up on disk (bytes)
+
+# the source files whose contents determine what a model's tables look like
+SOURCE_FILES = ["rhoR_Model.py", "StopPow_numpy.py", "Material.py", "Constants.py"]
+
+
+@functools.cache
+def code_version() -> str:
+	""" a hash of the source code that goes into the tables, so that editing it invalidates the old ones """
+	hasher = hashlib.sha256()
+	for filename in SOURCE_FILES:
+		with open(os.path.join(os.path.dirname(__file__), filename), "rb") as f:
+			hasher.update(f.read())
+	return hasher.hexdigest()
+
+
+def table_key(*parameters: Any) -> str:
+	""" compute the content address of a set of tables
+	    :param parameters: everything that affects the tables' values (numbers, strings, or None)
+	    :return: a hex digest unique to those parameters and the current version of the code
+	"""
+	hasher = hashlib.sha256(code_version().encode())
+	for parameter in parameters:
+		if isinstance(parameter, (int, float, np.number)) and not isinstance(parameter, bool):
+			parameter = float(parameter)  # so that 50 and 50.0 and np.float64(50) all look the same
+		hasher.update(repr(parameter).encode())
+		hasher.update(b"\0")
+	return hasher.hexdigest()
+
+
+def load_tables(key: str) -> Optional[dict[str, NDArray[float]]]:
+	""" load a set of tables from the cache, if they're there
+	    :param key: the content address returned by table_key()
+	    :return: a dict of the saved arrays, or None if there's no (readable) file for this key
+	"""
+	filename = _filename(key)
+	try:
+		with np.load(filename) as data:
+			tables = {name: data[name] for name in data.files}
+	except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+		return None
+	try:
+		os.utime(filename)  # mark it as recently used
+	except OSError:
+		pass
+	return tables
+
+
+def save_tables(key: str, tables: dict[str, NDArray[float]]) -> None:
+	""" save a set of tables to the cache, and then delete old ones if it's gotten too big.  if the cache directory
+	    can't be written to, this will just print a warning.
+	    :param key: the content address returned by table_key()
+	    :param tables: the arrays to save
+	"""
+	filename = _filename(key)
+	temporary_filename = f"{filename}.{os.getpid()}.tmp"  # so that other processes never see a half-written file
+	try:
+		os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+		with open(temporary_filename, "wb") as f:
+			np.savez(f, **tables)
+		os.replace(temporary_filename, filename)
+	except OSError as e:
+		print(f"couldn't save the ρR model to the cache because {e}")
+		return
+	evict(CACHE_SIZE_LIMIT)
+
+
+def evict(size_limit: float) -> int:
+	""" delete the least recently used tables until the cache is no bigger than size_limit
+	    :param size_limit: the most space the cache may take up on disk (bytes)
+	    :return: the number of files deleted
+	"""
+	files = []
+	for filename in _cached_files():
+		try:
+			status = os.stat(filename)
+		except OSError:
+			continue  # another process may have just deleted it
+		files.append((status.st_mtime, status.st_size, filename))
+	files.sort()
+	total_size = sum(size for _, size, _ in files)
+	num_deleted = 0
+	for _, size, filename in files:
+		if total_size <= size_limit:
+			break
+		try:
+			os.remove(filename)
+		except OSError:
+			continue
+		total_size -= size
+		num_deleted += 1
+	return num_deleted
+
+
+def purge_cache() -> int:
+	""" delete every table in the cache
+	    :return: the number of files deleted
+	"""
+	return evict(0)
+
+
+def cache_info() -> tuple[int, int]:
+	""" describe the current contents of the cache
+	    :return: the number of cached tables and their total size (bytes)
+	"""
+	sizes = []
+	for filename in _cached_files():
+		try:
+			sizes.append(os.path.getsize(filename))
+		except OSError:
+			continue
+	return len(sizes), sum(sizes)
+
+
+def _filename(key: str) -> str:
+	return os.path.join(CACHE_DIRECTORY, f"{key}.npz")
+
+
+def _cached_files() -> list[str]:
+	try:
+		return [os.path.join(CACHE_DIRECTORY, filename) for filename in os.listdir(CACHE_DIRECTORY)
+		        if filename.endswith(".npz")]
+	except OSError:
+		return []
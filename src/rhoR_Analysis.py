@@ -1,6 +1,11 @@
+from src import model_bank
 from src.rhoR_Model import rhoR_Model
+import concurrent.futures
 import numpy
 import math
+import os
+import scipy.stats
+import time
 
 __author__ = 'Alex Zylstra'
 
@@ -31,6 +36,17 @@ class rhoR_Analysis(object):
     :param f_Remain: (optional) shell mass remaining during the implosion [fractional] {default=0.175}
     :param E0: (optional) initial proton energy [MeV] {default=14.7}
     :param dEdx_model: (optional) Stopping model to use, valid choices are 'LP', 'BPS', 'Z' {default='LP'}
+    :param backend: (optional) Stopping power implementation to use, valid choices are 'SWIG' or 'numpy'
+        {default='SWIG' if it's installed}
+    :param cache: (optional) whether the models may use the on-disk model cache {default=True}
+    :param lazy: (optional) whether the models should put off precomputing their tables until they need them, which is
+        faster when only a few energies will be analyzed (see rhoR_Model) {default=False}
+    :param workers: (optional) number of processes to build the nominal and varied models in, or None for one per
+        CPU {default=None}
+    :param error_mode: (optional) how to get the error bars due to the model parameters, valid choices are 'varied'
+        (rebuild the model with each parameter at -1 and +1 sigma) or 'jacobian' (evaluate the nominal model's grid
+        with each parameter at -jacobian_step and +jacobian_step sigma, and extrapolate linearly; this always builds
+        the nominal model, even if lazy) {default='varied'}
 
     :author: Alex Zylstra
     :date: 2014/09/25
@@ -39,6 +55,16 @@ class rhoR_Analysis(object):
     # set verbosity for console output:
     verbose = False
 
+    error_modes_avail = ['varied', 'jacobian']
+    jacobian_step = 0.5  # size of the perturbations in the 'jacobian' error mode [sigma]
+    # options for the Monte Carlo error bars:
+    monte_carlo_samples = 4000  # default number of samples to draw
+    monte_carlo_batch_size = 500  # number of samples to evaluate per batch of models
+    monte_carlo_percentiles = [2.5, 16, 50, 84, 97.5]  # percentiles of the rhoR distribution to report
+    # options for the Sobol sensitivity analysis:
+    sobol_samples = 512  # default number of base samples (each one takes a model evaluation per parameter, plus 2)
+    sobol_bootstrap = 200  # number of bootstrap resamples for the indices' error bars
+
     # values below are defaults
     # anything beginning with a def_ is replaced with a class variable
 
@@ -100,8 +126,10 @@ class rhoR_Analysis(object):
                  t_Shell=def_t_Shell, t_Shell_err=def_t_Shell_err,
                  f_Remain=def_f_Remain, f_Remain_err=def_f_Remain_err,
                  E0=def_E0,
-                 dEdx_model='LP'):
+                 dEdx_model='LP', backend=None, cache=True, lazy=False, workers=None, error_mode='varied'):
         """Initialize the rhoR model."""
+        if error_mode not in self.error_modes_avail:
+            raise ValueError(f"I don't have an error mode called '{error_mode}'")
         self.shell_mat = shell_mat  # shell material
 
         # set the error bars appropriately:
@@ -141,10 +169,17 @@ class rhoR_Analysis(object):
         self.f_Remain = [f_Remain - self.f_Remain_err, f_Remain, f_Remain + self.f_Remain_err]
         self.E0 = E0
         self.dEdx_model = dEdx_model
-
-        # start the rhoR model itself:
-        self.model = rhoR_Model(self.shell_mat, Ri, Ro, fD, f3He, P0, Te_Gas, Te_Shell, Te_Abl, Te_Mix, rho_Abl_Max,
-                                rho_Abl_Min, rho_Abl_Scale, f_Mix, t_Shell, f_Remain, E0, dEdx_model)
+        self.cache = cache
+        self.lazy = lazy
+        self.workers = workers
+        self.error_mode = error_mode
+
+        # start the rhoR model itself (all of the models start out lazy, so that any whose tables aren't in the
+        # cache can be built together in parallel once they've all been set up):
+        self.model = model_bank.get_model(self.shell_mat, Ri, Ro, fD, f3He, P0, Te_Gas, Te_Shell, Te_Abl, Te_Mix,
+                                          rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale, f_Mix, t_Shell, f_Remain, E0,
+                                          dEdx_model=dEdx_model, backend=backend, cache=cache)
+        self.backend = self.model.backend
 
         # a list of all parameters
         self.AllParam = []
@@ -155,14 +190,23 @@ class rhoR_Analysis(object):
 
         # set up the models for error bar calculations:
         try:
-            self.__setup_error_models__()
+            if self.error_mode == 'jacobian':
+                self.__setup_jacobian_models__()
+            else:
+                self.__setup_error_models__()
         except ValueError:
             raise ValueError("One of the error bars passed to the rhoR_Analysis was too big relative to its corresponding value")
+        # let the varied models reuse each other's trajectories thru the regions whose inputs they didn't vary
+        for model_set in self.__varied_models__:
+            for model in model_set:
+                model.__stages__ = self.model.__stages__
+        if not self.lazy:
+            self.__build_models__()
 
     def Eout(self, Rcm) -> tuple:
         """Main function, which calculates the proton energy downshift.
 
-        :param Rcm: shell radius at shock BT [cm]
+        :param Rcm: shell radius at shock BT, which may be an array [cm]
         :returns: Eout, error = final proton energy and its error bar [MeV]
         """
         TotalError = self.__calc_error__("Eout", Rcm, breakdown=True)
@@ -171,27 +215,205 @@ class rhoR_Analysis(object):
     def Calc_rhoR(self, E1, dE=0, breakdown=False) -> tuple:
         """Alternative analysis method: specify measured E and calc rhoR.
 
-        :param E1: Measured proton energy [MeV]
-        :param dE: Uncertainty in measured proton energy [MeV]
+        :param E1: Measured proton energy, which may be an array [MeV]
+        :param dE: Uncertainty in measured proton energy, which may be an array [MeV]
         :param breakdown: Whether to provide a summary of the sources of error [default = false]
-        :returns: tuple containing (rhoR , Rcm , rhoR error) = modeled areal density to produce modeled E
+        :returns: tuple containing (rhoR , Rcm , rhoR error) = modeled areal density to produce modeled E,
+            all nan wherever E1 is outside of the model's range. If breakdown, the error is a tuple of (error, sources).
         """
         rhoR, Rcm = self.model.Calc_rhoR(E1)
 
         ModelError = self.__calc_error__("Calc_rhoR", Rcm, E1, breakdown=breakdown)
+        if breakdown:
+            ModelError, sources = ModelError
         # Two cases: non-zero user-supplied error bar, or model error only:
-        if dE > 0:
-            rhoR_min = self.model.Calc_rhoR(min(E1+dE, self.E0))[0]
-            rhoR_max = self.model.Calc_rhoR(    E1-dE          )[0]
-            TotalError = numpy.sqrt(0.25*(rhoR_max-rhoR_min)**2 + ModelError**2)
+        dE = numpy.asarray(dE)
+        if numpy.any(dE > 0):
+            rhoR_min = self.model.Calc_rhoR(numpy.minimum(E1+dE, self.E0))[0]
+            rhoR_max = self.model.Calc_rhoR(              E1-dE          )[0]
+            TotalError = numpy.where(dE > 0, numpy.sqrt(0.25*(rhoR_max-rhoR_min)**2 + ModelError**2), ModelError)[()]
         else:
             TotalError = ModelError
+        if breakdown:
+            return rhoR, Rcm, (TotalError, sources)
         return rhoR, Rcm, TotalError
 
+    def Calc_rhoR_MonteCarlo(self, E1, dE=0, samples=None, time_limit=None, seed=None) -> dict:
+        """Alternative error analysis: sample every model parameter and the measured energy together, from Gaussians
+        with the given error bars (truncated to physical values), and find the rhoR for each sample. Unlike the other
+        error modes, this catches the interactions between parameters and any non-Gaussian tails. The samples are
+        evaluated monte_carlo_batch_size at a time as batches of models (see rhoR_Model), with the NumPy backend.
+
+        :param E1: Measured proton energy [MeV]
+        :param dE: (optional) Uncertainty in measured proton energy [MeV] {default=0}
+        :param samples: (optional) Number of samples to draw {default=monte_carlo_samples}
+        :param time_limit: (optional) Stop after the batch that goes past this many seconds, even if it hasn't drawn
+            all of the samples yet, though the first batch always runs [s] {default=None}
+        :param seed: (optional) Seed for the random number generator, for reproducible results {default=None}
+        :returns: a dict with the samples ('rhoR' [g/cm2], 'Rcm' [cm], 'E1' [MeV], and each parameter under its name
+            in 'parameters'), the summary statistics of the valid ones ('mean', 'std', and 'percentiles', keyed by
+            percentile) [g/cm2], and the convergence diagnostics: 'samples' (number drawn), 'valid fraction' (fraction
+            whose E1 was within the model's range), 'time' [s], 'standard error' (of the mean) [g/cm2],
+            'percentile errors' (the standard errors of the percentiles, from the spread between batches) [g/cm2],
+            and 'history' (the number of samples and the percentiles after each batch)
+        :raise ValueError: if samples is less than 1
+        """
+        if self.dEdx_model != 'LP':
+            raise ValueError(f"the Monte Carlo error bars need the NumPy backend, which only does LP stopping, "
+                             f"not '{self.dEdx_model}'")
+        samples = self.monte_carlo_samples if samples is None else samples
+        if samples < 1:
+            raise ValueError(f"the Monte Carlo error bars need at least one sample, not {samples}")
+        rng = numpy.random.default_rng(seed)
+        start = time.perf_counter()
+
+        batches = []
+        history = []
+        num_drawn = 0
+        while num_drawn < samples and (num_drawn == 0 or time_limit is None or
+                                       time.perf_counter() - start < time_limit):
+            num_samples = min(self.monte_carlo_batch_size, samples - num_drawn)
+            values = self.__sample_parameters__(num_samples, rng)
+            energies = E1 + dE*rng.standard_normal(num_samples)
+            model = rhoR_Model(self.shell_mat, *values, self.E0, dEdx_model=self.dEdx_model,
+                               backend='numpy', cache=False)
+            rhoR, Rcm = model.Calc_rhoR(energies)
+            batches.append((rhoR, Rcm, energies, values))
+            num_drawn += num_samples
+
+            all_rhoR = numpy.concatenate([batch[0] for batch in batches])
+            history.append((num_drawn, numpy.nanpercentile(all_rhoR, self.monte_carlo_percentiles)
+                            if numpy.any(~numpy.isnan(all_rhoR)) else numpy.full(len(self.monte_carlo_percentiles),
+                                                                                 numpy.nan)))
+
+        rhoR, Rcm, energies, values = (numpy.concatenate(arrays, axis=-1) for arrays in zip(*batches))
+        valid = rhoR[~numpy.isnan(rhoR)]
+        # the spread of each batch's percentiles says how well the combined percentiles are known
+        with numpy.errstate(invalid='ignore'):
+            batch_percentiles = numpy.array([numpy.nanpercentile(batch[0], self.monte_carlo_percentiles)
+                                             if numpy.any(~numpy.isnan(batch[0])) else
+                                             numpy.full(len(self.monte_carlo_percentiles), numpy.nan)
+                                             for batch in batches])
+            percentile_errors = (numpy.std(batch_percentiles, axis=0, ddof=1) / math.sqrt(len(batches))
+                                 if len(batches) > 1 else numpy.full(len(self.monte_carlo_percentiles), numpy.nan))
+
+        return {
+            'rhoR': rhoR,
+            'Rcm': Rcm,
+            'E1': energies,
+            'parameters': {name: values[i] for i, (parameter, name) in enumerate(self.__parameter_names__)},
+            'mean': numpy.mean(valid) if valid.size > 0 else numpy.nan,
+            'std': numpy.std(valid) if valid.size > 0 else numpy.nan,
+            'percentiles': dict(zip(self.monte_carlo_percentiles, history[-1][1])),
+            'samples': rhoR.size,
+            'valid fraction': valid.size / rhoR.size,
+            'time': time.perf_counter() - start,
+            'standard error': numpy.std(valid) / math.sqrt(valid.size) if valid.size > 0 else numpy.nan,
+            'percentile errors': dict(zip(self.monte_carlo_percentiles, percentile_errors)),
+            'history': history,
+        }
+
+    def Calc_Sobol_Indices(self, E1, samples=None, seed=None) -> dict:
+        """Variance-based (Sobol) sensitivity analysis: how much of the variance in the inferred rhoR is due to each
+        parameter, both by itself (the first-order index) and including its interactions with the others (the total
+        index), with the parameters distributed as in Calc_rhoR_MonteCarlo (Gaussians truncated at zero). This uses
+        Saltelli's sampling scheme on a scrambled Sobol sequence, with Saltelli's first-order estimator (centered on the
+        mean, since rhoR's mean is much bigger than its spread) and Jansen's total estimator, which take samples*(k+2)
+        model evaluations for k parameters with error bars. Those are evaluated monte_carlo_batch_size at a time as
+        batches of models, spread across a pool of self.workers processes. Any base sample where any of its
+        evaluations is unphysical or out of the model's range gets left out.
+
+        :param E1: Measured proton energy, which may be an array [MeV]
+        :param samples: (optional) Number of base samples, rounded up to a power of 2 {default=sobol_samples}
+        :param seed: (optional) Seed for the scrambling and the bootstrap, for reproducible results {default=None}
+        :returns: a dict with the 'parameters' (names, as in the error breakdown), the 'first order' and 'total'
+            indices and their bootstrap standard errors ('first order error' and 'total error'), each an array with a
+            row per parameter and a column per energy (zero for parameters without an error bar), the 'mean' and
+            'variance' of rhoR at each energy [g/cm2], 'E1' [MeV], 'samples' (base samples), 'valid fraction' (at each
+            energy), 'evaluations', and 'time' [s]
+        """
+        if self.dEdx_model != 'LP':
+            raise ValueError(f"the Sobol indices need the NumPy backend, which only does LP stopping, "
+                             f"not '{self.dEdx_model}'")
+        start = time.perf_counter()
+        E1 = numpy.atleast_1d(numpy.asarray(E1, dtype=float))
+        samples = self.sobol_samples if samples is None else samples
+        nominal = numpy.array([getattr(self, parameter)[1] for parameter, name in self.__parameter_names__])
+        error = numpy.array([getattr(self, f'{parameter}_err') for parameter, name in self.__parameter_names__])
+        varied = numpy.nonzero(error != 0)[0]
+
+        # the base matrices A and B, then A with each column in turn taken from B
+        sampler = scipy.stats.qmc.Sobol(2 * varied.size, seed=seed)
+        lower = numpy.tile(-nominal[varied] / numpy.abs(error[varied]), 2)  # no parameter can be negative
+        normal = scipy.stats.truncnorm.ppf(sampler.random_base2(math.ceil(math.log2(samples))), lower, numpy.inf)
+        A, B = normal[:, :varied.size], normal[:, varied.size:]
+        matrices = [A, B]
+        for i in range(varied.size):
+            AB = A.copy()
+            AB[:, i] = B[:, i]
+            matrices.append(AB)
+        num_samples = A.shape[0]
+        values = numpy.tile(nominal[:, numpy.newaxis], (1, len(matrices) * num_samples))
+        values[varied, :] += error[varied, numpy.newaxis] * numpy.concatenate(matrices).T
+
+        # evaluate the physical ones in batches
+        physical = numpy.nonzero(self.__physical__(values))[0]
+        batches = [physical[i:i + self.monte_carlo_batch_size]
+                   for i in range(0, physical.size, self.monte_carlo_batch_size)]
+        arguments = [(self.shell_mat, values[:, batch], self.E0, E1) for batch in batches]
+        workers = min(os.cpu_count() if self.workers is None else self.workers, len(batches))
+        if workers <= 1:
+            results = [_evaluate_rhoR(*args) for args in arguments]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_evaluate_rhoR, *zip(*arguments)))
+        rhoR = numpy.full((values.shape[1], E1.size), numpy.nan)
+        for batch, result in zip(batches, results):
+            rhoR[batch, :] = result
+        rhoR = rhoR.reshape((len(matrices), num_samples, E1.size))
+        valid = numpy.all(~numpy.isnan(rhoR), axis=0)
+
+        # then estimate the indices at each energy, and bootstrap their error bars
+        rng = numpy.random.default_rng(seed)
+        first_order = numpy.zeros((nominal.size, E1.size, 1 + self.sobol_bootstrap))
+        total = numpy.zeros((nominal.size, E1.size, 1 + self.sobol_bootstrap))
+        mean = numpy.full(E1.size, numpy.nan)
+        variance = numpy.full(E1.size, numpy.nan)
+        for j in range(E1.size):
+            f = rhoR[:, valid[:, j], j]
+            if f.shape[1] < 2:
+                first_order[:, j, :] = total[:, j, :] = numpy.nan
+                continue
+            mean[j] = numpy.mean(f[:2])
+            variance[j] = numpy.var(f[:2])
+            resamples = [numpy.arange(f.shape[1])] + [rng.integers(f.shape[1], size=f.shape[1])
+                                                      for k in range(self.sobol_bootstrap)]
+            for k, index in enumerate(resamples):
+                f_A, f_B, f_AB = f[0, index], f[1, index], f[2:, index]
+                V = numpy.var(numpy.concatenate([f_A, f_B]))
+                f_0 = numpy.mean(numpy.concatenate([f_A, f_B]))
+                first_order[varied, j, k] = numpy.mean((f_B - f_0) * (f_AB - f_A), axis=1) / V
+                total[varied, j, k] = numpy.mean((f_A - f_AB) ** 2, axis=1) / (2 * V)
+
+        return {
+            'parameters': [name for parameter, name in self.__parameter_names__],
+            'first order': first_order[:, :, 0],
+            'total': total[:, :, 0],
+            'first order error': numpy.std(first_order[:, :, 1:], axis=2),
+            'total error': numpy.std(total[:, :, 1:], axis=2),
+            'mean': mean,
+            'variance': variance,
+            'E1': E1,
+            'samples': num_samples,
+            'valid fraction': numpy.mean(valid, axis=0),
+            'evaluations': physical.size * E1.size,
+            'time': time.perf_counter() - start,
+        }
+
     def rhoR_Total(self, Rcm) -> tuple:
         """Calculate the total rhoR when the shell is at a given position.
 
-        :param Rcm: shell radius [cm]
+        :param Rcm: shell radius, which may be an array [cm]
         :returns: tuple containing (rhoR,error) with error due to the model
         """
         TotalError = self.__calc_error__("rhoR_Total", Rcm)
@@ -209,8 +431,8 @@ class rhoR_Analysis(object):
     def Calc_Rcm(self, E1, dE, ModelErr=True) -> tuple:
         """Calculate the shell Rcm.
 
-        :param E1: the measured energy [MeV]
-        :param dE: the energy uncertainty [MeV]
+        :param E1: the measured energy, which may be an array [MeV]
+        :param dE: the energy uncertainty, which may be an array [MeV]
         :param ModelErr: (optional) whether to include model errors {default=True}
         :returns: a tuple containing (Rcm,Uncertainty)
         """
@@ -222,24 +444,50 @@ class rhoR_Analysis(object):
         else:
             RcmModelErr = 0
 
-        # error due to dE, on low energy side:
-        Rcm_Emin = numpy.copy(Rcm)
-        Emin = E1
-        while Emin > (E1 - dE):
-            Rcm_Emin -= 1e-4
-            Emin = self.Eout(Rcm_Emin)[0]
-
-        # error due to dE, on high energy side:
-        Rcm_Emax = numpy.copy(Rcm)
-        Emax = E1
-        while Emax < (E1 + dE):
-            Rcm_Emax += 1e-4
-            Emax = self.Eout(Rcm_Emax)[0]
+        # error due to dE, by inverting the nominal model's table at either end of the error bar (clipped to the
+        # energies the table covers):
+        if self.model.__lazy__:
+            self.model.__build_tables__()
+        E_lo = numpy.maximum(numpy.subtract(E1, dE), self.model.__EoutList__[0])
+        E_hi = numpy.minimum(numpy.add(E1, dE), self.E0)
+        Rcm_Emin = self.model.Calc_rhoR(E_lo)[1]
+        Rcm_Emax = self.model.Calc_rhoR(E_hi)[1]
 
         # Calculate a quadrature sum total error:
-        TotalError = math.sqrt(RcmModelErr ** 2 + 0.25*(Rcm_Emax - Rcm_Emin) ** 2)
+        TotalError = numpy.sqrt(RcmModelErr ** 2 + 0.25*(Rcm_Emax - Rcm_Emin) ** 2)[()]
         return Rcm, TotalError
 
+    def __build_models__(self):
+        """Precompute the tables of the nominal and varied models that weren't in the cache, spread across a pool of
+        self.workers processes, and then freeze them all (see rhoR_Model.freeze), here and in the model bank. The
+        nominal model goes first, so that each varied model starts out with its trajectories to reuse. Since the models
+        can be shared thru the model bank (and one model can fill several places), each one is built and frozen once.
+        Only the frozen tables come back from the pool. Once they're all built, the shared store of stages is emptied,
+        since nothing will range protons thru them again."""
+        stages = self.model.__stages__
+        if self.model.__lazy__:
+            self.model.__build_tables__()
+        models = [self.model] + [model for model_set in self.__varied_models__ for model in model_set]
+        unbuilt = list({id(model): model for model in models if model.__lazy__}.values())
+        workers = min(os.cpu_count() if self.workers is None else self.workers, len(unbuilt))
+        tables = {}
+        if workers <= 1:
+            for model in unbuilt:
+                model.__build_tables__()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                for model, table in zip(unbuilt, executor.map(_build_model, unbuilt)):
+                    tables[id(model)] = table
+
+        for model in models:
+            if id(model) not in tables:
+                tables[id(model)] = model_bank.freeze_model(model)
+            else:
+                model_bank.freeze_model(model, tables[id(model)])
+        self.model = tables[id(self.model)]
+        self.__varied_models__ = [[tables[id(model)] for model in model_set] for model_set in self.__varied_models__]
+        stages.clear()
+
     def __setup_error_models__(self):
         """Set up extra models corresponding to varying each parameter."""
         # clear, just in case:
@@ -249,153 +497,228 @@ class rhoR_Analysis(object):
         # Vary the inner radius:
         new_set = []
         for Ri in [self.Ri[0], self.Ri[2]]:  # vary inner radius:
-            new_set.append(rhoR_Model(self.shell_mat, Ri, self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, Ri, self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Ri')
 
         # Vary the outer radius:
         new_set = []
         for Ro in [self.Ro[0], self.Ro[2]]:  # vary Ro:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], Ro, self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], Ro, self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Ro')
 
         # Vary the deuterium fraction:
         new_set = []
         for fD in [self.fD[0], self.fD[2]]:  # vary fD:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], fD, self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], fD, self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('fD')
 
         # Vary the 3He fraction::
         new_set = []
         for f3He in [self.f3He[0], self.f3He[2]]:  # vary f3He:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], f3He, self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], f3He, self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('f3He')
 
         # Vary the initial pressure:
         new_set = []
         for P0 in [self.P0[0], self.P0[2]]:  # vary P0:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], P0,
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], P0,
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('P0')
 
         # Vary the gas electron temperature:
         new_set = []
         for Te_Gas in [self.Te_Gas[0], self.Te_Gas[2]]:  # vary Te_Gas:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       Te_Gas, self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Gas Te')
 
         # Vary the shell electron temperature:
         new_set = []
         for Te_Shell in [self.Te_Shell[0], self.Te_Shell[2]]:  # vary Te_Shell:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], Te_Shell, self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Shell Te')
 
         # Vary the ablated material electron temp:
         new_set = []
         for Te_Abl in [self.Te_Abl[0], self.Te_Abl[2]]:  # vary Te_Abl:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], Te_Abl, self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Ablated Te')
 
         # Vary the Te_Mix:
         new_set = []
         for Te_Mix in [self.Te_Mix[0], self.Te_Mix[2]]:  # vary Te_Mix:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], Te_Mix,
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Mix Te')
 
         # Vary the maximum ablated material density:
         new_set = []
         for rho_Abl_Max in [self.rho_Abl_Max[0], self.rho_Abl_Max[2]]:  # vary rho_Abl_Max:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       rho_Abl_Max, self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Abl mass max rho')
 
         # Vary the minimum ablated mass density:
         new_set = []
         for rho_Abl_Min in [self.rho_Abl_Min[0], self.rho_Abl_Min[2]]:  # vary rho_Abl_Min:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], rho_Abl_Min, self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Abl mass min rho')
 
         # Vary the ablated mass scale length:
         new_set = []
         for rho_Abl_Scale in [self.rho_Abl_Scale[0], self.rho_Abl_Scale[2]]:  # vary rho_Abl_Scale:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], rho_Abl_Scale, self.f_Mix[1],
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Abl mass exp scale')
 
         # Vary the mix fraction:
         new_set = []
         for f_Mix in [self.f_Mix[0], self.f_Mix[2]]:  # vary f_Mix:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], f_Mix,
-                                      self.t_Shell[1], self.f_Remain[1], self.E0))
+                                      self.t_Shell[1], self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Mix fraction')
 
         # Vary the shell thickness:
         new_set = []
         for t_Shell in [self.t_Shell[0], self.t_Shell[2]]:  # vary t_Shell:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      t_Shell, self.f_Remain[1], self.E0))
+                                      t_Shell, self.f_Remain[1], self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Shell Thickness')
 
         # Vary the mass remaining::
         new_set = []
         for f_Remain in [self.f_Remain[0], self.f_Remain[2]]:  # vary f_Remain:
-            new_set.append(rhoR_Model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
+            new_set.append(model_bank.get_model(self.shell_mat, self.Ri[1], self.Ro[1], self.fD[1], self.f3He[1], self.P0[1],
                                       self.Te_Gas[1], self.Te_Shell[1], self.Te_Abl[1], self.Te_Mix[1],
                                       self.rho_Abl_Max[1], self.rho_Abl_Min[1], self.rho_Abl_Scale[1], self.f_Mix[1],
-                                      self.t_Shell[1], f_Remain, self.E0))
+                                      self.t_Shell[1], f_Remain, self.E0,
+                                      dEdx_model=self.dEdx_model, backend=self.backend, cache=self.cache))
         self.__varied_models__.append(new_set)
         self.__varied_model_names__.append('Mass Remaining')
 
+    # the parameters that get varied, in the order rhoR_Model takes them, and what to call each one
+    __parameter_names__ = [('Ri', 'Ri'), ('Ro', 'Ro'), ('fD', 'fD'), ('f3He', 'f3He'), ('P0', 'P0'),
+                           ('Te_Gas', 'Gas Te'), ('Te_Shell', 'Shell Te'), ('Te_Abl', 'Ablated Te'),
+                           ('Te_Mix', 'Mix Te'), ('rho_Abl_Max', 'Abl mass max rho'),
+                           ('rho_Abl_Min', 'Abl mass min rho'), ('rho_Abl_Scale', 'Abl mass exp scale'),
+                           ('f_Mix', 'Mix fraction'), ('t_Shell', 'Shell Thickness'), ('f_Remain', 'Mass Remaining')]
+
+    def __setup_jacobian_models__(self):
+        """Set up a pair of perturbed models for each parameter, for the linearized error bars. Each one moves one
+        parameter by -jacobian_step or +jacobian_step sigma, and is only evaluated at the nominal model's grid points,
+        in one pass."""
+        self.__varied_models__ = []
+        self.__varied_model_names__ = []
+        if self.model.__lazy__:
+            self.model.__build_tables__()
+        Rcm = self.model.__RcmList__[:-1]  # leave out the point at 2*Ri
+
+        for i, (parameter, name) in enumerate(self.__parameter_names__):
+            new_set = []
+            error = getattr(self, f'{parameter}_err')
+            for sign in ([-1, 1] if error != 0 else []):  # a parameter with no error bar doesn't need models
+                values = [getattr(self, p)[1] for p, _ in self.__parameter_names__]
+                values[i] += sign * self.jacobian_step * error
+                new_set.append(model_bank.get_model(self.shell_mat, *values, self.E0, dEdx_model=self.dEdx_model,
+                                                    backend=self.backend, grid=Rcm, stages=self.model.__stages__))
+            self.__varied_models__.append(new_set)
+            self.__varied_model_names__.append(name)
+
+    def __sample_parameters__(self, num_samples, rng) -> numpy.ndarray:
+        """Draw random values of the model parameters from Gaussians with their error bars, redrawing any sample that
+        isn't physical (see __physical__).
+
+        :param num_samples: the number of samples to draw
+        :param rng: the numpy.random.Generator to use
+        :returns: an array with one row per parameter, in the order rhoR_Model takes them
+        """
+        nominal = numpy.array([getattr(self, parameter)[1] for parameter, name in self.__parameter_names__])
+        error = numpy.array([getattr(self, f'{parameter}_err') for parameter, name in self.__parameter_names__])
+        values = numpy.empty((nominal.size, 0))
+        while values.shape[1] < num_samples:
+            new_values = nominal[:, numpy.newaxis] + error[:, numpy.newaxis]*rng.standard_normal((nominal.size,
+                                                                                                   num_samples))
+            values = numpy.concatenate([values, new_values[:, self.__physical__(new_values)]], axis=1)
+        return values[:, :num_samples]
+
+    @staticmethod
+    def __physical__(values) -> numpy.ndarray:
+        """Check which sets of model parameters make sense (e.g. no negative temperatures, and the inner radius inside
+        the outer radius).
+
+        :param values: an array with one row per parameter, in the order rhoR_Model takes them (Ri thru f_Remain)
+        :returns: whether each column is physical
+        """
+        (Ri, Ro, fD, f3He, P0, Te_Gas, Te_Shell, Te_Abl, Te_Mix,
+         rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale, f_Mix, t_Shell, f_Remain) = values
+        return (Ri > t_Shell/2) & (Ro > Ri) & (fD >= 0) & (f3He >= 0) & (P0 >= 0) & \
+               (Te_Gas > 0) & (Te_Shell > 0) & (Te_Abl > 0) & (Te_Mix > 0) & \
+               (rho_Abl_Max > rho_Abl_Min) & (rho_Abl_Min > 0) & (rho_Abl_Scale > 0) & \
+               (f_Mix >= 0) & (t_Shell > 0) & (f_Remain >= 0) & (f_Mix + f_Remain <= 1)
+
     def __call_func__(self, model, func, Rcm, E1=0):
         """Helper function for calculating errors. Calls an appropriate function of the model.
 
@@ -419,8 +742,8 @@ class rhoR_Analysis(object):
         """Helper function for calculating error bars due to uncertainties in model assumptions.
 
         :param func: The functional to call (i.e. Eout)
-        :param Rcm: The center of mass radius [cm]
-        :param E1: (optional) The energy to pass to func [MeV]
+        :param Rcm: The center of mass radius, which may be an array [cm]
+        :param E1: (optional) The energy to pass to func, which may be an array [MeV]
         :param breakdown: (optional) Whether to provide a summary of the sources of error [default = false]
         """
         if self.verbose:
@@ -437,22 +760,28 @@ class rhoR_Analysis(object):
             values = []
             for model in self.__varied_models__[row]:
                 values.append(self.__call_func__(model, func, Rcm, E1))
-
-            # calculate the error bar, if valid:
-            if numpy.nan not in values:
-                val_max = math.fabs(max(values))
-                val_min = math.fabs(min(values))
-                err = (val_max - val_min) / 2.0
+            if self.error_mode == 'jacobian':
+                # extrapolate the perturbed models' central difference linearly out to -1 and +1 sigma
+                change = (values[1] - values[0]) / (2 * self.jacobian_step) if len(values) > 0 else 0
+                values = [nominal - change, nominal + change]
+
+            # calculate the error bar wherever it's valid:
+            values = numpy.array(values, dtype=float)
+            valid = ~numpy.any(numpy.isnan(values), axis=0)
+            if numpy.any(valid):
+                val_max = numpy.absolute(numpy.max(values, axis=0))
+                val_min = numpy.absolute(numpy.min(values, axis=0))
+                err = numpy.where(valid, (val_max - val_min) / 2.0, numpy.nan)[()]
                 if self.verbose:
                     print(values, err)
-                TotalError += numpy.absolute(err**2.0)
+                TotalError += numpy.where(valid, err**2.0, 0)
 
                 # if requested, keep track of error sources:
                 if breakdown:
                     sources.append([self.__varied_model_names__[row], err])
 
         # Calculate quadrature sum of Errors, i.e. total error bar:
-        TotalError = numpy.sqrt(TotalError)
+        TotalError = numpy.sqrt(TotalError)[()]
 
         # return sources of error if requested:
         if breakdown:
@@ -460,3 +789,21 @@ class rhoR_Analysis(object):
 
         # default, just return total error:
         return TotalError
+
+
+def _evaluate_rhoR(shell_mat, values, E0, E1) -> numpy.ndarray:
+    """Find the rhoR for a batch of models at some energies, in a worker process.
+
+    :param shell_mat: the shell material
+    :param values: the model parameters, with a row per parameter (Ri thru f_Remain) and a column per model
+    :param E0: the initial proton energy [MeV]
+    :param E1: the measured proton energies [MeV]
+    :returns: the rhoR of each model at each energy, or nan where it's out of range [g/cm2]
+    """
+    model = rhoR_Model(shell_mat, *values[:, :, numpy.newaxis], E0, backend='numpy', cache=False)
+    return model.Calc_rhoR(E1)[0]
+
+
+def _build_model(model):
+    """Precompute a model's tables in a worker process and send back the frozen model."""
+    return model.freeze()
@@ -5,7 +5,14 @@ import numpy
 
 from src.Constants import me, mp
 from src.Material import Material
-from src.StopPow import StopPow_LP, DoubleVector, StopPow_BPS, StopPow_Zimmerman
+from src import model_cache
+from src.StopPow_numpy import Eout_LP, dEdx_LP, Emin as Emin_numpy
+try:
+    from src.StopPow import StopPow_LP, DoubleVector, StopPow_BPS, StopPow_Zimmerman
+    StopPow_error = None
+except ImportError as e:  # the NumPy backend can still do LP without it, but only if it's asked for
+    StopPow_LP, DoubleVector, StopPow_BPS, StopPow_Zimmerman = None, None, None, None
+    StopPow_error = e
 
 __author__ = 'Alex Zylstra'
 
@@ -31,6 +38,17 @@ class rhoR_Model(object):
     :param f_Remain: (optional) mass remaining of the in-flight shell [fractional] {default=0.15}
     :param E0: (optional) initial proton energy [MeV] {default=14.7}
     :param dEdx_model: (optional) Stopping model to use, valid choices are 'LP', 'BPS', 'Z' {default='LP'}
+    :param backend: (optional) Stopping power implementation to use, valid choices are 'SWIG' (the StopPow library)
+        or 'numpy' (StopPow_numpy, which is vectorized but only does 'LP') {default='SWIG' if it's installed}
+    :param cache: (optional) whether to load the precomputed tables from (and save them to) the on-disk model cache in
+        src.model_cache, which is keyed by all of the above plus the stepping options and the code version {default=True}
+    :param lazy: (optional) whether to put off precomputing the tables and instead answer each Calc_rhoR query by
+        root-finding, keeping every point it evaluates for later queries, until it's evaluated lazy_max_evaluations
+        points or something needs the full table (unless the tables are already in the cache) {default=False}
+
+    Any of the parameters from Ri to f_Remain may also be arrays, in which case this is a whole batch of models, one for
+    each element, that get evaluated together in array passes (with the NumPy backend). A batch of models has no tables;
+    Eout and Calc_rhoR evaluate each element directly, and Calc_rhoR root-finds every element at once.
     :raise ValueError: if one of the given parameters is invalid (e.g. if outer radius is nonpositive)
     :author: Alex Zylstra
     :date: 2014/09/25
@@ -41,21 +59,50 @@ class rhoR_Model(object):
     rho_3He_STP = (3 / 4) * 0.1786e-3  # density of 3he gas at STP [g/cc]
 
     dEdx_models_avail = ['LP', 'BPS', 'Z']
+    backends_avail = ['SWIG', 'numpy']
 
     # options for stop pow calculations:
-    steps = 100  # steps in radius per region
+    abl_tolerance = 1e-3  # largest energy error allowed per step thru the ablated mass [MeV]
+    abl_max_step_growth = 5.  # largest factor by which one step in the ablated mass can exceed the last
+    # the coarse precomputed grid shrinks Rcm by Rcm_step at each point, and is then refined where it needs it. The NumPy
+    # backend's cost is mostly per array pass, not per point, so it starts finer and refines less.
+    Rcm_step = {'SWIG': 1/15., 'numpy': 1/30.}  # fractional decrease in Rcm between points of the coarse grid
+    Eout_tolerance = 1e-2  # largest error allowed when linearly interpolating between precomputed points [MeV]
+    max_refinements = {'SWIG': 4, 'numpy': 1}  # most passes to make refining the coarse grid
+    max_subdivisions = 8  # most pieces an interval of the precomputed grid may be split into in one pass
+    batch_size = {'SWIG': 16, 'numpy': 64}  # number of coarse Rcm points to precompute per array pass
+    range_out_points = {'SWIG': 1, 'numpy': 7}  # number of Rcm points per pass when narrowing down the range-out
+    # options for lazy mode:
+    lazy_Rcm_step = 1/4.  # fractional decrease in Rcm between the points used to bracket a query
+    lazy_points = {'SWIG': 1, 'numpy': 7}  # number of Rcm points to evaluate per pass when bracketing a query
+    lazy_max_evaluations = 60  # number of points to evaluate in lazy mode before just building the full table
+    # options for sharing stages between models:
+    max_stages = 64  # most region stages a shared store keeps, dropping the least recently used
 
     def __init__(self,
                  shell_mat, Ri, Ro, fD, f3He, P0,
                  Te_Gas, Te_Shell, Te_Abl, Te_Mix,
                  rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale,
                  f_Mix, t_Shell, f_Remain,
-                 E0, dEdx_model='LP'):
+                 E0, dEdx_model='LP', backend=None, cache=True, lazy=False):
         """Initialize the rhoR model."""
-        if Ri <= 0 or Ro <= 0 or fD < 0 or f3He < 0 or P0 < 0 or \
-                Te_Gas <= 0 or Te_Shell <= 0 or Te_Abl <= 0 or Te_Mix <= 0 or \
-                rho_Abl_Max <= 0 or rho_Abl_Min <= 0 or rho_Abl_Scale <= 0 or \
-                f_Mix < 0 or t_Shell <= 0 or f_Remain < 0 or E0 <= 0:
+        varied = (Ri, Ro, fD, f3He, P0, Te_Gas, Te_Shell, Te_Abl, Te_Mix,
+                  rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale, f_Mix, t_Shell, f_Remain)
+        self.__batch__ = any(numpy.ndim(value) > 0 for value in varied)
+        self.__batch_shape__ = numpy.broadcast_shapes(*(numpy.shape(value) for value in varied))
+        if backend is None:
+            backend = 'numpy' if self.__batch__ else self.default_backend()
+        if backend not in self.backends_avail:
+            raise ValueError(f"I don't have a stopping power backend called '{backend}'")
+        elif backend == 'SWIG' and DoubleVector is None:
+            raise ValueError("the StopPow library isn't installed, so you can't use the SWIG backend")
+        elif backend == 'numpy' and dEdx_model != 'LP':
+            raise ValueError(f"the NumPy backend only does LP stopping, not '{dEdx_model}'")
+        elif backend == 'SWIG' and self.__batch__:
+            raise ValueError("only the NumPy backend can evaluate a batch of models")
+        if any(numpy.any(numpy.less_equal(value, 0)) for value in [
+                    Ri, Ro, Te_Gas, Te_Shell, Te_Abl, Te_Mix, rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale, t_Shell, E0]) or \
+                any(numpy.any(numpy.less(value, 0)) for value in [fD, f3He, P0, f_Mix, f_Remain]):
             raise ValueError("you passd something negative.  idk which one.")
 
         self.shell = Material(shell_mat)
@@ -76,6 +123,16 @@ class rhoR_Model(object):
         self.f_Remain = f_Remain
         self.E0 = E0
         self.dEdx_model = dEdx_model
+        self.backend = backend
+        # everything that was passed to the constructor, for identifying this model
+        self.__parameters__ = (shell_mat, Ri, Ro, fD, f3He, P0, Te_Gas, Te_Shell, Te_Abl, Te_Mix,
+                               rho_Abl_Max, rho_Abl_Min, rho_Abl_Scale, f_Mix, t_Shell, f_Remain,
+                               E0, dEdx_model, backend)
+        self.abl_steps = 0  # total steps taken thru the ablated mass
+        self.abl_evaluations = 0  # total stopping power evaluations in the ablated mass
+        self.lazy_evaluations = 0  # total points evaluated in lazy mode
+        self.stopping_power_allocations = 0  # total stopping power objects constructed (SWIG backend)
+        self.stopping_power_updates = 0  # total times a pooled stopping power object's field was changed
 
         # calculate initial gas density in g/cc
         self.rho0_Gas = P0 * ((fD / 2) * self.rho_D2_STP + f3He * self.rho_3He_STP)
@@ -90,191 +147,458 @@ class rhoR_Model(object):
         # shell material shorthand:
         A = self.shell.A
         Z = self.shell.Z
-        # Set up DoubleVectors for gas plus mix stopping power
-        self.__mfGasMix__ = DoubleVector(3+len(A))  # eg e-, D , 3He , H , C
-        self.__mfGasMix__[0] = 2
-        self.__mfGasMix__[1] = 3
-        for i in range(len(A)):
-            self.__mfGasMix__[2+i] = A[i]
-        self.__mfGasMix__[-1] = me / mp
-        self.__ZfGasMix__ = DoubleVector(3+len(A))  # eg e-, D , 3He , H , C
-        self.__ZfGasMix__[0] = 1
-        self.__ZfGasMix__[1] = 2
-        for i in range(len(Z)):
-            self.__ZfGasMix__[2+i] = Z[i]
-        self.__ZfGasMix__[-1] = -1
-        self.__TfGasMix__ = DoubleVector(3+len(A))  # eg e-, D , 3He , H , C
-        self.__TfGasMix__[0] = self.Te_Gas
-        self.__TfGasMix__[1] = self.Te_Gas
-        for i in range(len(Z)):
-            self.__TfGasMix__[2+i] = self.Te_Mix
-        self.__TfGasMix__[-1] = self.Te_Gas
-        # For partially-ionized models (i.e. Zimmerman)
-        self.__mfGasMix_PI__ = DoubleVector(2+len(A))  # eg e-, D , 3He , H , C
-        self.__mfGasMix_PI__[0] = 2
-        self.__mfGasMix_PI__[1] = 3
-        for i in range(len(A)):
-            self.__mfGasMix_PI__[2+i] = A[i]
-        self.__ZfGasMix_PI__ = DoubleVector(2+len(A))  # eg e-, D , 3He , H , C
-        self.__ZfGasMix_PI__[0] = 1
-        self.__ZfGasMix_PI__[1] = 2
-        for i in range(len(Z)):
-            self.__ZfGasMix_PI__[2+i] = Z[i]
-        self.__ZbarGasMix_PI__ = DoubleVector(2+len(A))  # eg e-, D , 3He , H , C
-        self.__ZbarGasMix_PI__[0] = 1
-        self.__ZbarGasMix_PI__[1] = 2
-        for i in range(len(Z)):
-            self.__ZbarGasMix_PI__[2+i] = Z[i]
-        self.__TfGasMix_PI__ = DoubleVector(2+len(A))  # eg e-, D , 3He , H , C
-        self.__TfGasMix_PI__[0] = self.Te_Gas
-        self.__TfGasMix_PI__[1] = self.Te_Gas
-        for i in range(len(Z)):
-            self.__TfGasMix_PI__[2+i] = self.Te_Mix
-
-        # some field particle info for the shell stopping power:
-        self.__mfShell__ = DoubleVector(1+len(A))
-        for i in range(len(A)):
-            self.__mfShell__[i] = A[i]
-        self.__mfShell__[-1] = me / mp
-        self.__ZfShell__ = DoubleVector(1+len(Z))
-        for i in range(len(Z)):
-            self.__ZfShell__[i] = Z[i]
-        self.__ZfShell__[-1] = -1
-        self.__TfShell__ = DoubleVector(1+len(A))
-        for i in range(1+len(A)):
-            self.__TfShell__[i] = Te_Shell
-        # And for the partially-ionized models
-        self.__mfShell_PI__ = DoubleVector(len(A))
-        for i in range(len(A)):
-            self.__mfShell_PI__[i] = A[i]
-        self.__ZfShell_PI__ = DoubleVector(len(Z))
-        for i in range(len(Z)):
-            self.__ZfShell_PI__[i] = Z[i]
-        self.__ZbarShell_PI__ = DoubleVector(len(Z))
-        for i in range(len(Z)):
-            self.__ZbarShell_PI__[i] = Z[i]
-        self.__TfShell_PI__ = DoubleVector(len(A))
-        for i in range(len(A)):
-            self.__TfShell_PI__[i] = Te_Shell
-
-        # field particle info for the ablated material stopping power:
-        self.__mfAbl__ = DoubleVector(1+len(A))
-        for i in range(len(A)):
-            self.__mfAbl__[i] = A[i]
-        self.__mfAbl__[-1] = me / mp
-        self.__ZfAbl__ = DoubleVector(1+len(Z))
-        for i in range(len(Z)):
-            self.__ZfAbl__[i] = Z[i]
-        self.__ZfAbl__[-1] = -1
-        self.__TfAbl__ = DoubleVector(1+len(A))
-        for i in range(1+len(A)):
-            self.__TfAbl__[i] = self.Te_Abl
-        # And for the partially-ionized models
-        self.__mfAbl_PI__ = DoubleVector(len(A))
-        for i in range(len(A)):
-            self.__mfAbl_PI__[i] = A[i]
-        self.__ZfAbl_PI__ = DoubleVector(len(Z))
-        for i in range(len(Z)):
-            self.__ZfAbl_PI__[i] = Z[i]
-        self.__ZbarAbl_PI__ = DoubleVector(len(Z))
-        for i in range(len(Z)):
-            self.__ZbarAbl_PI__[i] = Z[i]
-        self.__TfAbl_PI__ = DoubleVector(len(A))
-        for i in range(len(A)):
-            self.__TfAbl_PI__[i] = self.Te_Abl
+        # masses, charges, and temperatures of the field particles in each region, eg D, 3He, H, C, e-
+        self.__fields__ = {
+            'GasMix': ([2, 3] + A + [me / mp], [1, 2] + Z + [-1],
+                       [self.Te_Gas, self.Te_Gas] + [self.Te_Mix]*len(A) + [self.Te_Gas]),
+            'Shell': (A + [me / mp], Z + [-1], [self.Te_Shell]*(len(A) + 1)),
+            'Abl': (A + [me / mp], Z + [-1], [self.Te_Abl]*(len(A) + 1)),
+        }
+        self.__setup_stopping_powers__()
+
+        # everything that goes into each region's downshift, up to and including that region, for sharing the results
+        # between models (see __stage__). The ablated mass is the last region, so nothing downstream of it is shared.
+        gas_key = (shell_mat, dEdx_model, backend, E0, Ri, Ro, fD, f3He, P0, Te_Gas, Te_Mix, f_Mix, t_Shell)
+        self.__stage_keys__ = {
+            'GasMix': ('GasMix',) + gas_key,
+            'Shell': ('Shell',) + gas_key + (f_Remain, Te_Shell),
+        }
+        self.__stages__ = {}
 
         # set up arrays for precomputed data for a few things:
-        self.__RcmList__ = [2*self.Ri]
-        self.__EoutList__ = [E0]
-        self.__rhoRList__ = [0]
+        self.__RcmList__ = []
+        self.__EoutList__ = []
+        self.__rhoRList__ = []
         self.__interp_Eout__ = 0
         self.__interp_rhoR__ = 0
         self.__interp_Rcm__ = 0
 
-        # precompute Eout and rhoR vs Rcm
+        # precompute Eout and rhoR vs Rcm, or load them if this exact model has been computed before
+        self.__cache_key__ = None
+        if cache and not self.__batch__:
+            self.__cache_key__ = model_cache.table_key(
+                *self.__parameters__,
+                self.Rcm_step[backend], self.Eout_tolerance, self.max_refinements[backend],
+                self.max_subdivisions, self.range_out_points[backend],
+                self.abl_tolerance, self.abl_max_step_growth)
+            tables = model_cache.load_tables(self.__cache_key__)
+        else:
+            tables = None
+        self.__lazy__ = lazy and tables is None and not self.__batch__
+        if tables is not None:
+            self.__RcmList__ = tables['Rcm']
+            self.__EoutList__ = tables['Eout']
+            self.__rhoRList__ = tables['rhoR']
+            self.__setup_interpolation__()
+        elif self.__batch__:
+            pass  # a batch of models doesn't have tables
+        elif self.__lazy__:
+            # in lazy mode, the tables just hold the points evaluated so far, starting with the unshifted energy
+            self.__RcmList__ = numpy.array([2*self.Ri])
+            self.__EoutList__ = numpy.array([float(self.E0)])
+        else:
+            self.__build_tables__()
+
+    @staticmethod
+    def default_backend():
+        """The stopping power backend to use when none is given, which is the StopPow library. The NumPy backend
+        doesn't stand in for it automatically, since its agreement with StopPow_LP hasn't been measured yet.
+
+        :returns: 'SWIG'
+        :raise ValueError: if the StopPow library isn't installed
+        """
+        if DoubleVector is None:
+            raise ValueError(f"the StopPow library couldn't be imported ({StopPow_error}). pass backend='numpy' to use "
+                             f"the NumPy stopping power instead (see src/StopPow_numpy.py for how well it agrees).")
+        return 'SWIG'
+
+    def __setup_stopping_powers__(self):
+        """Set up the StopPow library's vectors of field particle properties (for the SWIG backend) and the empty pools
+        that the stopping power objects get put in as they're needed."""
+        if self.backend == 'SWIG':
+            for region, (mf, Zf, Tf) in self.__fields__.items():
+                setattr(self, f'__mf{region}__', self.__DoubleVector__(mf))
+                setattr(self, f'__Zf{region}__', self.__DoubleVector__(Zf))
+                setattr(self, f'__Tf{region}__', self.__DoubleVector__(Tf))
+                # For partially-ionized models (i.e. Zimmerman), which leave out the electrons
+                setattr(self, f'__mf{region}_PI__', self.__DoubleVector__(mf[:-1]))
+                setattr(self, f'__Zf{region}_PI__', self.__DoubleVector__(Zf[:-1]))
+                setattr(self, f'__Zbar{region}_PI__', self.__DoubleVector__(Zf[:-1]))
+                setattr(self, f'__Tf{region}_PI__', self.__DoubleVector__(Tf[:-1]))
+        # one long-lived stopping power object per region, with the densities it was last set to
+        self.__stopping_powers__ = {}
+        self.__nf_vectors__ = {}
+        self.__nf_current__ = {}
+
+    def __getstate__(self) -> dict:
+        """Get everything needed to pickle this model, which leaves out the StopPow library's objects since they
+        can't be pickled (they get set up again when it's unpickled)."""
+        state = {key: value for key, value in self.__dict__.items()
+                 if not (key.startswith('__mf') or key.startswith('__Zf') or
+                         key.startswith('__Tf') or key.startswith('__Zbar'))}
+        for key in ['__stopping_powers__', '__nf_vectors__', '__nf_current__']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state: dict):
+        """Restore a pickled model."""
+        self.__dict__.update(state)
+        self.__setup_stopping_powers__()
+
+    def __build_tables__(self):
+        """Precompute the tables, save them to the cache if it's on, and set up interpolation."""
+        self.__lazy__ = False
+        self.__precompute_tables__()
+        if self.__cache_key__ is not None:
+            model_cache.save_tables(self.__cache_key__, {'Rcm': self.__RcmList__,
+                                                         'Eout': self.__EoutList__,
+                                                         'rhoR': self.__rhoRList__})
+        self.__setup_interpolation__()
+
+    def freeze(self):
+        """Boil this model down to a rhoR_Table, which answers the same queries from the same tables but can be pickled
+        (or kept around by the hundred) cheaply. The tables get built first if this model is lazy.
+
+        :returns: the frozen model
+        """
+        if self.__lazy__:
+            self.__build_tables__()
+        return rhoR_Table(self)
+
+    def __setup_interpolation__(self):
+        """Set up interpolation on the precomputed tables."""
+        self.__interp_Eout__ = self.__interpolator__(self.__RcmList__, self.__EoutList__)
+        self.__interp_Rcm__ = self.__interpolator__(self.__EoutList__, self.__RcmList__)
+        self.__interp_rhoR__ = self.__interpolator__(self.__EoutList__, self.__rhoRList__)
+
+    def __precompute_tables__(self):
+        """Precompute Eout and rhoR vs Rcm. This starts with a coarse geometric grid of Rcm that shrinks by Rcm_step at each
+        point, evaluated as arrays batch_size points at a time until the protons range out. Then it refines the grid
+        wherever the table's curvature says linear interpolation would be off by more than Eout_tolerance, evaluating all
+        of the new points in one array pass each time, up to max_refinements times. Each of those passes also narrows
+        down where the protons range out.
+        """
+        Rcm = []
+        Eout = []
         r = self.Ri
-        dr = r/50.
-        Eout = self.__precompute_Eout__(r)
-        while Eout > 0.:
-            Eout = self.__precompute_Eout__(r)
-            rhoR = self.rhoR_Total(r)
-            if Eout >= 0.:
-                self.__RcmList__.append(r)
-                self.__EoutList__.append(Eout)
-                self.__rhoRList__.append(rhoR)
-
-            # decrement r:
-            r -= dr
-            dr = r/50.
-
-        # have to flip the arrays to make spline happy:
-        self.__RcmList__ = self.__RcmList__[::-1]
-        self.__EoutList__ = self.__EoutList__[::-1]
-        self.__rhoRList__ = self.__rhoRList__[::-1]
-        # also cut off one:
-        self.__RcmList__ = self.__RcmList__[1:]
-        self.__EoutList__ = self.__EoutList__[1:]
-        self.__rhoRList__ = self.__rhoRList__[1:]
-
-        # set up interpolation:
-        self.__interp_Eout__ = scipy.interpolate.interp1d(self.__RcmList__, self.__EoutList__, kind='linear', bounds_error=True)
-        self.__interp_Rcm__ = scipy.interpolate.interp1d(self.__EoutList__, self.__RcmList__, kind='linear', bounds_error=True)
-        self.__interp_rhoR__ = scipy.interpolate.interp1d(self.__EoutList__, self.__rhoRList__, kind='linear', bounds_error=True)
+        Rcm_ranged_out = None  # the largest Rcm we know the protons range out at
+        while r > self.t_Shell/2:
+            batch = r * (1 - self.Rcm_step[self.backend])**numpy.arange(self.batch_size[self.backend])
+            batch = batch[batch > self.t_Shell/2]  # the gas region can't have negative radius
+            E = self.__precompute_Eout__(batch)
+            ranged_out = numpy.nonzero(E <= 0)[0]
+            if ranged_out.size > 0:
+                Rcm.extend(batch[:ranged_out[0]])
+                Eout.extend(E[:ranged_out[0]])
+                Rcm_ranged_out = batch[ranged_out[0]]
+                break
+            Rcm.extend(batch)
+            Eout.extend(E)
+            r = batch[-1] * (1 - self.Rcm_step[self.backend])
+        Rcm = numpy.array(Rcm[::-1])
+        Eout = numpy.array(Eout[::-1])
+
+        bracket = (Rcm_ranged_out, Rcm[0]) if Rcm_ranged_out is not None and Rcm.size > 0 else None
+        for i in range(self.max_refinements[self.backend]):
+            new_Rcm = self.__refinement_points__(Rcm, Eout)
+            num_refinements = new_Rcm.size
+            if num_refinements == 0:
+                break
+            # each pass also narrows down where the protons range out, since it's nearly free to do so
+            if bracket is not None:
+                num_points = self.range_out_points[self.backend]
+                new_Rcm = numpy.concatenate([new_Rcm, numpy.geomspace(*bracket, num_points + 2)[1:-1]])
+            new_Eout = self.__precompute_Eout__(new_Rcm)
+            if bracket is not None:
+                Rcm_bracket = numpy.concatenate([[bracket[0]], new_Rcm[num_refinements:], [bracket[1]]])
+                E_bracket = numpy.concatenate([[0], new_Eout[num_refinements:], [1]])
+                j = numpy.nonzero(E_bracket > 0)[0][0]
+                bracket = (Rcm_bracket[j - 1], Rcm_bracket[j])
+
+            # add every new point that didn't range out to the table
+            Rcm = numpy.concatenate([Rcm, new_Rcm[new_Eout > 0]])
+            Eout = numpy.concatenate([Eout, new_Eout[new_Eout > 0]])
+            order = numpy.argsort(Rcm)
+            Rcm, Eout = Rcm[order], Eout[order]
+
+        self.__store_tables__(Rcm, Eout)
+
+    def __build_tables_at__(self, Rcm):
+        """Precompute the tables at just the given shell radii, in one array pass, instead of picking the points
+        adaptively, and set up interpolation. This is for perturbations of another model, which can reuse its grid.
+        Nothing is saved to the cache.
+
+        :param Rcm: the shell radii to tabulate, in increasing order and less than 2*Ri [cm]
+        """
+        self.__lazy__ = False
+        Rcm = numpy.asarray(Rcm, dtype=float)
+        Eout = self.__precompute_Eout__(Rcm)
+        self.__store_tables__(Rcm[Eout > 0], Eout[Eout > 0])
+        self.__setup_interpolation__()
+
+    def __store_tables__(self, Rcm, Eout):
+        """Fill in the tables from the precomputed points where the protons didn't range out.
 
+        :param Rcm: the shell radii, in increasing order [cm]
+        :param Eout: the final proton energies at those radii [MeV]
+        """
+        # right at the range-out, the energies are too small to be monotonic, so drop any that are out of order
+        monotonic = Eout < numpy.append(numpy.minimum.accumulate(Eout[:0:-1])[::-1], numpy.inf)
+        Rcm, Eout = Rcm[monotonic], Eout[monotonic]
+
+        # the outermost point is the unshifted energy with no rhoR:
+        Rcm = numpy.append(Rcm, 2*self.Ri)
+        Eout = numpy.append(Eout, self.E0)
+        rhoR = numpy.append(self.rhoR_Total(Rcm[:-1]), 0)
+
+        # store them in order of increasing Rcm to make spline happy:
+        self.__RcmList__ = Rcm
+        self.__EoutList__ = Eout
+        self.__rhoRList__ = rhoR
+
+    def __refinement_points__(self, Rcm, Eout) -> numpy.ndarray:
+        """Pick the points to add to a table of Eout vs Rcm so that interpolating it is good to Eout_tolerance.
+        The interpolation error on each interval is estimated from the table's curvature (in log(Rcm)) at either end,
+        and since that error goes as the square of the interval's width, it says how many pieces to split it into.
+
+        :param Rcm: the shell radii in the table, in increasing order [cm]
+        :param Eout: the final proton energies at those radii [MeV]
+        :returns: the new shell radii to evaluate [cm]
+        """
+        if Rcm.size < 3:
+            return numpy.empty(0)
+        x = numpy.log(Rcm)
+        h = numpy.diff(x)
+        slope = numpy.diff(Eout)/h
+        curvature = numpy.abs(2*numpy.diff(slope)/(x[2:] - x[:-2]))
+        curvature = numpy.concatenate([curvature[:1], curvature, curvature[-1:]])
+        error = numpy.maximum(curvature[:-1], curvature[1:])*h**2/8
+        pieces = numpy.minimum(numpy.ceil(numpy.sqrt(error/self.Eout_tolerance)), self.max_subdivisions).astype(int)
+        return numpy.concatenate([numpy.exp(x[j] + h[j]*numpy.arange(1, pieces[j])/pieces[j])
+                                  for j in range(h.size)])
 
     def Eout(self, Rcm) -> float:
         """Main function, which calculates the proton energy downshift.
 
-        :param Rcm: shell radius at shock BT [cm]
-        :returns: the final proton energy [MeV]
+        :param Rcm: shell radius at shock BT, which may be an array [cm]
+        :returns: the final proton energy, or nan outside of the precomputed table (for a batch of models, 0 where the
+            protons range out) [MeV]
         """
-        Eout = numpy.nan
-        try:
-            Eout = self.__interp_Eout__(Rcm)
-        except ValueError:
-            Eout = numpy.nan
-        return Eout
+        if self.__batch__:
+            shape = numpy.broadcast_shapes(numpy.shape(Rcm), self.__batch_shape__)
+            return self.__precompute_Eout__(numpy.broadcast_to(Rcm, shape))[()]
+        if self.__lazy__:
+            self.__build_tables__()
+        return self.__interp_Eout__(Rcm)[()]
+
+    def __precompute_Eout__(self, Rcm) -> numpy.ndarray:
+        """Calculate the proton energy downshift for a whole array of shell radii in one pass.
+
+        :param Rcm: array of shell radii at shock BT [cm]
+        :returns: the final proton energies [MeV]
+        """
+        Rcm = numpy.asarray(Rcm, dtype=float)
+        assert numpy.all(Rcm >= 0)
+        E = numpy.full(Rcm.shape, float(self.E0))
+        for region in ['GasMix', 'Shell', 'Abl']:
+            E = self.__stage__(region, Rcm, E)
+        return numpy.maximum(E, 0)
+
+    def __stage__(self, region, Rcm, E) -> numpy.ndarray:
+        """Range an array of protons thru one region, reusing any that have already been ranged thru it at the same
+        shell radius by a model whose inputs up to and including this region are the same (e.g. a varied model that
+        only changes the ablated mass reuses the nominal model's trajectories thru the gas and shell). Each stage is
+        kept in __stages__, which rhoR_Analysis shares between its models, as a sorted array of the shell radii done so
+        far and an array of the energies coming out at them. The store keeps the max_stages most recently used.
+
+        :param region: which region to range thru ('GasMix', 'Shell', or 'Abl')
+        :param Rcm: array of shell radii at shock BT [cm]
+        :param E: the proton energies going into the region [MeV]
+        :returns: the proton energies coming out of the region [MeV]
+        """
+        if self.__batch__ or region not in self.__stage_keys__:  # a batch of models has no one set of inputs to key on
+            return self.__transport__(region, Rcm, E)
+        key = self.__stage_keys__[region]
+        Rcm_done, E_done = self.__stages__.pop(key, (numpy.empty(0), numpy.empty(0)))
+        Rcm_flat = Rcm.ravel()
+        index = numpy.minimum(numpy.searchsorted(Rcm_done, Rcm_flat), max(Rcm_done.size - 1, 0))
+        missing = numpy.ones(Rcm_flat.size, dtype=bool) if Rcm_done.size == 0 else Rcm_done[index] != Rcm_flat
+        if numpy.any(missing):
+            E_new = self.__transport__(region, Rcm_flat[missing], E.ravel()[missing])
+            Rcm_done, unique = numpy.unique(numpy.concatenate([Rcm_done, Rcm_flat[missing]]), return_index=True)
+            E_done = numpy.concatenate([E_done, E_new])[unique]
+            index = numpy.searchsorted(Rcm_done, Rcm_flat)
+        self.__stages__[key] = (Rcm_done, E_done)
+        while len(self.__stages__) > self.max_stages:
+            del self.__stages__[next(iter(self.__stages__))]
+        return E_done[index].reshape(Rcm.shape)
+
+    def __transport__(self, region, Rcm, E) -> numpy.ndarray:
+        """Range an array of protons thru one region.
+
+        :param region: which region to range thru ('GasMix', 'Shell', or 'Abl')
+        :param Rcm: array of shell radii at shock BT [cm]
+        :param E: the proton energies going into the region [MeV]
+        :returns: the proton energies coming out of the region [MeV]
+        """
+        l_gas = numpy.maximum(0, 1e4 * (Rcm - self.t_Shell/2))  # length in um
+        if region == 'GasMix':
+            # range through gas+mix:
+            return self.Eout_GasMix(E, l_gas, Rcm)
+        elif region == 'Shell':
+            #range through shell:
+            l_shell = 1e4 * (Rcm + self.t_Shell/2) - l_gas
+            return self.Eout_Shell(E, l_shell, Rcm)
+        else:
+            #range through ablated mass gradient:
+            r1, r2, r3 = self.get_Abl_radii(Rcm)
+            return self.Eout_Abl(E, r1, r2, r3, Rcm)
 
-    def __precompute_Eout__(self, Rcm) -> float:
-        """Main function, which calculates the proton energy downshift.
+    def Calc_rhoR(self, E1) -> tuple:
+        """Alternative analysis method: specify measured E and calculate rhoR.
 
-        :param Rcm: shell radius at shock BT [cm]
-        :returns: the final proton energy [MeV]
+        :param E1: Measured proton energy, which may be an array [MeV]
+        :returns: model areal density to produced measured E [g/cm2], Rcm [cm], both nan outside of the table
         """
-        assert Rcm >= 0
-        E = self.E0
-        # range through gas+mix:
-        l_gas = max(0, 1e4 * (Rcm - self.t_Shell/2))  # length in um
-        E = self.Eout_GasMix(E, l_gas, Rcm)
+        if self.__batch__:
+            Rcm = self.__batch_Rcm__(E1)
+        elif self.__lazy__:
+            Rcm = numpy.vectorize(self.__lazy_Rcm__, otypes=[float])(E1)
+        else:
+            # the interpolator returns nan outside of the table's limits:
+            Rcm = self.__interp_Rcm__(E1)
+        return self.rhoR_Total(Rcm), Rcm[()]
 
-        #range through shell:
-        l_shell = 1e4 * (Rcm + self.t_Shell/2) - l_gas
-        if (l_shell < 0):
-            print(l_shell)
-        E = self.Eout_Shell(E, l_shell, Rcm)
+    def __lazy_Rcm__(self, E1) -> float:
+        """Find the shell radius that produces one measured energy in lazy mode. This brackets it with a few coarse
+        points, then narrows the bracket down (by false position for SWIG and by evaluating lazy_points points at once
+        for NumPy) until the energy changes by no more than Eout_tolerance across it, and interpolates. Every point
+        evaluated along the way is kept, so a later query that lands in an interval that's already small enough costs
+        nothing. Once lazy_max_evaluations points have been evaluated, this builds the full tables instead.
 
-        #range through ablated mass gradient:
-        r1, r2, r3 = self.get_Abl_radii(Rcm)
-        E = self.Eout_Abl(E, r1, r2, r3, Rcm)
+        :param E1: Measured proton energy [MeV]
+        :returns: Rcm [cm], or nan if no Rcm gives that energy
+        """
+        if self.__lazy__ and self.lazy_evaluations >= self.lazy_max_evaluations:
+            self.__build_tables__()
+        if not self.__lazy__:
+            return self.__interp_Rcm__(E1)[()]
+        if not 0 < E1 <= self.E0:
+            return numpy.nan
+
+        # work inward from the smallest Rcm so far until some point's energy is lower than E1
+        while numpy.all(self.__EoutList__ >= E1):
+            steps = numpy.arange(self.lazy_points[self.backend])
+            if self.__RcmList__[0] > self.Ri:  # nothing but the unshifted energy yet
+                batch = self.Ri * (1 - self.lazy_Rcm_step)**steps
+            else:
+                batch = self.__RcmList__[0] * (1 - self.lazy_Rcm_step)**(steps + 1)
+            batch = batch[batch > self.t_Shell/2]  # the gas region can't have negative radius
+            if batch.size == 0:
+                return numpy.nan
+            self.__lazy_evaluate__(batch)
+
+        # then narrow down the bracket
+        while True:
+            i = numpy.nonzero(self.__EoutList__ >= E1)[0][0]
+            R_lo, R_hi = self.__RcmList__[i - 1], self.__RcmList__[i]
+            E_lo, E_hi = self.__EoutList__[i - 1], self.__EoutList__[i]
+            # past Ri the table is just a straight line out to the unshifted energy
+            if E_hi - E_lo <= self.Eout_tolerance or R_hi > self.Ri or R_hi - R_lo < 1e-9:
+                break
+            num_points = self.lazy_points[self.backend]
+            if num_points == 1:
+                guess = R_lo + (E1 - E_lo)/(E_hi - E_lo)*(R_hi - R_lo)
+                batch = numpy.clip(guess, R_lo + (R_hi - R_lo)/10, R_hi - (R_hi - R_lo)/10)
+            else:
+                batch = numpy.linspace(R_lo, R_hi, num_points + 2)[1:-1]
+            self.__lazy_evaluate__(batch)
 
-        return max(E, 0)
+        if E_lo <= 0:  # it's in the discontinuity where the protons range out
+            return numpy.nan
+        return R_lo + (E1 - E_lo)/(E_hi - E_lo)*(R_hi - R_lo)
 
-    def Calc_rhoR(self, E1) -> tuple:
-        """Alternative analysis method: specify measured E and calculate rhoR.
+    def __lazy_evaluate__(self, Rcm):
+        """Evaluate the final energy at some more shell radii and add them to the lazy mode's tables.
 
-        :param E1: Measured proton energy [MeV]
-        :returns: model areal density to produced measured E [g/cm2], Rcm [cm]
+        :param Rcm: the shell radii to evaluate [cm]
         """
-        # check limits:
-        if E1 < min(self.__EoutList__) or E1 > max(self.__EoutList__):
-            return numpy.nan, numpy.nan
-        try:
-            Rcm = self.__interp_Rcm__(E1)
-            rhoR = self.rhoR_Total(Rcm)
-
-            return rhoR, Rcm
-        except ValueError:
-            return numpy.nan, numpy.nan
+        Rcm = numpy.atleast_1d(Rcm)
+        self.lazy_evaluations += Rcm.size
+        Rcm = numpy.concatenate([self.__RcmList__, Rcm])
+        Eout = numpy.concatenate([self.__EoutList__, self.__precompute_Eout__(Rcm[self.__RcmList__.size:])])
+        order = numpy.argsort(Rcm)
+        self.__RcmList__, self.__EoutList__ = Rcm[order], Eout[order]
+
+    def __batch_Rcm__(self, E1) -> numpy.ndarray:
+        """Find the shell radius that produces each measured energy for a batch of models, each element with its own
+        parameters. Like lazy mode, this brackets each one by stepping inward from Ri by lazy_Rcm_step, then narrows
+        the brackets down by false position until the energy changes by no more than Eout_tolerance across them, and
+        interpolates; but it does every element that isn't done yet in one array pass each time.
+
+        :param E1: Measured proton energies, which broadcast against the parameters [MeV]
+        :returns: Rcm [cm], or nan wherever no Rcm gives that energy
+        """
+        shape = numpy.broadcast_shapes(numpy.shape(E1), self.__batch_shape__)
+        E1 = numpy.broadcast_to(E1, shape).ravel().astype(float)
+        Ri = numpy.broadcast_to(self.Ri, shape).ravel().astype(float)
+        R_min = numpy.broadcast_to(self.t_Shell/2, shape).ravel()  # the gas region can't have negative radius
+        model = self.__subset__(slice(None), shape)  # flattened, and broadcast against E1
+        Rcm = numpy.full(E1.shape, numpy.nan)
+
+        # past Ri the table would just be a straight line out to the unshifted energy at 2*Ri
+        R_hi = Ri.copy()
+        E_hi = model.__precompute_Eout__(R_hi)
+        outside = (E1 > E_hi) & (E1 <= self.E0)
+        Rcm[outside] = Ri[outside] * (1 + (E1[outside] - E_hi[outside])/(self.E0 - E_hi[outside]))
+
+        # work inward from Ri until some point's energy is lower than E1
+        searching = (E1 > 0) & (E1 <= E_hi)
+        R_lo, E_lo = R_hi.copy(), E_hi.copy()
+        while True:
+            stepping = numpy.nonzero(searching & (E_lo >= E1))[0]
+            if stepping.size == 0:
+                break
+            R_hi[stepping], E_hi[stepping] = R_lo[stepping], E_lo[stepping]
+            R_lo[stepping] *= 1 - self.lazy_Rcm_step
+            searching[stepping] = R_lo[stepping] > R_min[stepping]
+            stepping = stepping[searching[stepping]]
+            if stepping.size > 0:
+                E_lo[stepping] = model.__subset__(stepping).__precompute_Eout__(R_lo[stepping])
+
+        # then narrow down the brackets
+        while True:
+            narrowing = numpy.nonzero(searching & (E_hi - E_lo > self.Eout_tolerance) & (R_hi - R_lo >= 1e-9))[0]
+            if narrowing.size == 0:
+                break
+            R_lo_n, R_hi_n, E_lo_n, E_hi_n = R_lo[narrowing], R_hi[narrowing], E_lo[narrowing], E_hi[narrowing]
+            width = R_hi_n - R_lo_n
+            # false position can't see thru the range-out, so bisect wherever the lower end has ranged out
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                guess = numpy.where(E_lo_n > 0, R_lo_n + (E1[narrowing] - E_lo_n)/(E_hi_n - E_lo_n)*width,
+                                    R_lo_n + width/2)
+            guess = numpy.clip(guess, R_lo_n + width/10, R_hi_n - width/10)
+            E = model.__subset__(narrowing).__precompute_Eout__(guess)
+            below = E < E1[narrowing]
+            R_lo[narrowing] = numpy.where(below, guess, R_lo_n)
+            E_lo[narrowing] = numpy.where(below, E, E_lo_n)
+            R_hi[narrowing] = numpy.where(below, R_hi_n, guess)
+            E_hi[narrowing] = numpy.where(below, E_hi_n, E)
+
+        found = searching & (E_lo > 0)  # the rest are in the discontinuity where the protons range out
+        Rcm[found] = R_lo[found] + (E1[found] - E_lo[found])/(E_hi[found] - E_lo[found])*(R_hi[found] - R_lo[found])
+        return Rcm.reshape(shape)
+
+    def __subset__(self, index, shape=None):
+        """Get a batch of models with some of this batch's elements.
+
+        :param index: which elements to take, as an index into the (flattened) batch
+        :param shape: (optional) the shape to broadcast the batch to first {default=the batch's own shape}
+        :returns: a new rhoR_Model with the parameters at those elements
+        """
+        shape = self.__batch_shape__ if shape is None else shape
+        varied = [numpy.broadcast_to(value, shape).ravel()[index] for value in self.__parameters__[1:16]]
+        return rhoR_Model(self.__parameters__[0], *varied, *self.__parameters__[16:], cache=False)
 
     # ----------------------------------------------------------------
     #         Calculators for rho, rhoR, n
@@ -379,18 +703,15 @@ class rhoR_Model(object):
         m = self.Mass_Shell_Total * (1 - self.f_Remain - self.f_Mix)
         r1 = Rcm + self.t_Shell / 2  # start of ablated mass
         # end of exponential ramp:
-        r2 = r1 + self.rho_Abl_Scale * math.log(self.rho_Abl_Max / self.rho_Abl_Min)
+        r2 = r1 + self.rho_Abl_Scale * numpy.log(self.rho_Abl_Max / self.rho_Abl_Min)
         # mass left in the "tail"
         λ = self.rho_Abl_Scale  # shorthand
         m12 = self.rho_Abl_Max * 4*math.pi*λ * (
-                2*λ**2 + 2*r1*λ + r1**2 - (2*λ**2 + 2*λ*r2 + r2**2)*math.exp((r1 - r2)/λ))
-        if m12 < m:
-            m23 = m - m12
-            r3 = (r2**3 + 3*m23/(4*math.pi*self.rho_Abl_Min))**(1/3)
-        else:
-            r3 = r2
+                2*λ**2 + 2*r1*λ + r1**2 - (2*λ**2 + 2*λ*r2 + r2**2)*numpy.exp((r1 - r2)/λ))
+        m23 = numpy.maximum(m - m12, 0)
+        r3 = numpy.where(m12 < m, (r2**3 + 3*m23/(4*math.pi*self.rho_Abl_Min))**(1/3), r2)
 
-        assert r1 <= r2 <= r3, (r1, r2, r3)
+        assert numpy.all((r1 <= r2) & (r2 <= r3)), (r1, r2, r3)
         return r1, r2, r3
 
     def rho_Abl(self, r, Rcm) -> float:
@@ -403,11 +724,9 @@ class rhoR_Model(object):
         r1, r2, r3 = self.get_Abl_radii(Rcm)
 
         # density is constructed piecewise, depending on where we are:
-        if r1 <= r < r2:
-            return self.rho_Abl_Max * math.exp(-(r - r1) / self.rho_Abl_Scale)
-        if r2 <= r <= r3:
-            return self.rho_Abl_Min
-        return 0.
+        return numpy.select([(r1 <= r) & (r < r2), (r2 <= r) & (r <= r3)],
+                            [self.rho_Abl_Max * numpy.exp(-(r - r1) / self.rho_Abl_Scale), self.rho_Abl_Min],
+                            0.)
 
     def rhoR_Abl(self, Rcm) -> float:
         """Calculate the ablated mass areal density.
@@ -418,7 +737,7 @@ class rhoR_Model(object):
         # integrate from r1 to r3
         #return scipy.integrate.quad(self.rho_Abl, r1, r3, args=(Rcm, self.t_Shell, f_Remain))[0]
         # contribution from exponential part:
-        rhoR = self.rho_Abl_Max * self.rho_Abl_Scale * (1 - math.exp(-(r2-r1)/self.rho_Abl_Scale))
+        rhoR = self.rho_Abl_Max * self.rho_Abl_Scale * (1 - numpy.exp(-(r2-r1)/self.rho_Abl_Scale))
         # contribution from linear part:
         rhoR += (r3-r2)*self.rho_Abl_Min
 
@@ -437,28 +756,24 @@ class rhoR_Model(object):
     def rhoR_Total(self, Rcm) -> float:
         """Calculate the total rhoR for given conditions.
 
-        :param Rcm: shell radius at shock BT [cm]
-        :returns: the total areal density [g/cm2]
+        :param Rcm: shell radius at shock BT, which may be an array [cm]
+        :returns: the total areal density, or nan where Rcm is nan [g/cm2]
         """
-        ret = self.rhoR_Gas(Rcm)
-        ret += self.rhoR_Mix(Rcm)
-        ret += self.rhoR_Shell(Rcm)
-        ret += self.rhoR_Abl(Rcm)
-        return ret
+        gas, shell, abl = self.rhoR_Parts(Rcm)
+        return gas + shell + abl
 
     def rhoR_Parts(self, Rcm) -> tuple:
         """Get the three components of rhoR for given conditions.
 
-        :param Rcm: shell radius at shock BT [cm]
-        :returns: a tuple containing (fuel,shell,ablated) rhoR [g/cm2]
+        :param Rcm: shell radius at shock BT, which may be an array [cm]
+        :returns: a tuple containing (fuel,shell,ablated) rhoR, or nan where Rcm is nan [g/cm2]
         """
-        if math.isnan(Rcm):
-            return math.nan, math.nan, math.nan
-        gas = self.rhoR_Gas(Rcm)
-        gas += self.rhoR_Mix(Rcm)
-        shell = self.rhoR_Shell(Rcm)
-        abl = self.rhoR_Abl(Rcm)
-        return gas, shell, abl
+        valid = ~numpy.isnan(Rcm)
+        Rcm = numpy.where(valid, Rcm, 2*self.Ri)  # stand in a radius that works for every model in a batch
+        gas = numpy.where(valid, self.rhoR_Gas(Rcm) + self.rhoR_Mix(Rcm), numpy.nan)
+        shell = numpy.where(valid, self.rhoR_Shell(Rcm), numpy.nan)
+        abl = numpy.where(valid, self.rhoR_Abl(Rcm), numpy.nan)
+        return gas[()], shell[()], abl[()]
 
     # ----------------------------------------------------------------
     #         Calculators for stopping power
@@ -466,7 +781,10 @@ class rhoR_Model(object):
     __mt__ = 1
     __Zt__ = 1
 
-    def Eout_GasMix(self, Ep, x, Rcm) -> float:
+    # the electron temperature that goes with each region's field particles
+    __region_Te__ = {'GasMix': 'Te_Gas', 'Shell': 'Te_Shell', 'Abl': 'Te_Abl'}
+
+    def Eout_GasMix(self, Ep, x, Rcm) -> numpy.ndarray:
         """Calculate gas+mix downshift for protons
 
         :param Ep: proton energy [MeV]
@@ -474,41 +792,27 @@ class rhoR_Model(object):
         :param Rcm: shell radius at shock BT [cm]
         :returns: downshifted energy [MeV]
         """
-        assert x >= 0
+        assert numpy.all(x >= 0)
 
         ni_gas, ne_gas = self.n_Gas(Rcm)
         ni_mix, ne_mix = self.n_Mix(Rcm)
-        nf = DoubleVector(2 + len(self.shell.A) + (self.dEdx_model!='Z'))
-        nf[0] = ni_gas * self.fD
-        nf[1] = ni_gas * self.f3He
+        nf = [ni_gas * self.fD, ni_gas * self.f3He]
         for i in range(len(self.shell.f)):
-            nf[2+i] = ni_mix * self.shell.f[i]
+            nf.append(ni_mix * self.shell.f[i])
         # for plasma models, include electrons:
         if self.dEdx_model != 'Z':
-            nf[-1] = ne_gas + ne_mix
+            nf.append(ne_gas + ne_mix)
+        nf = numpy.array(numpy.broadcast_arrays(*nf), dtype=float)
 
         # if any densities are zero, it is problematic (no mix does this)
         # add 1 particle per cc minimum:
-        for i in range(len(nf)):
-            if nf[i] <= 0:
-                nf[i] = 1
+        nf[nf <= 0] = 1
 
-        assert all(numpy.isfinite(nf))
-
-        # choose the correct model
-        if self.dEdx_model == 'BPS':
-            model = StopPow_BPS(self.__mt__, self.__Zt__, self.__mfGasMix__, self.__ZfGasMix__, self.__TfGasMix__, nf)
-        elif self.dEdx_model == 'Z':
-            model = StopPow_Zimmerman(self.__mt__, self.__Zt__, self.__mfGasMix_PI__, self.__ZfGasMix_PI__, self.__TfGasMix_PI__, nf, self.__ZbarGasMix_PI__, self.Te_Gas)
-        else: # default to LP
-            model = StopPow_LP(self.__mt__, self.__Zt__, self.__mfGasMix__, self.__ZfGasMix__, self.__TfGasMix__, nf)
+        assert numpy.all(numpy.isfinite(nf))
 
-        try:
-            return model.Eout(Ep, x)
-        except SystemError: # SystemError is the model's way of telling us that the particle has ranged out :/
-            return 0
+        return self.__Eout__('GasMix', Ep, x, nf)
 
-    def Eout_Shell(self, Ep, x, Rcm) -> float:
+    def Eout_Shell(self, Ep, x, Rcm) -> numpy.ndarray:
         """Calculate downshift in the shell.
 
         :param Ep: proton energy [MeV]
@@ -516,61 +820,282 @@ class rhoR_Model(object):
         :param Rcm: shell radius at shock BT [cm]
         :returns: downshifted energy [MeV]
         """
-        assert x >= 0, x
+        assert numpy.all(x >= 0), x
 
         ni, ne = self.n_Shell(Rcm)
-        assert ne > 0, ne
+        assert numpy.all(ne > 0), ne
 
-        nf = DoubleVector(len(self.shell.A) + (self.dEdx_model!='Z'))
-        for i in range(len(self.shell.f)):
-            nf[i] = ni * self.shell.f[i]
+        return self.__Eout__('Shell', Ep, x, self.__nf_Shell__(ni, ne))
+
+    def Eout_Abl(self, Ep, r1, r2, r3, Rcm) -> numpy.ndarray:
+        """Calculate downshift in the ablated mass, stepping thru the density gradient with an adaptive
+        Bogacki-Shampine integrator that keeps the energy error of each step below abl_tolerance.
+        The number of steps and stopping power evaluations are added to abl_steps and abl_evaluations.
+
+        :param Ep: proton energy [MeV]
+        :param r1: start of the exponential ramp [cm]
+        :param r2: end of the exponential ramp [cm]
+        :param r3: end of the flat tail [cm]
+        :param Rcm: shell radius at shock BT [cm]
+        :returns: downshifted energy [MeV]
+        """
+        Ep, r1, r2, r3, Rcm, rho_Max, scale, Te = (numpy.array(a, dtype=float) for a in numpy.broadcast_arrays(
+            Ep, r1, r2, r3, Rcm, self.rho_Abl_Max, self.rho_Abl_Scale, self.Te_Abl))
+        assert numpy.all(r2 > r1)
+
+        def dEdr(r, E, index):
+            # the steps never go past r2, so this is always on the exponential ramp
+            ni = rho_Max[index] * numpy.exp(-(r - r1[index]) / scale[index]) / (self.shell.AvgA * mp)
+            ne = self.shell.AvgZ * ni
+            assert numpy.all(ne > 0)
+            self.abl_evaluations += E.size
+            return 1e4 * self.__dEdx_Abl__(E, ni, ne, Te[index])
+
+        # have to do manually b/c of density gradient:
+        r = r1.copy()
+        h = (r2 - r1) / 10
+        k1 = dEdr(r, Ep, ...)
+        active = numpy.nonzero(Ep > 0)
+        while active[0].size > 0:
+            r_a, E_a, k1_a = r[active], Ep[active], k1[active]
+            h_a = numpy.minimum(h[active], r2[active] - r_a)
+            k2 = dEdr(r_a + h_a/2, E_a + h_a/2*k1_a, active)
+            k3 = dEdr(r_a + 3*h_a/4, E_a + 3*h_a/4*k2, active)
+            E_new = E_a + h_a*(2/9*k1_a + 1/3*k2 + 4/9*k3)
+            k4 = dEdr(r_a + h_a, E_new, active)
+            error = numpy.abs(h_a*(-5/72*k1_a + 1/12*k2 + 1/9*k3 - 1/8*k4))
+
+            # take the step where the error is small enough, and adjust the step size either way
+            accepted = error <= self.abl_tolerance
+            self.abl_steps += numpy.count_nonzero(accepted)
+            with numpy.errstate(divide='ignore'):
+                growth = 0.9*(self.abl_tolerance/error)**(1/3)
+            h[active] = h_a*numpy.clip(growth, 0.2, self.abl_max_step_growth)
+            last_step = h_a == r2[active] - r_a
+            r[active] = numpy.where(accepted, numpy.where(last_step, r2[active], r_a + h_a), r_a)
+            Ep[active] = numpy.where(accepted, E_new, E_a)
+            k1[active] = numpy.where(accepted, k4, k1_a)
+
+            # stop where the protons reach r2 or drop below the stopping power model's minimum energy
+            ranged_out = accepted & ((E_new <= 0) | (k4 == 0))
+            Ep[active] = numpy.where(ranged_out, 0, Ep[active])
+            active = numpy.nonzero((r < r2) & (Ep > 0))
+
+        # for the rest of the ablated mass, stopping power is constant:
+        ni, ne = self.n_Abl(r2, Rcm)
+        return self.__Eout__('Abl', Ep, r3 - r2, self.__nf_Shell__(ni, ne))
+
+    def __nf_Shell__(self, ni, ne) -> numpy.ndarray:
+        """Field particle densities for shell material (also used for the ablated mass).
+
+        :param ni: ion number density [1/cc]
+        :param ne: electron number density [1/cc]
+        :returns: an array of densities, one row per field particle species [1/cc]
+        """
+        nf = [ni * self.shell.f[i] for i in range(len(self.shell.f))]
         # for plasma models, include electrons:
         if self.dEdx_model != 'Z':
-            nf[-1] = ne
+            nf.append(ne)
+        return numpy.array(numpy.broadcast_arrays(*nf), dtype=float)
+
+    def __stopping_power__(self, region, nf):
+        """Get the stopping power model for a region at one set of field particle densities.
+        Each region has one long-lived StopPow object, which is constructed the first time it's needed;
+        after that only its field densities get updated, thru set_field.
+
+        :param region: which region's field particles to use ('GasMix', 'Shell', or 'Abl')
+        :param nf: the field particle densities [1/cc]
+        :returns: a StopPow object using this model's dEdx_model
+        """
+        nf = [float(n) for n in nf]
+        model = self.__stopping_powers__.get(region)
+
+        if model is None:
+            nf_vector = self.__DoubleVector__(nf)
+            model = self.__new_stopping_power__(region, nf_vector)
+            self.__stopping_powers__[region] = model
+            self.__nf_vectors__[region] = nf_vector
+
+        elif nf != self.__nf_current__[region]:
+            # reuse the existing object and its DoubleVector; only the densities change
+            nf_vector = self.__nf_vectors__[region]
+            for i in range(len(nf)):
+                nf_vector[i] = nf[i]
+            if self.dEdx_model == 'Z':
+                model.set_field(getattr(self, f'__mf{region}_PI__'), getattr(self, f'__Zf{region}_PI__'),
+                                getattr(self, f'__Tf{region}_PI__'), nf_vector,
+                                getattr(self, f'__Zbar{region}_PI__'), getattr(self, self.__region_Te__[region]))
+            else:
+                model.set_field(getattr(self, f'__mf{region}__'), getattr(self, f'__Zf{region}__'),
+                                getattr(self, f'__Tf{region}__'), nf_vector)
+            self.stopping_power_updates += 1
+
+        self.__nf_current__[region] = nf
+        return model
+
+    def __new_stopping_power__(self, region, nf_vector):
+        """Construct a stopping power model for a region's field particles.
+
+        :param region: which region's field particles to use ('GasMix', 'Shell', or 'Abl')
+        :param nf_vector: the field particle densities, as a DoubleVector [1/cc]
+        :returns: a new StopPow object using this model's dEdx_model
+        """
+        Tf, Tf_PI = getattr(self, f'__Tf{region}__'), getattr(self, f'__Tf{region}_PI__')
+        Te = getattr(self, self.__region_Te__[region])
+        self.stopping_power_allocations += 1
 
         # choose the correct model
         if self.dEdx_model == 'BPS':
-            model = StopPow_BPS(self.__mt__, self.__Zt__, self.__mfShell__, self.__ZfShell__, self.__TfShell__, nf)
+            return StopPow_BPS(self.__mt__, self.__Zt__,
+                               getattr(self, f'__mf{region}__'), getattr(self, f'__Zf{region}__'), Tf, nf_vector)
         elif self.dEdx_model == 'Z':
-            model = StopPow_Zimmerman(self.__mt__, self.__Zt__, self.__mfShell_PI__, self.__ZfShell_PI__, self.__TfShell_PI__, nf, self.__ZbarShell_PI__, self.Te_Shell)
-        else:
-            model = StopPow_LP(self.__mt__, self.__Zt__, self.__mfShell__, self.__ZfShell__, self.__TfShell__, nf)
-
-        try:
-            return model.Eout(Ep, x)
-        except SystemError: # SystemError is the model's way of telling us that the particle has ranged out :/
-            return 0
-
-    def Eout_Abl(self, Ep, r1, r2, r3, Rcm) -> float:
-        # first part of the ablated region:
-        dr = (r2 - r1) / self.steps
-        assert dr > 0
-        model = None
-        # have to do manually b/c of density gradient:
-        for i in range(self.steps):
-            ni, ne = self.n_Abl(r1 + (r2 - r1) * i/(self.steps - 1), Rcm)
-            assert ne > 0
-
-            nf = DoubleVector(len(self.shell.A) + (self.dEdx_model!='Z'))
-            for i in range(len(self.shell.f)):
-                nf[i] = ni * self.shell.f[i]
-            # for plasma models, include electrons:
-            if self.dEdx_model != 'Z':
-                nf[-1] = ne
-
-            # choose the correct model
-            if self.dEdx_model == 'BPS':
-                model = StopPow_BPS(self.__mt__, self.__Zt__, self.__mfAbl__, self.__ZfAbl__, self.__TfAbl__, nf)
-            elif self.dEdx_model == 'Z':
-                model = StopPow_Zimmerman(self.__mt__, self.__Zt__, self.__mfAbl_PI__, self.__ZfAbl_PI__, self.__TfAbl_PI__, nf, self.__ZbarAbl_PI__, self.Te_Abl)
-            else:
-                model = StopPow_LP(self.__mt__, self.__Zt__, self.__mfAbl__ , self.__ZfAbl__, self.__TfAbl__, nf)
+            return StopPow_Zimmerman(self.__mt__, self.__Zt__,
+                                     getattr(self, f'__mf{region}_PI__'), getattr(self, f'__Zf{region}_PI__'),
+                                     Tf_PI, nf_vector, getattr(self, f'__Zbar{region}_PI__'), Te)
+        else:  # default to LP
+            return StopPow_LP(self.__mt__, self.__Zt__,
+                              getattr(self, f'__mf{region}__'), getattr(self, f'__Zf{region}__'), Tf, nf_vector)
+
+    def __Eout__(self, region, Ep, x, nf) -> numpy.ndarray:
+        """Range an array of protons thru uniform sections of a region.
+
+        :param region: which region's field particles to use ('GasMix', 'Shell', or 'Abl')
+        :param Ep: proton energies [MeV]
+        :param x: path lengths [um]
+        :param nf: field particle densities, one row per species [1/cc]
+        :returns: downshifted energies, or 0 where the protons ranged out [MeV]
+        """
+        if self.backend == 'numpy':
+            mf, Zf, Tf = self.__fields__[region]
+            return Eout_LP(numpy.maximum(Ep, 0), x, self.__mt__, self.__Zt__, mf, Zf, Tf, nf)
+
+        Ep, x = numpy.broadcast_arrays(Ep, x)
+        Eout = numpy.zeros(Ep.shape)
+        for j in numpy.ndindex(Ep.shape):
+            if Ep[j] > 0:
+                model = self.__stopping_power__(region, nf[(slice(None),) + j])
+                try:
+                    Eout[j] = model.Eout(Ep[j], x[j])
+                except SystemError:  # SystemError is the model's way of telling us that the particle has ranged out :/
+                    Eout[j] = 0
+        return Eout
 
-            if Ep >= model.get_Emin():
-                Ep += dr * 1e4 * model.dEdx(Ep)
+    def __dEdx__(self, region, Ep, nf, Tf=None) -> numpy.ndarray:
+        """Evaluate the stopping power for an array of protons in a region.
 
-        # for the rest of the ablated mass, stopping power is constant:
-        try:
-            return model.Eout(Ep, r3 - r2)
-        except SystemError: # SystemError is the model's way of telling us that the particle has ranged out :/
-            return 0
+        :param region: which region's field particles to use ('GasMix', 'Shell', or 'Abl')
+        :param Ep: proton energies [MeV]
+        :param nf: field particle densities, one row per species [1/cc]
+        :param Tf: (optional) field particle temperatures, one row per species, if they aren't the region's own
+            (only for the NumPy backend, where they may differ between the elements of a batch) [keV]
+        :returns: dE/dx, or 0 where the energy is below the model's minimum [MeV/um]
+        """
+        if self.backend == 'numpy':
+            mf, Zf, region_Tf = self.__fields__[region]
+            Tf = region_Tf if Tf is None else Tf
+            valid = Ep >= Emin_numpy
+            return numpy.where(valid, dEdx_LP(numpy.where(valid, Ep, Emin_numpy), self.__mt__, self.__Zt__,
+                                              mf, Zf, Tf, nf), 0)
+
+        Ep = numpy.asarray(Ep)
+        dEdx = numpy.zeros(Ep.shape)
+        for j in numpy.ndindex(Ep.shape):
+            model = self.__stopping_power__(region, nf[(slice(None),) + j])
+            if Ep[j] >= model.get_Emin():
+                dEdx[j] = model.dEdx(Ep[j])
+        return dEdx
+
+    def __dEdx_Abl__(self, Ep, ni, ne, Te) -> numpy.ndarray:
+        """Evaluate the stopping power for an array of protons in the ablated mass.
+
+        :param Ep: proton energies [MeV]
+        :param ni: ion number densities [1/cc]
+        :param ne: electron number densities [1/cc]
+        :param Te: the ablated mass temperatures (which only differ from Te_Abl in a batch of models) [keV]
+        :returns: dE/dx, or 0 where the energy is below the model's minimum [MeV/um]
+        """
+        Ep, ni, ne, Te = (numpy.array(a, dtype=float) for a in numpy.broadcast_arrays(Ep, ni, ne, Te))
+        Tf = [Te] * len(self.__fields__['Abl'][2])
+        return self.__dEdx__('Abl', Ep, self.__nf_Shell__(ni, ne), Tf)
+
+    @staticmethod
+    def __interpolator__(x, y) -> scipy.interpolate.PchipInterpolator:
+        """Interpolate a precomputed table with PCHIP, so the result is monotonic wherever the table is.
+        The last interval, which goes out to the unshifted energy at 2*Ri, stays linear.
+
+        :param x: the table's independent variable, in increasing order
+        :param y: the table's dependent variable
+        :returns: an interpolator that returns nan outside of the table
+        """
+        interpolator = scipy.interpolate.PchipInterpolator(x, y, extrapolate=False)
+        interpolator.c[:, -1] = [0, 0, (y[-1] - y[-2])/(x[-1] - x[-2]), y[-2]]
+        return interpolator
+
+    @staticmethod
+    def __DoubleVector__(values) -> DoubleVector:
+        """Copy a list of numbers into a new DoubleVector for the StopPow library.
+
+        :param values: the numbers to copy
+        :returns: a DoubleVector with the same contents
+        """
+        vector = DoubleVector(len(values))
+        for i in range(len(values)):
+            vector[i] = values[i]
+        return vector
+
+
+class rhoR_Table(object):
+    """A built rhoR_Model boiled down to its parameters and its tables of Eout and rhoR vs Rcm. The rhoR components
+    come from the same closed-form profiles as the model's, so every query gives the same answer the model would, but
+    there are no stopping power objects, stages, or interpolators to carry around, so it pickles to a few kB.
+    Get one from rhoR_Model.freeze().
+
+    :param model: the model to freeze, which has to have its tables built
+    :raise ValueError: if the model is lazy or a batch of models
+    """
+
+    # what the rhoR profiles need from the model, besides the tables
+    __profile_attributes__ = ['Ri', 'Ro', 't_Shell', 'f_Mix', 'f_Remain', 'rho_Abl_Max', 'rho_Abl_Min',
+                              'rho_Abl_Scale', 'rho0_Gas', 'Mass_Shell_Total', 'Mass_Mix_Total',
+                              'E0', 'dEdx_model', 'backend']
+
+    # a frozen model always has its tables
+    __lazy__ = False
+    __batch__ = False
+
+    def __init__(self, model):
+        """Freeze a model."""
+        if model.__lazy__ or model.__batch__:
+            raise ValueError("only a single model with its tables built can be frozen")
+        self.__parameters__ = model.__parameters__
+        for name in self.__profile_attributes__:
+            setattr(self, name, getattr(model, name))
+        self.__RcmList__ = numpy.asarray(model.__RcmList__, dtype=float)
+        self.__EoutList__ = numpy.asarray(model.__EoutList__, dtype=float)
+        self.__rhoRList__ = numpy.asarray(model.__rhoRList__, dtype=float)
+        self.__stages__ = {}  # so that it can stand in for a model whose stages get shared
+        self.__setup_interpolation__()
+
+    def __getstate__(self) -> dict:
+        """Get everything needed to pickle this, which is just the parameters and the tables."""
+        return {key: value for key, value in self.__dict__.items()
+                if not key.startswith('__interp') and key != '__stages__'}
+
+    def __setstate__(self, state: dict):
+        """Restore a pickled frozen model."""
+        self.__dict__.update(state)
+        self.__stages__ = {}
+        self.__setup_interpolation__()
+
+    # the queries are the model's own, since they only use the tables and the profiles
+    Eout = rhoR_Model.Eout
+    Calc_rhoR = rhoR_Model.Calc_rhoR
+    rhoR_Total = rhoR_Model.rhoR_Total
+    rhoR_Parts = rhoR_Model.rhoR_Parts
+    rhoR_Gas = rhoR_Model.rhoR_Gas
+    rhoR_Mix = rhoR_Model.rhoR_Mix
+    rhoR_Shell = rhoR_Model.rhoR_Shell
+    rhoR_Abl = rhoR_Model.rhoR_Abl
+    get_Abl_radii = rhoR_Model.get_Abl_radii
+    __setup_interpolation__ = rhoR_Model.__setup_interpolation__
+    __interpolator__ = staticmethod(rhoR_Model.__interpolator__)
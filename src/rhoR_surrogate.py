@@ -0,0 +1,301 @@
+""" a surrogate for the ρR inference, so that what-if studies and optimization loops can get ρR in well under a
+    millisecond instead of building a rhoR_Model for every set of parameters.  it's a polynomial chaos expansion (a
+    least-squares fit of Legendre polynomials up to some total degree) of log(ρR/(E0 - E1)) over a box of the model
+    parameters and the measured energy, trained on the ρR that rhoR_Analysis.Calc_rhoR gets from its model, for one
+    shell material, stopping power model, and backend (in batches, with the NumPy backend).  every query also gets an
+    error estimate, from the spread between fits to different folds of the training set, scaled so that it covers the
+    actual error on a validation set COVERAGE of the time.  queries outside the box, or whose estimated error is bigger
+    than the tolerance, get passed thru to the full model.
+"""
+import json
+import math
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.stats import qmc
+
+from src.rhoR_Analysis import rhoR_Analysis
+from src.rhoR_Model import rhoR_Model
+
+# the model parameters, in the order rhoR_Model takes them
+PARAMETERS = [parameter for parameter, name in rhoR_Analysis.__parameter_names__]
+# the default largest relative error in ρR to accept from the surrogate before falling back to the model
+TOLERANCE = 0.02
+# the default total degree of the polynomials
+DEGREE = 4
+# the default number of training samples per polynomial term
+SAMPLES_PER_TERM = 3
+# the number of folds to fit for the error estimate
+NUM_FOLDS = 5
+# the fraction of the validation set whose error the error estimate should cover
+COVERAGE = 0.95
+
+
+class rhoRSurrogate:
+	""" ρR as a function of the measured energy and some of the model parameters, with the rest fixed """
+	def __init__(self, shell_material: str, bounds: dict[str, tuple[float, float]], fixed: dict[str, float],
+	             multi_indices: NDArray[int], coefficients: NDArray[float], calibration: float,
+	             validation: dict[str, float], tolerance: float = TOLERANCE,
+	             dEdx_model: str = "LP", backend: str = "numpy"):
+		""" :param shell_material: the shell material the model was trained for
+		    :param bounds: the lower and upper bound of each varied quantity, starting with the measured energy "E1"
+		                   and followed by any of PARAMETERS
+		    :param fixed: the value of every other parameter, including "E0"
+		    :param multi_indices: the degree of each varied quantity in each polynomial term
+		    :param coefficients: the coefficient of each term, for the fit to the whole training set and then for each
+		                         fold's fit
+		    :param calibration: the factor by which to multiply the folds' spread to get the error estimate
+		    :param validation: summary statistics of the relative error on the validation set
+		    :param tolerance: the largest estimated relative error to accept before falling back to the model
+		    :param dEdx_model: the stopping power model it was trained on, as in rhoR_Model
+		    :param backend: the stopping power backend it was trained on, as in rhoR_Model
+		"""
+		self.shell_material = shell_material
+		self.bounds = bounds
+		self.fixed = fixed
+		self.multi_indices = multi_indices
+		self.coefficients = coefficients
+		self.calibration = calibration
+		self.validation = validation
+		self.tolerance = tolerance
+		self.dEdx_model = dEdx_model
+		self.backend = backend
+		self.surrogate_queries = 0  # total queries answered by the surrogate
+		self.fallback_queries = 0  # total queries passed thru to the model
+
+	@classmethod
+	def train(cls, shell_material: str, bounds: dict[str, tuple[float, float]],
+	          fixed: Optional[dict[str, float]] = None, degree: int = DEGREE, num_samples: Optional[int] = None,
+	          tolerance: float = TOLERANCE, seed: Optional[int] = None,
+	          dEdx_model: str = "LP", backend: Optional[str] = None) -> "rhoRSurrogate":
+		""" fit a surrogate to the ρR inference over a box of parameter space
+		    :param shell_material: the shell material to use
+		    :param bounds: the lower and upper bound of each quantity to vary: the measured energy "E1" (which must
+		                   stay below E0) and any of PARAMETERS
+		    :param fixed: the values of any of the other parameters or "E0" to use instead of the rhoR_Analysis
+		                  defaults
+		    :param degree: the total degree of the polynomials
+		    :param num_samples: the number of training samples, which will get rounded up to a power of two
+		                        (SAMPLES_PER_TERM times the number of terms by default)
+		    :param tolerance: the largest estimated relative error to accept before falling back to the model
+		    :param seed: the seed for the sample points, for reproducibility
+		    :param dEdx_model: the stopping power model to use, as in rhoR_Model
+		    :param backend: the stopping power backend to use, as in rhoR_Model (by default SWIG, which needs the
+		                    StopPow library).  it's slow to train without the NumPy backend, since that's the only one
+		                    that can evaluate a whole batch of models at once.
+		    :return: the trained surrogate
+		    :raise ValueError: if the box is invalid, or if the backend isn't available
+		"""
+		if backend is None:
+			backend = rhoR_Model.default_backend()
+		fixed = dict(fixed) if fixed is not None else {}
+		for parameter in PARAMETERS + ["E0"]:
+			if parameter not in bounds and parameter not in fixed:
+				fixed[parameter] = getattr(rhoR_Analysis, f"def_{parameter}")
+		bounds = {"E1": bounds["E1"], **{key: value for key, value in bounds.items() if key != "E1"}}
+		for key, (lower, upper) in bounds.items():
+			if key != "E1" and key not in PARAMETERS:
+				raise ValueError(f"I can't vary '{key}'; the options are E1 and {', '.join(PARAMETERS)}")
+			if not lower < upper:
+				raise ValueError(f"the bounds on {key} are backwards")
+		if bounds["E1"][1] >= fixed["E0"]:
+			raise ValueError("the measured energy must stay below E0")
+
+		multi_indices = _multi_indices(len(bounds), degree)
+		if num_samples is None:
+			num_samples = SAMPLES_PER_TERM*len(multi_indices)
+		surrogate = cls(shell_material, bounds, fixed, multi_indices, np.empty((len(multi_indices), 0)),
+		                math.inf, {}, tolerance, dEdx_model, backend)
+
+		# train on a Sobol' sequence, which covers the box more evenly than random points
+		sampler = qmc.Sobol(len(bounds), seed=seed)
+		points = surrogate._scale_points(sampler.random_base2(math.ceil(math.log2(num_samples))))
+		points, rhoR = surrogate._evaluate_model(points)
+		basis = surrogate._basis(points)
+		target = np.log(rhoR/(fixed["E0"] - points[:, 0]))
+		folds = np.arange(target.size) % NUM_FOLDS
+		fits = [np.ones(target.size, dtype=bool)] + [folds != k for k in range(NUM_FOLDS)]
+		surrogate.coefficients = np.stack(
+			[np.linalg.lstsq(basis[fit], target[fit], rcond=None)[0] for fit in fits], axis=1)
+
+		# then check it against random points, half to calibrate the error estimate and half to see how it does
+		rng = np.random.default_rng(seed)
+		points = surrogate._scale_points(rng.random((max(num_samples//4, 200), len(bounds))))
+		points, rhoR = surrogate._evaluate_model(points)
+		estimate, spread = surrogate._predict(points)
+		error = np.abs(estimate/rhoR - 1)
+		half = error.size//2
+		surrogate.calibration = float(np.quantile(error[:half]/spread[:half], COVERAGE))
+		error, estimated_error = error[half:], surrogate.calibration*spread[half:]
+		accepted = estimated_error <= tolerance
+		surrogate.validation = {
+			"training samples": int(target.size),
+			"validation samples": int(error.size),
+			"median error": float(np.median(error)),
+			"95th percentile error": float(np.quantile(error, 0.95)),
+			"max error": float(np.max(error)),
+			"coverage": float(np.mean(error <= estimated_error)),
+			"accepted fraction": float(np.mean(accepted)),
+			"max accepted error": float(np.max(error, where=accepted, initial=0)),
+		}
+		return surrogate
+
+	def predict(self, E1: NDArray[float], **parameters: NDArray[float]) -> tuple[NDArray[float], NDArray[float]]:
+		""" evaluate the surrogate
+		    :param E1: the measured energies [MeV]
+		    :param parameters: the values of any of PARAMETERS (in rhoR_Model's units), which broadcast against E1.
+		                       any that aren't given are assumed to be at the bounds' midpoints or the fixed values.
+		    :return: ρR [g/cm^2], and the estimated relative error (inf outside of the training domain)
+		"""
+		points, inside = self._points(E1, parameters)
+		estimate, spread = self._predict(points)
+		error = np.where(inside, self.calibration*spread, np.inf)
+		return estimate.reshape(inside.shape)[()], error.reshape(inside.shape)[()]
+
+	def Calc_rhoR(self, E1: NDArray[float], **parameters: NDArray[float]) -> NDArray[float]:
+		""" get ρR from the surrogate wherever it's good to the tolerance, and from the model it was trained on everywhere
+		    else
+		    :param E1: the measured energies [MeV]
+		    :param parameters: the values of any of PARAMETERS (in rhoR_Model's units), which broadcast against E1.
+		                       any that aren't given are assumed to be at the bounds' midpoints or the fixed values.
+		    :return: ρR, or NaN wherever the model can't produce E1 [g/cm^2]
+		"""
+		rhoR, error = self.predict(E1, **parameters)
+		shape = np.shape(rhoR)
+		rhoR, error = np.ravel(rhoR), np.ravel(error)
+		fallback = ~(error <= self.tolerance)
+		self.surrogate_queries += np.count_nonzero(~fallback)
+		self.fallback_queries += np.count_nonzero(fallback)
+		if np.any(fallback):
+			values = {key: np.broadcast_to(value, shape).ravel()[fallback] for key, value in
+			          self._all_parameters(E1, parameters).items()}
+			rhoR[fallback] = self._model_rhoR(values, values["E1"])
+		return rhoR.reshape(shape)[()]
+
+	def save(self, filename: str) -> None:
+		""" write this surrogate to disk (as a .npz file) """
+		metadata = dict(shell_material=self.shell_material, bounds=self.bounds, fixed=self.fixed,
+		                calibration=self.calibration, validation=self.validation, tolerance=self.tolerance,
+		                dEdx_model=self.dEdx_model, backend=self.backend)
+		with open(filename, "wb") as f:
+			np.savez(f, multi_indices=self.multi_indices, coefficients=self.coefficients,
+			         metadata=np.array(json.dumps(metadata)))
+
+	@classmethod
+	def load(cls, filename: str) -> "rhoRSurrogate":
+		""" read a surrogate that was written with save().  ones saved before the backend was recorded were all
+		    trained on the NumPy backend with LP stopping.
+		"""
+		with np.load(filename, allow_pickle=False) as arrays:
+			metadata = json.loads(str(arrays["metadata"]))
+			return cls(metadata["shell_material"], {key: tuple(value) for key, value in metadata["bounds"].items()},
+			           metadata["fixed"], arrays["multi_indices"], arrays["coefficients"], metadata["calibration"],
+			           metadata["validation"], metadata["tolerance"],
+			           metadata.get("dEdx_model", "LP"), metadata.get("backend", "numpy"))
+
+	def _all_parameters(self, E1: NDArray[float], parameters: dict[str, NDArray[float]]) -> dict[str, NDArray[float]]:
+		""" fill in the parameters that weren't given in a query """
+		values = {"E1": E1}
+		for parameter in PARAMETERS:
+			if parameter in parameters:
+				values[parameter] = parameters[parameter]
+			elif parameter in self.bounds:
+				values[parameter] = sum(self.bounds[parameter])/2
+			else:
+				values[parameter] = self.fixed[parameter]
+		return values
+
+	def _points(self, E1: NDArray[float], parameters: dict[str, NDArray[float]]
+	            ) -> tuple[NDArray[float], NDArray[bool]]:
+		""" lay out a query as points in the box
+		    :return: the varied quantities at each point, and whether each point is in the training domain
+		"""
+		for parameter in parameters:
+			if parameter not in PARAMETERS:
+				raise ValueError(f"'{parameter}' isn't a model parameter; the options are {', '.join(PARAMETERS)}")
+		values = self._all_parameters(E1, parameters)
+		shape = np.broadcast_shapes(*(np.shape(value) for value in values.values()))
+		inside = np.ones(shape, dtype=bool)
+		for key, value in values.items():
+			if key in self.bounds:
+				lower, upper = self.bounds[key]
+				inside &= (value >= lower) & (value <= upper)
+			else:
+				inside &= np.isclose(value, self.fixed[key], rtol=1e-9, atol=0)
+		points = np.stack([np.broadcast_to(values[key], shape).ravel() for key in self.bounds], axis=-1)
+		return points, inside
+
+	def _predict(self, points: NDArray[float]) -> tuple[NDArray[float], NDArray[float]]:
+		""" evaluate the fits at some points in the box
+		    :return: ρR from the fit to the whole training set, and the spread between the folds' fits (relative)
+		"""
+		fits = self._basis(points) @ self.coefficients
+		with np.errstate(over="ignore"):
+			rhoR = np.exp(fits[:, 0])*(self.fixed["E0"] - points[:, 0])
+		return rhoR, np.std(fits[:, 1:], axis=1)
+
+	def _basis(self, points: NDArray[float]) -> NDArray[float]:
+		""" evaluate every polynomial term at some points in the box """
+		lower = np.array([lower for lower, upper in self.bounds.values()])
+		upper = np.array([upper for lower, upper in self.bounds.values()])
+		u = np.clip(2*(points - lower)/(upper - lower) - 1, -1, 1)
+		degree = int(np.max(self.multi_indices))
+		# the Legendre polynomials, normalized to unit variance on [-1, 1], by Bonnet's recursion
+		legendre = np.empty(u.shape + (degree + 1,))
+		legendre[..., 0] = 1
+		if degree > 0:
+			legendre[..., 1] = u
+		for k in range(1, degree):
+			legendre[..., k + 1] = ((2*k + 1)*u*legendre[..., k] - k*legendre[..., k - 1])/(k + 1)
+		legendre *= np.sqrt(2*np.arange(degree + 1) + 1)
+		return np.prod(legendre[:, np.arange(len(self.bounds)), self.multi_indices], axis=-1)
+
+	def _scale_points(self, unit_points: NDArray[float]) -> NDArray[float]:
+		""" stretch points in the unit hypercube to fill the box """
+		lower = np.array([lower for lower, upper in self.bounds.values()])
+		upper = np.array([upper for lower, upper in self.bounds.values()])
+		return lower + (upper - lower)*unit_points
+
+	def _evaluate_model(self, points: NDArray[float]) -> tuple[NDArray[float], NDArray[float]]:
+		""" run the model at some points in the box
+		    :return: the points that are physical and where the model could produce E1, and ρR at each one
+		"""
+		values = {key: points[:, i] for i, key in enumerate(self.bounds)}
+		values = {parameter: np.broadcast_to(values.get(parameter, self.fixed.get(parameter)), points.shape[:1])
+		          for parameter in PARAMETERS}
+		physical = rhoR_Analysis.__physical__(np.array([values[parameter] for parameter in PARAMETERS]))
+		rhoR = self._model_rhoR({parameter: values[parameter][physical] for parameter in PARAMETERS},
+		                        points[physical, 0])
+		valid = ~np.isnan(rhoR)
+		return points[physical][valid], rhoR[valid]
+
+	def _model_rhoR(self, values: dict[str, NDArray[float]], E1: NDArray[float]) -> NDArray[float]:
+		""" get ρR the way rhoR_Analysis.Calc_rhoR does for each set of parameters, from a rhoR_Model with this
+		    surrogate's stopping power model and backend: all at once as a batch of models with the NumPy backend, or
+		    one model at a time with the others
+		    :param values: the value of each of PARAMETERS at each point
+		    :param E1: the measured energy at each point [MeV]
+		    :return: ρR at each point, or NaN wherever the model can't produce E1 [g/cm^2]
+		"""
+		if self.backend == "numpy":
+			model = rhoR_Model(self.shell_material, *(values[parameter] for parameter in PARAMETERS),
+			                   self.fixed["E0"], dEdx_model=self.dEdx_model, backend=self.backend, cache=False)
+			return model.Calc_rhoR(E1)[0]
+		rhoR = np.empty(np.size(E1))
+		for i in range(rhoR.size):
+			model = rhoR_Model(self.shell_material, *(float(values[parameter][i]) for parameter in PARAMETERS),
+			                   self.fixed["E0"], dEdx_model=self.dEdx_model, backend=self.backend, cache=False)
+			rhoR[i] = model.Calc_rhoR(E1[i])[0]
+		return rhoR
+
+
+def _multi_indices(num_dimensions: int, degree: int) -> NDArray[int]:
+	""" list every combination of polynomial degrees in some number of dimensions whose total is at most degree """
+	if num_dimensions == 0:
+		return np.zeros((1, 0), dtype=int)
+	indices = []
+	for k in range(degree + 1):
+		for rest in _multi_indices(num_dimensions - 1, degree - k):
+			indices.append([k, *rest])
+	return np.array(indices, dtype=int)
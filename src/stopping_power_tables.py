@@ -0,0 +1,175 @@
+""" the cold-matter stopping power tables in tables/ that the hohlraum correction uses.  each one gets parsed the first
+    time it's needed and kept in memory for the rest of the process, so correcting a whole campaign's worth of WRFs
+    only reads each file once.  along with dE/dx, each table gets the CSDA range R(E) (the distance a proton at energy E
+    travels before stopping, measured from the bottom of the table), so that the energy after any thickness of a
+    material is just R⁻¹(R(E) ∓ thickness).  dE/dx is taken to be linear between the table's points (and constant past
+    its ends), the same as interpolating it with np.interp, and on those pieces R(E) and its inverse are closed-form,
+    so the range tables are exact rather than another layer of interpolation.
+    a campaign tends to reuse the same few hohlraum layer stacks for all of its WRFs, so each distinct stack also gets
+    its whole transfer function E_in(E_out) tabulated once and kept in a small LRU cache.
+"""
+import functools
+import os
+from typing import Sequence
+
+import numpy as np
+import scipy.interpolate
+from numpy.typing import NDArray
+
+TABLE_DIRECTORY = "tables"
+# the number of distinct layer stacks whose transfer functions are kept in memory at once
+STACK_CACHE_SIZE = 32
+# the final energies at which each layer stack's transfer function is tabulated, spaced logarithmicly; past the top,
+# energies go thru the layers one at a time instead (MeV)
+STACK_ENERGY_RANGE = (0.01, 20.)
+STACK_POINTS = 800
+
+# every table loaded so far in this process, keyed by material: the energies, dE/dx, and the CSDA range
+_tables: dict[str, tuple[NDArray[float], NDArray[float], NDArray[float]]] = {}
+
+
+def get_table(material: str) -> tuple[NDArray[float], NDArray[float]]:
+	""" get the stopping power of protons in a cold material, loading it from disk if it hasn't been already
+	    :param material: the material's name as it appears in the table's filename, like "Au" or "CR39"
+	    :return: the energies (MeV) and the stopping powers at those energies (MeV/μm), as read-only arrays
+	    :raise OSError: if there's no table for that material
+	"""
+	energy, dEdx, _ = _load(material)
+	return energy, dEdx
+
+
+def stopping_power(energy: NDArray[float], material: str) -> NDArray[float]:
+	""" look up the stopping power of protons in a cold material, interpolated the same way the range tables take it
+	    :param energy: the protons' energies, which may be an array (MeV)
+	    :param material: the material's name as it appears in the table's filename
+	    :return: dE/dx at each energy (MeV/μm)
+	"""
+	table_energy, dEdx, _ = _load(material)
+	return np.interp(energy, table_energy, dEdx)
+
+
+def csda_range(energy: NDArray[float], material: str) -> NDArray[float]:
+	""" find how far protons go in a cold material before stopping
+	    :param energy: the protons' energies, which may be an array (MeV)
+	    :param material: the material's name as it appears in the table's filename
+	    :return: the range of each one (μm), measured from the bottom of the table (so it's negative below that)
+	"""
+	table_energy, dEdx, table_range = _load(material)
+	energy = np.asarray(energy, dtype=float)
+	k, slope = _pieces(table_energy, dEdx, energy)
+	step = energy - table_energy[k]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		curved = np.log1p(slope*step/dEdx[k])/slope
+	return (table_range[k] + np.where(slope != 0, curved, step/dEdx[k]))[()]
+
+
+def energy_from_range(distance: NDArray[float], material: str) -> NDArray[float]:
+	""" find the energy protons need to go some distance in a cold material before stopping; the inverse of csda_range
+	    :param distance: the range, measured from the bottom of the table, which may be an array (μm)
+	    :param material: the material's name as it appears in the table's filename
+	    :return: the energy of each one (MeV)
+	"""
+	table_energy, dEdx, table_range = _load(material)
+	distance = np.asarray(distance, dtype=float)
+	k, slope = _pieces(table_range, dEdx, distance, table_energy)
+	step = distance - table_range[k]
+	with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+		curved = dEdx[k]*np.expm1(slope*step)/slope
+	return (table_energy[k] + np.where(slope != 0, curved, step*dEdx[k]))[()]
+
+
+def unfold_layers(energy: NDArray[float], layers: Sequence[tuple[float, str]]
+                  ) -> tuple[NDArray[float], NDArray[float]]:
+	""" find the energies protons had before passing thru a stack of cold layers, using the stack's transfer function
+	    :param energy: the protons' energies after the last layer, which may be an array (MeV)
+	    :param layers: the thickness (μm) and material of each layer, in the order the protons go thru them
+	    :return: the energy of each one before the first layer (MeV), and the derivative of that with respect to the
+	             energy after the last layer (how much the stack stretched the energy axis there)
+	"""
+	energy = np.asarray(energy, dtype=float)
+	transfer = _transfer_function(tuple((float(thickness), material) for thickness, material in layers if thickness > 0))
+	inside = (energy >= 0) & (energy <= STACK_ENERGY_RANGE[1])
+	if np.all(inside):
+		return transfer(energy)[()], transfer(energy, 1)[()]
+	exact_energy, exact_stretch = _through_layers(energy, layers)
+	return (np.where(inside, transfer(energy), exact_energy)[()],
+	        np.where(inside, transfer(energy, 1), exact_stretch)[()])
+
+
+def stack_info() -> tuple[int, int, int]:
+	""" describe the use of the layer stack cache
+	    :return: the number of stacks whose transfer functions are in memory, the number of lookups that found their
+	             stack there, and the number that had to tabulate it
+	"""
+	info = _transfer_function.cache_info()
+	return info.currsize, info.hits, info.misses
+
+
+def table_info() -> dict[str, tuple[int, int]]:
+	""" describe the tables in memory
+	    :return: the number of points in each material's table and the memory its arrays take up (bytes)
+	"""
+	return {material: (energy.size, energy.nbytes + dEdx.nbytes + distance.nbytes)
+	        for material, (energy, dEdx, distance) in _tables.items()}
+
+
+def clear_tables() -> None:
+	""" forget every table and layer stack in memory, so that the next lookup of each one reads it from disk again """
+	_tables.clear()
+	_transfer_function.cache_clear()
+
+
+def _load(material: str) -> tuple[NDArray[float], NDArray[float], NDArray[float]]:
+	""" get a material's table from memory, or read it and work out its range table if it's not there yet """
+	if material not in _tables:
+		data = np.loadtxt(os.path.join(TABLE_DIRECTORY, f"stopping_power_protons_{material}.csv"), delimiter=",")
+		energy = np.ascontiguousarray(data[:, 0]/1e3)  # [MeV]
+		dEdx = np.ascontiguousarray(data[:, 1]/1e3)  # [MeV/μm]
+		# integrate dE/(dE/dx) exactly over each piece where dE/dx is linear
+		slope = np.diff(dEdx)/np.diff(energy)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			pieces = np.where(slope != 0, np.log(dEdx[1:]/dEdx[:-1])/slope, np.diff(energy)/dEdx[:-1])
+		distance = np.concatenate([[0], np.cumsum(pieces)])  # [μm]
+		for array in [energy, dEdx, distance]:
+			array.flags.writeable = False  # since everyone who asks for this material shares them
+		_tables[material] = (energy, dEdx, distance)
+	return _tables[material]
+
+
+def _pieces(axis: NDArray[float], dEdx: NDArray[float], values: NDArray[float],
+            energy: NDArray[float] = None) -> tuple[NDArray[int], NDArray[float]]:
+	""" find which linear piece of dE/dx each value falls on
+	    :param axis: the table's energies or ranges, in increasing order
+	    :param dEdx: the table's stopping powers
+	    :param values: the energies or ranges to look up
+	    :param energy: the table's energies, if axis is the range
+	    :return: the index of the table point at the start of each value's piece, and dE/dx's slope (1/μm) on that
+	             piece, which is zero past either end of the table, where it's held constant
+	"""
+	energy = axis if energy is None else energy
+	slope = np.append(np.diff(dEdx)/np.diff(energy), 0)
+	k = np.searchsorted(axis, values, side="right") - 1
+	return np.maximum(k, 0), np.where(k >= 0, slope[np.maximum(k, 0)], 0)
+
+
+@functools.lru_cache(maxsize=STACK_CACHE_SIZE)
+def _transfer_function(layers: tuple[tuple[float, str], ...]) -> scipy.interpolate.CubicHermiteSpline:
+	""" tabulate the energy before a stack of layers against the energy after it, as a cubic spline that takes the
+	    exact slope at each point, which makes it good to about 10 eV
+	"""
+	energy = np.concatenate([[0], np.geomspace(*STACK_ENERGY_RANGE, STACK_POINTS)])  # [MeV]
+	return scipy.interpolate.CubicHermiteSpline(energy, *_through_layers(energy, layers))
+
+
+def _through_layers(energy: NDArray[float], layers: Sequence[tuple[float, str]]
+                    ) -> tuple[NDArray[float], NDArray[float]]:
+	""" find the energies before a stack of layers by going back thru them one at a time.  in each one, the range
+	    difference between the entrance and exit energies is fixed at its thickness, so dE_in/dE_out is the ratio of the
+	    stopping powers there.
+	"""
+	stretch = np.ones(np.shape(energy))
+	for thickness, material in layers[::-1]:
+		entrance_energy = energy_from_range(csda_range(energy, material) + thickness, material)
+		stretch = stretch*stopping_power(entrance_energy, material)/stopping_power(energy, material)
+		energy = entrance_energy
+	return energy, stretch
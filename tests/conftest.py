@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# so that `import src` works no matter where pytest is called from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import model_cache
+
+
+@pytest.fixture(autouse=True)
+def temporary_cache(tmp_path, monkeypatch):
+	""" keep the model tables each test builds out of the real cache directory """
+	monkeypatch.setattr(model_cache, "CACHE_DIRECTORY", str(tmp_path/"rhoR_models"))
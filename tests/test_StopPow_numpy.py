@@ -0,0 +1,54 @@
+""" regression tests for the NumPy stopping power.  the reference values were computed with this module itself, so
+    they catch changes to it but not disagreement with StopPow_LP; that's what test_agrees_with_StopPow is for, and it
+    only runs where the SWIG library loads.
+"""
+import numpy as np
+import pytest
+
+from benchmark_rhoR import default_model_parameters
+from src import StopPow_numpy
+from src.Material import plasma_conditions
+from src.rhoR_Model import DoubleVector, rhoR_Model
+
+ENERGIES = np.array([1., 3., 6., 10., 15.])  # (MeV)
+# dE/dx at ENERGIES for a proton in a few plasmas (MeV/μm), keyed by material, density (g/cm^3), and temperature (keV)
+REFERENCE_dEdx = {
+	("CH", 20., 0.5): [-0.181736965513, -0.157025129271, -0.100586510275, -0.068165104736, -0.049550431339],
+	("HDC", 3.5, 0.03): [-0.071717637815, -0.032932924058, -0.019338692751, -0.012875979026, -0.009258070482],
+	("CH", 0.3, 2.): [-0.001167172646, -0.001526527612, -0.001607731522, -0.001345153032, -0.001044598857],
+}
+# Calc_rhoR at 8, 10, and 12 MeV for the default model of each ablator (g/cm^2)
+REFERENCE_rhoR = {
+	"CH": [(0.23676606898650282, 0.014177956844510616),
+	       (0.1730781193419207, 0.016828393721723827),
+	       (0.1032419321601469, 0.022794150411412105)],
+	"HDC": [(0.27625794574342555, 0.02242332182074643),
+	        (0.20327754418382266, 0.026679620445784397),
+	        (0.12312298580057365, 0.03619327022504391)],
+}
+
+
+@pytest.mark.parametrize("conditions", REFERENCE_dEdx.keys())
+def test_dEdx(conditions):
+	stopping_power = StopPow_numpy.StopPow_LP(1, 1, *plasma_conditions(*conditions))
+	np.testing.assert_allclose(stopping_power.dEdx(ENERGIES), REFERENCE_dEdx[conditions], rtol=1e-9)
+
+
+@pytest.mark.parametrize("material", REFERENCE_rhoR.keys())
+def test_Calc_rhoR(material):
+	model = rhoR_Model(*default_model_parameters(material), backend="numpy")
+	for energy, expected in zip([8., 10., 12.], REFERENCE_rhoR[material]):
+		np.testing.assert_allclose(model.Calc_rhoR(energy), expected, rtol=1e-6)
+
+
+def test_default_backend_needs_StopPow():
+	if DoubleVector is not None:
+		assert rhoR_Model.default_backend() == "SWIG"
+	else:
+		with pytest.raises(ValueError):
+			rhoR_Model.default_backend()
+
+
+@pytest.mark.skipif(DoubleVector is None, reason="the StopPow library isn't installed")
+def test_agrees_with_StopPow():
+	StopPow_numpy.check_against_shots()
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from src import StopPow_numpy, calculate_rhoR
+from src.Material import plasma_conditions
+
+SHOT_INFO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shot_info.csv")
+OMEGA_PARAMETERS = {"ablator material": "CH", "shell density": 20., "shell electron temperature": 0.5,
+                    "secondary": False, "stopping power backend": "numpy"}
+
+
+def test_omega_table_against_direct_thickness():
+	energies = np.array([2., 5., 8., 11., 14., 14.6])
+	guesses = np.stack([energies, np.zeros(energies.shape), np.zeros(energies.shape)], axis=-1)
+	rhoR = calculate_rhoR.calculate_omega_rhoR(guesses, OMEGA_PARAMETERS)[..., 0]
+	stopping_power = StopPow_numpy.StopPow_LP(1, 1, *plasma_conditions("CH", 20., 0.5))
+	expected = stopping_power.Thickness(14.7, energies)*1e-4*20./1e-3
+	np.testing.assert_allclose(rhoR, expected, rtol=1e-3)
+
+
+def test_omega_scalar_matches_table():
+	rhoR, lower_error, upper_error = calculate_rhoR.calculate_rhoR((10., .1, .1), "O", OMEGA_PARAMETERS)
+	table = calculate_rhoR.calculate_omega_rhoR(np.array([[10., .1, .1]]), OMEGA_PARAMETERS)[0]
+	assert (rhoR, lower_error, upper_error) == tuple(table)
+	assert lower_error > 0 and upper_error > 0
+
+
+def test_omega_needs_StopPow_unless_asked():
+	if calculate_rhoR.StopPow_LP is not None:
+		pytest.skip("the StopPow library is installed")
+	with pytest.raises(ValueError):
+		calculate_rhoR.calculate_rhoR((10., .1, .1), "O", {**OMEGA_PARAMETERS, "stopping power backend": None})
+
+
+def test_nif_rhoR():
+	shot_number, parameters = next(iter(calculate_rhoR.load_representative_shots(SHOT_INFO).items()))
+	parameters = {**parameters, "stopping power backend": "numpy"}
+	rhoR, lower_error, upper_error = calculate_rhoR.calculate_rhoR((10., .1, .1), shot_number, parameters)
+	assert 0 < rhoR < 1000 and lower_error == upper_error > 0
+	breakdown = calculate_rhoR.calculate_rhoR_breakdown(np.array([10.]), np.array([.1]), shot_number, parameters)
+	assert breakdown["ρR"][0] == pytest.approx(rhoR)
+	assert breakdown["total"][0] == pytest.approx(lower_error)
+
+
+def test_load_shot_parameters():
+	shot_number = next(iter(calculate_rhoR.load_representative_shots(SHOT_INFO)))
+	parameters = calculate_rhoR.load_shot_parameters(shot_number, SHOT_INFO)
+	assert set(parameters) <= set(calculate_rhoR.SHOT_INFO_KEYS) | {"shell thickness"}
+	with pytest.raises(ValueError):
+		calculate_rhoR.load_shot_parameters("N000000-000", SHOT_INFO)
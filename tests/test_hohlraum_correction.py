@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from make_plots_from_analysis import np_Analysis, read_shot_summary_file
+from src.calculate_rhoR import correct_spectrum_for_hohlraum, get_ein_from_eout, perform_hohlraum_correction
+
+SPECTRUM = np.array([[energy, 1e7*np.exp(-(energy - 10)**2/2), 1e5] for energy in np.arange(4., 16., 0.25)])
+
+
+def test_no_hohlraum_means_no_corrected_spectrum():
+	assert correct_spectrum_for_hohlraum([], SPECTRUM) is None
+	assert correct_spectrum_for_hohlraum([(0., "Au"), (0., "Al")], SPECTRUM) is None
+
+
+def test_hohlraum_gives_a_new_spectrum():
+	corrected = correct_spectrum_for_hohlraum([(31., "U"), (205., "Al")], SPECTRUM)
+	assert corrected is not None and corrected is not SPECTRUM
+	assert corrected.shape == SPECTRUM.shape
+	assert np.all(corrected[:, 0] > SPECTRUM[:, 0])
+
+
+def test_summary_rows_have_no_corrected_spectrum(tmp_path):
+	filepath = tmp_path/"N210808-001.txt"
+	filepath.write_text("90-124  1  5.4e6  1.9e7   9.87   3.39  171.9  114.5\n", encoding="utf8")
+	analyses = np.array(read_shot_summary_file(str(filepath)), dtype=np_Analysis)
+	assert analyses[0]["corrected_spectrum"] is None
+
+
+def test_unfolding_conserves_yield():
+	corrected = correct_spectrum_for_hohlraum([(31., "U"), (205., "Al")], SPECTRUM)
+	assert np.trapezoid(corrected[:, 1], corrected[:, 0]) == \
+	       pytest.approx(np.trapezoid(SPECTRUM[:, 1], SPECTRUM[:, 0]), rel=1e-3)
+
+
+def test_peak_correction_matches_spectrum_correction():
+	layers = [(31., "U"), (205., "Al")]
+	yeeld, mean, sigma = perform_hohlraum_correction(layers, ((1e10, 1e8, 1e8), (10., .1, .1), (.5, .05, .05)))
+	assert yeeld == (1e10, 1e8, 1e8)
+	assert mean[0] == pytest.approx(get_ein_from_eout(10., layers))
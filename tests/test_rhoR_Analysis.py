@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from src.rhoR_Analysis import rhoR_Analysis
+
+QUERY_ENERGIES = np.array([7., 10., 12.])  # (MeV)
+PARAMETERS = [parameter for parameter, name in rhoR_Analysis.__parameter_names__]
+
+
+@pytest.fixture(scope="module")
+def analysis():
+	return rhoR_Analysis(backend="numpy", workers=1)
+
+
+def test_jacobian_error_bars_match_varied(analysis):
+	jacobian = rhoR_Analysis(backend="numpy", workers=1, error_mode="jacobian")
+	rhoR, Rcm, error = jacobian.Calc_rhoR(QUERY_ENERGIES)
+	expected_rhoR, _, expected_error = analysis.Calc_rhoR(QUERY_ENERGIES)
+	np.testing.assert_array_equal(rhoR, expected_rhoR)
+	# the linearization and the ±1σ models don't agree exactly, since ρR isn't linear in the parameters
+	np.testing.assert_allclose(error, expected_error, rtol=0.15)
+
+
+def test_error_breakdown_adds_up(analysis):
+	_, _, (error, sources) = analysis.Calc_rhoR(QUERY_ENERGIES, breakdown=True)
+	np.testing.assert_allclose(np.sqrt(sum(np.nan_to_num(part)**2 for _, part in sources)), error, rtol=1e-9)
+
+
+def test_Calc_Rcm_inverts_the_table(analysis):
+	Rcm, error = analysis.Calc_Rcm(QUERY_ENERGIES, 0.2)
+	np.testing.assert_allclose(analysis.model.Eout(Rcm), QUERY_ENERGIES, rtol=0, atol=1e-3)
+	assert np.all(error > 0)
+	# the measured energy's part of the error bar is half the spread in Rcm across it
+	_, model_error = analysis.Calc_Rcm(QUERY_ENERGIES, 0)
+	spread = analysis.model.Calc_rhoR(QUERY_ENERGIES - 0.2)[1] - analysis.model.Calc_rhoR(QUERY_ENERGIES + 0.2)[1]
+	np.testing.assert_allclose(error, np.sqrt(model_error**2 + (spread/2)**2), rtol=1e-9)
+
+
+def test_Monte_Carlo(analysis):
+	result = analysis.Calc_rhoR_MonteCarlo(10., samples=200, seed=0)
+	assert result["samples"] == 200 and result["rhoR"].size == 200
+	assert result["percentiles"][2.5] < result["mean"] < result["percentiles"][97.5]
+	again = analysis.Calc_rhoR_MonteCarlo(10., samples=200, seed=0)
+	np.testing.assert_array_equal(again["rhoR"], result["rhoR"])
+
+
+def test_Monte_Carlo_needs_samples(analysis):
+	with pytest.raises(ValueError):
+		analysis.Calc_rhoR_MonteCarlo(10., samples=0)
+
+
+def test_Monte_Carlo_always_runs_a_batch(analysis):
+	result = analysis.Calc_rhoR_MonteCarlo(10., samples=2*analysis.monte_carlo_batch_size, time_limit=0, seed=0)
+	assert result["samples"] == analysis.monte_carlo_batch_size
+	assert len(result["history"]) == 1
+	assert np.isfinite(result["mean"])
+
+
+def test_Monte_Carlo_out_of_range(analysis):
+	result = analysis.Calc_rhoR_MonteCarlo(analysis.E0 + 1, samples=10, seed=0)
+	assert result["valid fraction"] == 0
+	assert np.isnan(result["mean"])
+
+
+def test_Sobol_indices_of_one_parameter():
+	# with only P0 uncertain, it has to be responsible for all of the variance
+	errors = {f"{parameter}_err": 0 for parameter in PARAMETERS}
+	errors["P0_err"] = rhoR_Analysis.def_P0_err
+	analysis = rhoR_Analysis(backend="numpy", workers=1, **errors)
+	result = analysis.Calc_Sobol_Indices([10.], samples=64, seed=0)
+	P0 = PARAMETERS.index("P0")
+	assert result["first order"][P0, 0] == pytest.approx(1, abs=0.05)
+	assert result["total"][P0, 0] == pytest.approx(1, abs=0.05)
+	assert np.all(np.delete(result["first order"], P0, axis=0) == 0)
+
+
+def test_Sobol_indices(analysis):
+	result = analysis.Calc_Sobol_Indices([8., 10.], samples=64, seed=0)
+	assert result["first order"].shape == (len(PARAMETERS), 2)
+	assert np.all(result["valid fraction"] > 0.9)
+	# the total indices count every interaction, so they can't add up to less than the variance
+	assert np.all(np.sum(result["total"], axis=0) > 0.9)
+	again = analysis.Calc_Sobol_Indices([8., 10.], samples=64, seed=0)
+	np.testing.assert_array_equal(again["total"], result["total"])
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from benchmark_rhoR import default_model_parameters
+from src.rhoR_Model import rhoR_Model, rhoR_Table
+
+QUERY_ENERGIES = np.array([6., 8., 10., 12.])  # (MeV)
+# Calc_rhoR at QUERY_ENERGIES for the default model of each ablator with the NumPy backend, from before the adaptive
+# stepping thru the ablated mass and the adaptive Rcm grid (commit b896599), as ρR and Rcm (g/cm^2 and cm)
+BASELINE = {
+	"CH": [(0.2918560550102236, 0.01269367560549845), (0.23660594787251005, 0.014183092978510572),
+	       (0.17301234017215883, 0.016831974381686755), (0.10317871658747524, 0.02280281527297729)],
+	"HDC": [(0.3392659957760596, 0.020034118758841743), (0.2761183122515512, 0.02242961378208385),
+	        (0.2031749428533274, 0.026687427873020548), (0.12305285538202244, 0.036206534197856716)],
+}
+# how far the stepping and the grid are allowed to move ρR and Rcm from that baseline: a few times what an
+# Eout_tolerance (0.01 MeV) error in the table does to them at these energies
+BASELINE_TOLERANCE = 2e-3
+
+
+@pytest.fixture(scope="module")
+def model():
+	return rhoR_Model(*default_model_parameters("CH"), backend="numpy", cache=False)
+
+
+@pytest.mark.parametrize("material", BASELINE.keys())
+def test_against_baseline(material):
+	model = rhoR_Model(*default_model_parameters(material), backend="numpy", cache=False)
+	rhoR, Rcm = model.Calc_rhoR(QUERY_ENERGIES)
+	np.testing.assert_allclose(rhoR, [rhoR for rhoR, Rcm in BASELINE[material]], rtol=BASELINE_TOLERANCE)
+	np.testing.assert_allclose(Rcm, [Rcm for rhoR, Rcm in BASELINE[material]], rtol=BASELINE_TOLERANCE)
+
+
+def test_adaptive_ablated_mass_stepping(model):
+	class TightModel(rhoR_Model):
+		abl_tolerance = 1e-6
+	tight = TightModel(*default_model_parameters("CH"), backend="numpy", cache=False, lazy=True)
+	Rcm = np.geomspace(model.__RcmList__[1], model.__RcmList__[-2], 12)
+	np.testing.assert_allclose(model.__precompute_Eout__(Rcm), tight.__precompute_Eout__(Rcm), rtol=0, atol=1e-2)
+
+
+def test_refined_grid_interpolates_to_tolerance(model):
+	Rcm = np.sqrt(model.__RcmList__[1:-2]*model.__RcmList__[2:-1])  # halfway between the table's points
+	direct = model.__precompute_Eout__(Rcm)
+	inside = direct > 0
+	np.testing.assert_allclose(model.Eout(Rcm[inside]), direct[inside], rtol=0, atol=model.Eout_tolerance)
+
+
+def test_table_inversion(model):
+	rhoR, Rcm = model.Calc_rhoR(QUERY_ENERGIES)
+	np.testing.assert_allclose(model.Eout(Rcm), QUERY_ENERGIES, rtol=0, atol=1e-3)
+	np.testing.assert_allclose(model.rhoR_Total(Rcm), rhoR, rtol=1e-3)
+
+
+def test_array_queries_match_scalar_ones(model):
+	rhoR, Rcm = model.Calc_rhoR(QUERY_ENERGIES)
+	for i, energy in enumerate(QUERY_ENERGIES):
+		assert model.Calc_rhoR(energy) == (rhoR[i], Rcm[i])
+
+
+def test_out_of_range(model):
+	assert np.all(np.isnan(model.Calc_rhoR(model.E0 + 1)))
+
+
+def test_lazy_model_agrees(model):
+	lazy = rhoR_Model(*default_model_parameters("CH"), backend="numpy", cache=False, lazy=True)
+	expected = model.Calc_rhoR(QUERY_ENERGIES)[0]
+	np.testing.assert_allclose([lazy.Calc_rhoR(energy)[0] for energy in QUERY_ENERGIES], expected, rtol=1e-3)
+
+
+def test_batch_model_agrees(model):
+	material, *parameters, E0 = default_model_parameters("CH")
+	batch = rhoR_Model(material, *(np.full(QUERY_ENERGIES.size, value) for value in parameters), E0,
+	                   backend="numpy", cache=False)
+	np.testing.assert_allclose(batch.Calc_rhoR(QUERY_ENERGIES)[0], model.Calc_rhoR(QUERY_ENERGIES)[0], rtol=1e-3)
+
+
+def test_frozen_model_agrees(model):
+	frozen = model.freeze()
+	assert isinstance(frozen, rhoR_Table)
+	np.testing.assert_array_equal(frozen.Calc_rhoR(QUERY_ENERGIES), model.Calc_rhoR(QUERY_ENERGIES))
+
+
+def test_disk_cache_round_trip():
+	built = rhoR_Model(*default_model_parameters("CH"), backend="numpy")
+	loaded = rhoR_Model(*default_model_parameters("CH"), backend="numpy")
+	np.testing.assert_array_equal(loaded.__EoutList__, built.__EoutList__)
+	np.testing.assert_array_equal(loaded.Calc_rhoR(QUERY_ENERGIES), built.Calc_rhoR(QUERY_ENERGIES))
+
+
+def test_shared_stages_are_bit_identical(model):
+	material, *parameters, E0 = default_model_parameters("CH")
+	parameters[7] *= 1.1  # Te_Abl, which leaves the gas and shell to share
+	alone = rhoR_Model(material, *parameters, E0, backend="numpy", cache=False)
+	sharing = rhoR_Model(material, *parameters, E0, backend="numpy", cache=False, lazy=True)
+	sharing.__stages__ = model.__stages__
+	sharing.__build_tables__()
+	np.testing.assert_array_equal(sharing.__EoutList__, alone.__EoutList__)
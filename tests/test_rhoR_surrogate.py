@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from src.rhoR_Analysis import rhoR_Analysis
+from src.rhoR_surrogate import rhoRSurrogate
+
+BOUNDS = {"E1": (6., 13.5), "P0": (20., 60.)}
+
+
+@pytest.fixture(scope="module")
+def surrogate():
+	return rhoRSurrogate.train("CH", BOUNDS, degree=3, backend="numpy", seed=0)
+
+
+def test_accuracy(surrogate):
+	assert surrogate.validation["max accepted error"] <= surrogate.tolerance
+	rhoR, error = surrogate.predict(10., P0=rhoR_Analysis.def_P0)
+	expected = rhoR_Analysis(backend="numpy", workers=1).Calc_rhoR(10.)[0]
+	assert rhoR == pytest.approx(expected, rel=max(error, 1e-3))
+
+
+def test_falls_back_outside_the_box(surrogate):
+	queries = surrogate.fallback_queries
+	rhoR, error = surrogate.predict(10., P0=80.)
+	assert error == np.inf
+	expected = rhoR_Analysis(P0=80., backend="numpy", workers=1).Calc_rhoR(10.)[0]
+	assert surrogate.Calc_rhoR(10., P0=80.) == pytest.approx(expected, rel=1e-3)
+	assert surrogate.fallback_queries == queries + 1
+
+
+def test_falls_back_when_a_fixed_parameter_changes(surrogate):
+	_, error = surrogate.predict(10., Te_Gas=2*rhoR_Analysis.def_Te_Gas)
+	assert error == np.inf
+
+
+def test_out_of_range_is_nan(surrogate):
+	assert np.isnan(surrogate.Calc_rhoR(surrogate.fixed["E0"] + 1.))
+
+
+def test_save_and_load(surrogate, tmp_path):
+	surrogate.save(str(tmp_path/"surrogate.npz"))
+	loaded = rhoRSurrogate.load(str(tmp_path/"surrogate.npz"))
+	assert (loaded.backend, loaded.dEdx_model) == ("numpy", "LP")
+	E1 = np.linspace(6., 13.5, 7)
+	np.testing.assert_array_equal(loaded.predict(E1, P0=30.), surrogate.predict(E1, P0=30.))
+
+
+@pytest.mark.parametrize("bounds", [
+	{"E1": (6., 13.5), "P0": (60., 20.)},  # backwards
+	{"E1": (6., 15.)},  # past E0
+	{"E1": (6., 13.5), "E0": (14., 15.)},  # not a model parameter
+])
+def test_invalid_boxes(bounds):
+	with pytest.raises(ValueError):
+		rhoRSurrogate.train("CH", bounds, backend="numpy")
+
+
+def test_unknown_parameter(surrogate):
+	with pytest.raises(ValueError):
+		surrogate.predict(10., P1=30.)
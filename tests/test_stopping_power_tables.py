@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy.integrate import quad, solve_ivp
+
+from src import stopping_power_tables
+
+STACK = [(31., "U"), (205., "Al")]
+ENERGIES = np.array([0.5, 2., 4., 8., 12., 16.])  # (MeV)
+
+
+def through_layers_by_ODE(energy, layers):
+	""" go back thru each layer by integrating dE/dx with a tight tolerance """
+	for thickness, material in reversed(layers):
+		solution = solve_ivp(lambda x, E: np.abs(stopping_power_tables.stopping_power(E, material)),
+		                     (0, thickness), [energy], rtol=1e-11, atol=1e-12, max_step=0.5)
+		energy = solution.y[0, -1]
+	return energy
+
+
+def test_unfold_layers_against_ODE():
+	energy, _ = stopping_power_tables.unfold_layers(ENERGIES, STACK)
+	expected = [through_layers_by_ODE(E, STACK) for E in ENERGIES]
+	np.testing.assert_allclose(energy, expected, rtol=0, atol=5e-6)
+
+
+def test_unfold_layers_derivative():
+	_, stretch = stopping_power_tables.unfold_layers(ENERGIES, STACK)
+	step = 1e-4
+	expected = (stopping_power_tables.unfold_layers(ENERGIES + step, STACK)[0] -
+	            stopping_power_tables.unfold_layers(ENERGIES - step, STACK)[0])/(2*step)
+	np.testing.assert_allclose(stretch, expected, rtol=1e-6)
+
+
+def test_unfold_layers_past_the_transfer_function():
+	# above STACK_ENERGY_RANGE it goes thru the layers directly instead
+	energy, _ = stopping_power_tables.unfold_layers(np.array([25.]), STACK)
+	np.testing.assert_allclose(energy, [through_layers_by_ODE(25., STACK)], rtol=0, atol=5e-6)
+
+
+def test_no_layers():
+	energy, stretch = stopping_power_tables.unfold_layers(ENERGIES, [])
+	np.testing.assert_array_equal(energy, ENERGIES)
+	np.testing.assert_array_equal(stretch, 1)
+
+
+@pytest.mark.parametrize("material", ["Al", "Au", "U"])
+def test_csda_range(material):
+	distance = stopping_power_tables.csda_range(np.array([5., 10.]), material)
+	expected, _ = quad(lambda E: 1/abs(stopping_power_tables.stopping_power(E, material)), 5., 10., limit=200)
+	assert distance[1] - distance[0] == pytest.approx(expected, rel=1e-6)
+	np.testing.assert_allclose(stopping_power_tables.energy_from_range(distance, material), [5., 10.], rtol=1e-9)
+
+
+def test_cache_is_bounded():
+	stopping_power_tables.clear_tables()
+	for thickness in range(stopping_power_tables.STACK_CACHE_SIZE + 5):
+		stopping_power_tables.unfold_layers(ENERGIES, [(thickness + 1., "Al")])
+	assert stopping_power_tables.stack_info()[0] == stopping_power_tables.STACK_CACHE_SIZE
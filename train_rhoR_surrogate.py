@@ -0,0 +1,61 @@
+import argparse
+
+from src.rhoR_surrogate import DEGREE, PARAMETERS, TOLERANCE, rhoRSurrogate
+
+
+def parse_assignment(text: str) -> tuple[str, str]:
+	""" split a NAME=VALUE argument """
+	if "=" not in text:
+		raise argparse.ArgumentTypeError(f"expected NAME=VALUE, not '{text}'")
+	name, value = text.split("=", 1)
+	return name.strip(), value.strip()
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		prog="python train_rhoR_surrogate.py",
+		description="train a surrogate of the ρR inference over a box of model parameters, for fast what-if studies, "
+		            "and save it to a file that src.rhoR_surrogate.rhoRSurrogate.load() can read.")
+	parser.add_argument("material", type=str,
+	                    help="the shell material, as in src.Material")
+	parser.add_argument("output", type=str,
+	                    help="the .npz file to save the surrogate to")
+	parser.add_argument("--vary", type=parse_assignment, action="append", default=[], metavar="NAME=LOW:HIGH",
+	                    help=f"a quantity to vary and its bounds, in rhoR_Model's units (cm, atm, keV, g/cc); must "
+	                         f"include the measured energy E1 (MeV), and may include any of {', '.join(PARAMETERS)}")
+	parser.add_argument("--fix", type=parse_assignment, action="append", default=[], metavar="NAME=VALUE",
+	                    help="a parameter (or E0) to hold at something other than the rhoR_Analysis default")
+	parser.add_argument("--degree", type=int, default=DEGREE,
+	                    help="the total degree of the polynomials")
+	parser.add_argument("--samples", type=int, default=None,
+	                    help="the number of training samples (by default three per polynomial term)")
+	parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+	                    help="the largest estimated relative error to accept before falling back to the full model")
+	parser.add_argument("--seed", type=int, default=None,
+	                    help="the random seed, for reproducibility")
+	parser.add_argument("--dEdx_model", type=str, default="LP",
+	                    help="the stopping power model ('LP', 'BPS', or 'Z'); only LP works with the NumPy backend")
+	parser.add_argument("--backend", type=str, default=None,
+	                    help="the stopping power backend ('SWIG' or 'numpy'); by default SWIG, which needs the StopPow "
+	                         "library.  the surrogate falls back to the same one, and the NumPy one trains much faster.")
+	args = parser.parse_args()
+
+	bounds = {}
+	for name, value in args.vary:
+		lower, upper = value.split(":")
+		bounds[name] = (float(lower), float(upper))
+	if "E1" not in bounds:
+		parser.error("you need to give the range of measured energies with --vary E1=LOW:HIGH")
+	fixed = {name: float(value) for name, value in args.fix}
+
+	surrogate = rhoRSurrogate.train(args.material, bounds, fixed, degree=args.degree, num_samples=args.samples,
+	                                tolerance=args.tolerance, seed=args.seed,
+	                                dEdx_model=args.dEdx_model, backend=args.backend)
+	for key, value in surrogate.validation.items():
+		print(f"{key:>22s}: {value:.4g}")
+	surrogate.save(args.output)
+	print(f"saved the surrogate to `{args.output}`")
+
+
+if __name__ == "__main__":
+	main()